@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+ColumnStore
+
+Converter of MIKE SHE gridded results (dfs3, e.g. 3DSZ head elevation, or
+dfs2) into a chunked, column oriented store for fast repeated extraction of
+time series at points (e.g. observation wells in WellStats).
+
+A dfs file is stored time-major: extracting the time series of ~2400 wells
+means reading every grid cell of every timestep. The column store holds the
+same values tiled in space, with all timesteps (and layers) of a grid cell
+contiguous, so that extraction only reads the cells that are needed:
+O(wells x times) instead of O(grid x times).
+
+Usage: ColumnStore.py <result file> [--items <item> ...] [--tile N] [--time-chunk N]
+Output: store folder <result file>.cols next to the result file, with
+    store.json              : metadata (source file fingerprint, time axis,
+                              cell centre coordinates, items, tile size)
+    <item>/t<ty>_<tx>.npy   : one NumPy file per item and tile of tile x tile
+                              cells, shape (cell in tile, time[, z]); read as
+                              memory map
+
+The store is local only and a plain copy of the values (same dtype). It is
+used (e.g. by WellStats) only as long as the result file is unchanged since
+it was converted (same path, and same size and modification time, or else
+same content hash; see file_fingerprint); otherwise it is ignored and has to
+be converted again.
+"""
+
+import sys, os, json, shutil, argparse, hashlib
+import numpy as np
+import pandas as pd
+
+import mikeio
+
+# increase when the layout of the store changes
+COLUMN_STORE_VERSION = 2
+
+
+def store_path(fp_res):
+    """
+    Path of the column store of result file fp_res
+    """
+    return f'{fp_res}.cols'
+
+
+def _item_dir(item):
+    # folder name of item in the store
+    return ''.join(c if c.isalnum() else '_' for c in item)
+
+
+def file_fingerprint(fp, with_hash=True):
+    """
+    Fingerprint of file fp: absolute path, size, modification time and 
+    (optionally) SHA-1 hash of the content
+    """
+    st = os.stat(fp)
+    fpr = {'path': os.path.abspath(fp), 'size': st.st_size, 'mtime': st.st_mtime_ns}
+    if with_hash:
+        sha1 = hashlib.sha1()
+        with open(fp, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha1.update(block)
+        fpr['sha1'] = sha1.hexdigest()
+    return fpr
+
+
+def file_unchanged(fp, fpr):
+    """
+    True if file fp still matches its fingerprint fpr (see file_fingerprint): 
+    same path, and same size and modification time, or else (touched or 
+    copied) same content hash
+    """
+    if not os.path.exists(fp):
+        return False
+    cur = file_fingerprint(fp, with_hash=False)
+    if cur['path'] != fpr['path']:
+        return False
+    if (cur['size'] != fpr['size']) | (cur['mtime'] != fpr['mtime']):
+        return file_fingerprint(fp)['sha1'] == fpr.get('sha1')
+    return True
+
+
+def convert(fp_res, items=None, tile=32, time_chunk=50):
+    """
+    Convert result file fp_res (dfs2 or dfs3) to a column store.
+
+    fp_res      path to result file
+    items       names of items to convert (default: all items)
+    tile        tile size in cells (tile x tile cells per tile file)
+    time_chunk  number of timesteps read from fp_res at once
+    Returns path to the store
+    """
+    dfs = mikeio.open(fp_res)
+    if items is None:
+        items = [it.name for it in dfs.items]
+    missing = [item for item in items if item not in [it.name for it in dfs.items]]
+    if len(missing) > 0:
+        raise ValueError(f'Items {missing} not in {fp_res}')
+    geometry = dfs.geometry
+    time = pd.DatetimeIndex(dfs.time)
+    nt = len(time); ny, nx = geometry.ny, geometry.nx
+    nty = int(np.ceil(ny / tile)); ntx = int(np.ceil(nx / tile))
+
+    fp_store = store_path(fp_res)
+    if os.path.exists(fp_store):
+        shutil.rmtree(fp_store)
+    os.makedirs(fp_store)
+
+    meta = {'version': COLUMN_STORE_VERSION, 'source': file_fingerprint(fp_res),
+            'time': [t.isoformat() for t in time], 'x': np.asarray(geometry.x).tolist(),
+            'y': np.asarray(geometry.y).tolist(), 'tile': tile, 'items': {}}
+    tiles = {}
+    for it_s in range(0, nt, time_chunk):
+        it_e = min(it_s + time_chunk, nt)
+        ds = mikeio.read(fp_res, items=items, time=list(range(it_s, it_e)))
+        for item in items:
+            data = ds[item].to_numpy()
+            if it_s == 0:
+                # one memory mapped file per tile: (cell in tile, time[, z])
+                zshape = data.shape[1:-2]
+                os.makedirs(os.path.join(fp_store, _item_dir(item)))
+                for ty in range(nty):
+                    for tx in range(ntx):
+                        ncell = (min((ty + 1) * tile, ny) - ty * tile) * (min((tx + 1) * tile, nx) - tx * tile)
+                        tiles[item, ty, tx] = np.lib.format.open_memmap(
+                            os.path.join(fp_store, _item_dir(item), f't{ty:03d}_{tx:03d}.npy'),
+                            mode='w+', dtype=data.dtype, shape=(ncell, nt) + zshape)
+                meta['items'][item] = {'dir': _item_dir(item), 'dtype': str(data.dtype), 'zshape': list(zshape)}
+            for ty in range(nty):
+                for tx in range(ntx):
+                    block = data[..., ty * tile:(ty + 1) * tile, tx * tile:(tx + 1) * tile]
+                    # (time[, z], y, x) -> (y * x, time[, z])
+                    block = block.reshape(block.shape[:-2] + (-1,))
+                    tiles[item, ty, tx][:, it_s:it_e] = np.moveaxis(block, -1, 0)
+        del ds
+    for mm in tiles.values():
+        mm.flush()
+    del tiles
+    # metadata last: a store without store.json (e.g. interrupted conversion) is not used
+    with open(os.path.join(fp_store, 'store.json'), 'w') as f:
+        json.dump(meta, f)
+    return fp_store
+
+
+class ColumnStore:
+    """
+    Column store of one item of a result file (see convert); opened with
+    open_store.
+
+    Attributes
+        time    time axis (DatetimeIndex)
+        x, y    cell centre coordinates
+        zshape  shape of layer axis: (nz,) for dfs3, () for dfs2
+    """
+
+    def __init__(self, fp_store, meta, item):
+        self.fp_store = fp_store
+        self.item = item
+        self.time = pd.DatetimeIndex(meta['time'])
+        self.x = np.array(meta['x']); self.y = np.array(meta['y'])
+        self.tile = meta['tile']
+        self.zshape = tuple(meta['items'][item]['zshape'])
+        self.dtype = np.dtype(meta['items'][item]['dtype'])
+        self._dir = os.path.join(fp_store, meta['items'][item]['dir'])
+        self._tiles = {}
+
+    def _tile(self, ty, tx):
+        # memory map of tile (opened once)
+        if (ty, tx) not in self._tiles:
+            self._tiles[ty, tx] = np.load(os.path.join(self._dir, f't{ty:03d}_{tx:03d}.npy'), mmap_mode='r')
+        return self._tiles[ty, tx]
+
+    def read_cells(self, iy, ix, it_s=0, it_e=None):
+        """
+        Read timesteps it_s to it_e (inclusive; default: last) of the cells
+        (iy, ix) as numpy array (time[, z], cell)
+        """
+        it_e = len(self.time) - 1 if it_e is None else it_e
+        iy = np.asarray(iy); ix = np.asarray(ix)
+        nx = len(self.x); tile = self.tile
+        out = np.empty((len(iy), it_e - it_s + 1) + self.zshape, dtype=self.dtype)
+        ty = iy // tile; tx = ix // tile
+        # cell within tile (tiles at the upper/right edge may be narrower)
+        tw = np.minimum((tx + 1) * tile, nx) - tx * tile
+        ic = (iy - ty * tile) * tw + (ix - tx * tile)
+        tid = ty * (nx // tile + 1) + tx
+        for t in np.unique(tid):
+            sel = np.flatnonzero(tid == t)
+            out[sel] = self._tile(ty[sel[0]], tx[sel[0]])[ic[sel], it_s:it_e + 1]
+        return np.moveaxis(out, 0, -1)
+
+    def extract_points(self, x, y, layer=None, names=None):
+        """
+        Time series in nearest cell of points x, y (and layer, 0: lowest
+        layer, for dfs3 items) as DataFrame (time x point); NaN for points
+        outside the grid
+        """
+        x = np.asarray(x, dtype=float); y = np.asarray(y, dtype=float)
+        # nearest cell centre (ties go to the upper one, as .sel(method='nearest'))
+        ix = len(self.x) - 1 - np.abs(self.x[None, ::-1] - x[:, None]).argmin(axis=1)
+        iy = len(self.y) - 1 - np.abs(self.y[None, ::-1] - y[:, None]).argmin(axis=1)
+        data = self.read_cells(iy, ix).astype(float)
+        if len(self.zshape) > 0:
+            if layer is None:
+                raise ValueError(f'layer is required for item {self.item} with layers')
+            data = data[:, np.asarray(layer), np.arange(len(x))]
+        half_x = (self.x[1] - self.x[0]) / 2 if len(self.x) > 1 else np.inf
+        half_y = (self.y[1] - self.y[0]) / 2 if len(self.y) > 1 else np.inf
+        outside = (np.abs(self.x[ix] - x) > half_x) | (np.abs(self.y[iy] - y) > half_y)
+        data[:, outside] = np.nan
+        return pd.DataFrame(data, index=self.time, columns=names)
+
+
+def open_store(fp_res, item):
+    """
+    Open the column store of item of result file fp_res.
+    Returns ColumnStore, or None if there is no store of the item or the
+    result file changed since it was converted
+    """
+    fp_meta = os.path.join(store_path(fp_res), 'store.json')
+    if not (os.path.exists(fp_meta) and os.path.exists(fp_res)):
+        return None
+    with open(fp_meta) as f:
+        meta = json.load(f)
+    if (meta.get('version') != COLUMN_STORE_VERSION) | (item not in meta['items']):
+        return None
+    if not file_unchanged(fp_res, meta['source']):
+        return None
+    return ColumnStore(store_path(fp_res), meta, item)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert MIKE SHE result file to column store')
+    parser.add_argument('result', help='result file (dfs2/dfs3)')
+    parser.add_argument('--items', nargs='+', default=None, help='items to convert (default: all)')
+    parser.add_argument('--tile', type=int, default=32, help='tile size in cells')
+    parser.add_argument('--time-chunk', type=int, default=50, help='timesteps read at once')
+    args = parser.parse_args()
+    if not os.path.exists(args.result):
+        sys.exit(f'ERROR: Result file {args.result} does not exist!')
+    fp_store = convert(args.result, items=args.items, tile=args.tile, time_chunk=args.time_chunk)
+    print(f'Column store written to {fp_store}')
+
+
+if __name__ == '__main__':
+    main()
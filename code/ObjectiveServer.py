@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+"""
+ObjectiveServer
+
+Local server of calibration objectives of MIKE SHE runs: groundwater head
+statistics (WellStats) and river discharge skill, for optimisers (e.g. PEST,
+SCE) that evaluate thousands of runs.
+
+Every call of WellStats.py pays Python start-up, the import of mikeio, xarray
+and pandas, and the loading of the observations and PreProcessed files before
+the result file is even opened. The server does all of this once and keeps the
+observations and grid metadata (the static context of WellStats, see
+load_static) and the discharge observations in memory. A run is evaluated by
+sending its result folder to the server, which returns head and discharge
+statistics in one response. Requests are evaluated in a pool of worker
+processes which each receive the static context once (as WellStats --batch),
+so concurrent requests (e.g. from parallel PEST agents) run in parallel.
+
+Usage (server): ObjectiveServer.py serve <WS_config.xml> [--port N | --socket PATH] [--workers N] [--root DIR]
+                                         [--q-obs <observed discharge dfs0>] [--q-mod <M11 dfs0 name>]
+    --port      localhost port to listen on (default 50617)
+    --socket    Unix socket to listen on instead (not on Windows), only
+                accessible by the user of the server (permissions 0600)
+    --root      directory the files of requests must be in (default: current
+                directory); relative paths of requests are relative to it
+    --workers   number of worker processes evaluating requests (default: 1)
+    --q-obs     dfs0 of observed discharge with items named by station ID
+                (e.g. Q_filtered.dfs0); without it, no discharge skill
+    --q-mod     file name of the detailed time series dfs0 of MIKE 11 in the
+                result folder (default: Skjern_500mDetailedTS_M11.dfs0), items
+                named by station ID (see tools.read_m11_stations)
+Usage (client): ObjectiveServer.py query <result folder> [--port N | --socket PATH] [--write] [--out <file.json>]
+                ObjectiveServer.py shutdown [--port N | --socket PATH]
+All commands take --token-file FILE (default: ~/.objective_server_token).
+    --write     also write the WellStats text files, next to the result file
+                (as WellStats --batch)
+    --out       write the response to this file (default: print it)
+The client only imports the standard library, so it starts fast; from Python,
+use query() directly.
+
+Access: every request must carry the token of the server, shared through the
+environment variable OBJECTIVE_SERVER_TOKEN or, if that is not set, a token the
+server generates at start and writes to the token file (permissions 0600, so
+only readable by its user; servers running at the same time need their own
+token file). Files of requests (folder, result_file, dts_file, m11_file) must
+be in the root directory of the server, also through links, so write=true
+only writes there.
+
+The result file (and DetailedTSFile, if configured and present) of a result
+folder is the file of the same name as ResultFile (DetailedTSFile) in the
+config. Incremental in the config is not used: every request extracts all
+observations (concurrent requests would share one incremental state).
+
+Protocol: one JSON object per line over the connection, one response line
+per request line (a connection may send any number of requests):
+    {"cmd": "evaluate", "token": "<token>", "folder": "<result folder>"}    (optional:
+        "result_file", "dts_file", "m11_file" instead of the files in the folder, "write": true)
+    {"cmd": "ping", "token": "<token>"}
+    {"cmd": "shutdown", "token": "<token>"}
+Response of evaluate:
+    {"status": "ok",
+     "head": {"all":    {"RMSE_wells", "RMSE_obs", "ME_wells", "ME_obs", "nwells", "nobs"},
+              "layers": {<layer>: {same as all}}  (head statistics only, else null),
+              "wells":  {<well ID>: {"RMSE", "ME", "nobs"}},
+              "warnings": [...]},
+     "discharge": {<station ID>: {"n", "kge", "cc", "nse", "rmse", "bias"}}  (null without --q-obs),
+     "elapsed_s": <seconds>}
+or {"status": "error", "error": "<message>"}. Missing values are null.
+"""
+
+import sys, os, json, time, socket, socketserver, threading, argparse, secrets, hmac
+from concurrent.futures import ProcessPoolExecutor
+
+DEFAULT_PORT = 50617
+DEFAULT_Q_MOD = 'Skjern_500mDetailedTS_M11.dfs0'
+DEFAULT_TOKEN_FILE = os.path.join(os.path.expanduser('~'), '.objective_server_token')
+TOKEN_ENV = 'OBJECTIVE_SERVER_TOKEN'
+# files of an evaluate request, which must be in the root directory of the server
+REQUEST_PATHS = ['folder', 'result_file', 'dts_file', 'm11_file']
+
+# objective context in the server and its worker processes (set once per process by _init_worker)
+_context = None
+
+
+def load_context(fp_config, fp_qobs=None, q_mod=DEFAULT_Q_MOD):
+    """
+    Load the static context of WellStats for config fp_config, and the observed
+    discharge fp_qobs (optional)
+    """
+    # imported here, so that the client does not pay for them
+    import mikeio
+    from WellStats import WellStats
+    ws = WellStats(fp_config)
+    q_obs = None
+    if fp_qobs is not None:
+        q_obs = mikeio.read(fp_qobs).to_dataframe()
+    return {'static': ws.static, 'q_obs': q_obs, 'q_mod': q_mod}
+
+
+def _init_worker(context):
+    global _context
+    _context = context
+
+
+def server_token(fp_token=DEFAULT_TOKEN_FILE):
+    """
+    Token of the server: OBJECTIVE_SERVER_TOKEN if set, else a new token written
+    to fp_token, only readable by the user
+    """
+    token = os.environ.get(TOKEN_ENV)
+    if token:
+        return token
+    token = secrets.token_urlsafe(32)
+    if os.path.exists(fp_token):
+        os.remove(fp_token) # created again below, with permissions 0600
+    with os.fdopen(os.open(fp_token, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'w') as f:
+        f.write(token)
+    return token
+
+
+def client_token(fp_token=DEFAULT_TOKEN_FILE):
+    """
+    Token of the client: OBJECTIVE_SERVER_TOKEN if set, else the token file
+    fp_token of the server
+    """
+    token = os.environ.get(TOKEN_ENV)
+    if token:
+        return token
+    with open(fp_token) as f:
+        return f.read().strip()
+
+
+def root_path(root, path):
+    """
+    Real path of path (relative to directory root) of a request, which must be
+    in root: no '..', absolute path or link out of it
+    """
+    root = os.path.realpath(root)
+    fp = os.path.realpath(os.path.join(root, str(path)))
+    try:
+        inside = os.path.commonpath([root, fp]) == root
+    except ValueError: # e.g. other drive
+        inside = False
+    if not inside:
+        raise ValueError(f'{path} is not in the root directory of the server')
+    return fp
+
+
+def _records(df):
+    # DataFrame as dictionary of rows, NaN as None
+    return None if df is None else json.loads(df.to_json(orient='index'))
+
+
+def evaluate(folder=None, result_file=None, dts_file=None, m11_file=None, write=False):
+    """
+    Head statistics (WellStats) and discharge skill of the run in result
+    folder folder (see header for the files used, and the response)
+    """
+    import numpy as np
+    import pandas as pd
+    import WellStats as WS
+    import tools
+    t_start = time.time()
+    static = _context['static']; conf = static['conf']
+    fp_res = result_file; fp_dts = dts_file; fp_m11 = m11_file
+    if folder is not None:
+        if fp_res is None and conf.get('ResultFile') is not None:
+            fp_res = os.path.join(folder, os.path.basename(conf['ResultFile']))
+        if fp_dts is None and conf.get('DetailedTSFile') is not None:
+            fp_dts = os.path.join(folder, os.path.basename(conf['DetailedTSFile']))
+            fp_dts = fp_dts if os.path.exists(fp_dts) else None
+        if fp_m11 is None:
+            fp_m11 = os.path.join(folder, _context['q_mod'])
+    if fp_res is None:
+        raise ValueError('No result file: give folder (with ResultFile in config) or result_file')
+    if not os.path.exists(fp_res):
+        raise ValueError(f'Result file {fp_res} does not exist')
+
+    out_obs, out_well, out_lay, out_warn = WS.run_result(static, fp_res, fp_dts)
+    if write:
+        fp_obsin = conf['ObservationFile']
+        fp_stump = os.path.join(os.path.dirname(os.path.abspath(fp_res)),
+                                f'{os.path.splitext(os.path.basename(fp_obsin))[0]}_{os.path.splitext(os.path.basename(fp_res))[0]}')
+        out_groups = WS.group_tables(out_obs, conf['Groupings'], static['itop'], conf['DepthClasses'])
+        WS.write_output(fp_stump, os.path.splitext(fp_obsin)[1], out_obs, out_well, out_lay, out_warn, out_groups)
+    out_sum = WS.summary_stats(out_obs, out_well, out_lay)
+    wells = pd.DataFrame({'RMSE': np.sqrt(out_well['MSE']), 'ME': out_well['ME'], 'nobs': out_well['nobs']})
+    head = {'all': _records(out_sum.loc[['all']])['all'], 'layers': _records(out_lay),
+            'wells': _records(wells), 'warnings': list(out_warn)}
+
+    discharge = None
+    if _context['q_obs'] is not None:
+        if fp_m11 is None or not os.path.exists(fp_m11):
+            raise ValueError(f'Detailed time series file of MIKE 11 {fp_m11} does not exist')
+        q_obs = _context['q_obs']
+        q_mod = tools.read_m11_stations(fp_m11, list(q_obs.columns))
+        discharge = _records(tools.skill_table(q_obs, q_mod))
+    return {'head': head, 'discharge': discharge, 'elapsed_s': time.time() - t_start}
+
+
+class ObjectiveHandler(socketserver.StreamRequestHandler):
+    """
+    Connection to the server: one JSON request per line, one JSON response
+    line each
+    """
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError('Request must be a JSON object')
+                if not hmac.compare_digest(str(request.pop('token', '')).encode(), self.server.token.encode()):
+                    raise PermissionError('Missing or wrong token')
+                cmd = request.pop('cmd', 'evaluate')
+                if cmd == 'ping':
+                    response = {'status': 'ok'}
+                elif cmd == 'shutdown':
+                    response = {'status': 'ok'}
+                    threading.Thread(target=self.server.shutdown).start()
+                elif cmd == 'evaluate':
+                    response = {'status': 'ok', **self.server.evaluate(request)}
+                else:
+                    raise ValueError(f"Unknown cmd '{cmd}'")
+            except Exception as e:
+                response = {'status': 'error', 'error': f'{type(e).__name__}: {e}'}
+            self.wfile.write((json.dumps(response) + '\n').encode())
+            self.wfile.flush()
+
+
+class _Evaluator:
+    # evaluation of requests, in the pool of worker processes or (workers 1)
+    # one at a time in the server process
+
+    def evaluate(self, request):
+        for key in REQUEST_PATHS:
+            if request.get(key) is not None:
+                request[key] = root_path(self.root, request[key])
+        if self.pool is not None:
+            return self.pool.submit(evaluate, **request).result()
+        with self.lock:
+            return evaluate(**request)
+
+
+class ObjectiveTCPServer(_Evaluator, socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+if hasattr(socketserver, 'ThreadingUnixStreamServer'):
+    class ObjectiveUnixServer(_Evaluator, socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+
+def make_server(context, token, port=DEFAULT_PORT, socket_path=None, workers=1, root='.'):
+    """
+    Server of requests (see header) on localhost port (port 0: any free port,
+    see server_address) or Unix socket socket_path, accepting requests with
+    token and files in directory root, evaluated with context (see
+    load_context) in workers worker processes
+    """
+    if socket_path is not None:
+        if not hasattr(socketserver, 'ThreadingUnixStreamServer'):
+            raise ValueError('Unix sockets are not available on this platform, use a port')
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = ObjectiveUnixServer(socket_path, ObjectiveHandler)
+        os.chmod(socket_path, 0o600)
+    else:
+        server = ObjectiveTCPServer(('127.0.0.1', port), ObjectiveHandler)
+    server.token = token
+    server.root = os.path.realpath(root)
+    server.lock = threading.Lock()
+    server.pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(context,)) if workers > 1 else None
+    _init_worker(context)
+    return server
+
+
+def serve(context, token, port=DEFAULT_PORT, socket_path=None, workers=1, root='.'):
+    """
+    Serve requests until a shutdown request (see make_server)
+    """
+    server = make_server(context, token, port=port, socket_path=socket_path, workers=workers, root=root)
+    address = socket_path if socket_path is not None else f'127.0.0.1:{server.server_address[1]}'
+    print(f'ObjectiveServer listening on {address} with {workers} worker(s), root directory {server.root}', flush=True)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if server.pool is not None:
+            server.pool.shutdown()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+def query(request, port=DEFAULT_PORT, socket_path=None, timeout=None, token=None):
+    """
+    Send request (dictionary, see header) to the server on localhost port
+    (or Unix socket socket_path), and return its response (dictionary);
+    with token (default: see client_token) if the request has none
+    """
+    if 'token' not in request:
+        request = dict(request, token=client_token() if token is None else token)
+    if socket_path is not None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+    else:
+        sock = socket.create_connection(('127.0.0.1', port), timeout=timeout)
+    with sock, sock.makefile('rb') as f:
+        sock.sendall((json.dumps(request) + '\n').encode())
+        line = f.readline()
+    if not line:
+        raise ConnectionError('No response from ObjectiveServer')
+    return json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local server of calibration objectives (WellStats and discharge skill)')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_serve = sub.add_parser('serve', help='load observations and serve requests')
+    p_serve.add_argument('config', help='WS_config.xml file')
+    p_serve.add_argument('--workers', type=int, default=1, help='number of worker processes (default: 1)')
+    p_serve.add_argument('--root', default='.', help='directory the files of requests must be in (default: current directory)')
+    p_serve.add_argument('--q-obs', default=None, help='dfs0 of observed discharge, items named by station ID')
+    p_serve.add_argument('--q-mod', default=DEFAULT_Q_MOD, help=f'name of MIKE 11 detailed time series dfs0 in result folders (default: {DEFAULT_Q_MOD})')
+    p_query = sub.add_parser('query', help='evaluate a result folder')
+    p_query.add_argument('folder', help='result folder')
+    p_query.add_argument('--write', action='store_true', help='also write the WellStats text files next to the result file')
+    p_query.add_argument('--out', default=None, help='write response to this file (default: print)')
+    p_stop = sub.add_parser('shutdown', help='stop the server')
+    for p in [p_serve, p_query, p_stop]:
+        p.add_argument('--port', type=int, default=DEFAULT_PORT, help=f'localhost port (default: {DEFAULT_PORT})')
+        p.add_argument('--socket', default=None, help='Unix socket instead of port')
+        p.add_argument('--token-file', default=DEFAULT_TOKEN_FILE, help=f'token file, if {TOKEN_ENV} is not set (default: {DEFAULT_TOKEN_FILE})')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        if not os.path.exists(args.config):
+            sys.exit(f'ERROR: Config file {args.config} does not exist!')
+        if args.q_obs is not None and not os.path.exists(args.q_obs):
+            sys.exit(f'ERROR: Discharge observation file {args.q_obs} does not exist!')
+        if not os.path.isdir(args.root):
+            sys.exit(f'ERROR: Root directory {args.root} does not exist!')
+        context = load_context(args.config, args.q_obs, args.q_mod)
+        serve(context, server_token(args.token_file), port=args.port, socket_path=args.socket, workers=args.workers, root=args.root)
+        return
+    request = {'cmd': 'shutdown'} if args.command == 'shutdown' else \
+              {'cmd': 'evaluate', 'folder': os.path.abspath(args.folder), 'write': args.write}
+    try:
+        token = client_token(args.token_file)
+    except OSError as e:
+        sys.exit(f'ERROR: No token ({TOKEN_ENV} or token file): {e}')
+    try:
+        response = query(request, port=args.port, socket_path=args.socket, token=token)
+    except OSError as e:
+        sys.exit(f'ERROR: No ObjectiveServer at {args.socket or args.port}: {e}')
+    if response['status'] != 'ok':
+        sys.exit(f"ERROR: {response['error']}")
+    if args.command == 'query':
+        if args.out is not None:
+            with open(args.out, 'w') as f:
+                json.dump(response, f, indent=1)
+        else:
+            print(json.dumps(response, indent=1))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""
+WaterBalance
+
+Water balance analytics over the output of the MIKE Zero Water Balance Tool
+(e.g. output_sample/waterbalance_output):
+    wb_accumulated.dfs0         total water balance, accumulated
+    wb_incremental.dfs0         total water balance, per timestep
+    wb_SZ_incremental.dfs0      saturated zone water balance, per timestep
+    wb_UZ_incremental.dfs0      unsaturated zone water balance, per timestep
+    wb_component_error.dfs0     balance error per component, per timestep
+
+All dfs0 files of a folder are loaded once (load) into a columnar cache: per
+file the time axis, the item names and one (time, item) array. The cache is
+kept in memory per folder and on disk as wb_cache.npz in the folder, and only
+files that are new or changed (size, modification time) since are read again.
+Analytics (closure errors, period sums, component groups) and plots work on
+the cached arrays instead of re-reading the dfs0 files.
+
+Sign convention (MIKE SHE): inflows are negative, outflows and storage
+increase positive, so the Error item of a balance is the sum of all its other
+items (the closure residual). Values are storage depths [mm].
+
+Usage (library):
+    import WaterBalance
+    wb = WaterBalance.load(r'..\\output_sample\\waterbalance_output')
+    wb.closure()                                # closure errors per timestep
+    wb.period_sums('wb_incremental', 'hydro_year')
+    wb.group_components('wb_incremental', freq='year')
+    wb.plot('wb_incremental', 'Water Balance Incremental', varlist=['Baseflow to river'])
+"""
+
+import os, json
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+
+import mikeio
+
+# increase when the layout of the cache changes
+WB_CACHE_VERSION = 1
+WB_CACHE_FILE = 'wb_cache.npz'
+
+# balances with closure error: water balance file, and column of wb_component_error
+BALANCES = {'total': ('wb_incremental', 'TOTAL ERROR'),
+            'SZ': ('wb_SZ_incremental', 'SZ ERROR'),
+            'UZ': ('wb_UZ_incremental', 'UZ ERROR')}
+
+# default groups of the items of the total water balance (see group_components)
+COMPONENT_GROUPS = {
+    'Precipitation': ['Precip'],
+    'Irrigation': ['Irrigation'],
+    'Evapotranspiration': ['Evapotrans'],
+    'Storage change': ['Canopy Stor. Change', 'Snow Stor.Change', 'OL Stor.Change', 'OL Drain Stor. Change',
+                       'SubSurf.Stor.Change'],
+    'Boundary flow': ['OL Bou.Inflow', 'OL Bou.Outflow', 'SubSurf.Bou.Inflow', 'SubSurf.Bou.Outflow',
+                      'SZ Drain Inflow', 'SZ Drain Outflow'],
+    'Overland flow to river': ['OL->River/MOUSE', 'OL Drain->River/MOUSE'],
+    'Drain flow to river': ['SZ Drain->River', 'SZ Drain->Ext.River'],
+    'Baseflow': ['Baseflow to river', 'Baseflow from river'],
+    'Pumping and sinks': ['Pumping', 'OL->Ext.Sinks', 'SubSurf->Ext.Sinks'],
+    'Error': ['Error'],
+}
+
+# loaded folders: absolute path -> (fingerprints, WaterBalance)
+_loaded = {}
+
+
+def _fingerprints(folder):
+    # size and modification time of the dfs0 files of folder, by name (file name without extension)
+    fps = {}
+    for fn in sorted(os.listdir(folder)):
+        if fn.lower().endswith('.dfs0'):
+            st = os.stat(os.path.join(folder, fn))
+            fps[os.path.splitext(fn)[0]] = [fn, st.st_size, st.st_mtime_ns]
+    return fps
+
+
+def _read_dfs0(fp):
+    # time (datetime64[ns]), item names and (time, item) values of a dfs0 file
+    ds = mikeio.read(fp)
+    values = np.stack([da.to_numpy() for da in ds], axis=1) if len(ds.items) > 0 else np.zeros((len(ds.time), 0))
+    return np.asarray(pd.DatetimeIndex(ds.time), dtype='datetime64[ns]'), [it.name for it in ds.items], values
+
+
+class WaterBalance:
+    """
+    Water balance files of a folder, loaded once (see load).
+
+    Attributes
+        folder  folder of the water balance files
+        names   names of the files (file name without extension, e.g. 'wb_incremental')
+    """
+
+    def __init__(self, folder, data):
+        self.folder = folder
+        self._data = data # name -> (time, items, values)
+
+    @property
+    def names(self):
+        return list(self._data)
+
+    def _get(self, name):
+        name = os.path.splitext(os.path.basename(name))[0]
+        if name not in self._data:
+            raise ValueError(f"No water balance file '{name}' in {self.folder}")
+        return self._data[name]
+
+    def frame(self, name, items=None):
+        """
+        Values of file name (e.g. 'wb_incremental') as DataFrame (time x item),
+        optionally of items only
+        """
+        time, names, values = self._get(name)
+        df = pd.DataFrame(values, index=pd.DatetimeIndex(time), columns=names)
+        return df if items is None else df[items]
+
+    def increments(self, name, items=None):
+        """
+        Values per timestep of file name: differences of accumulated files
+        (name containing 'accumulated'), else the values as they are
+        """
+        df = self.frame(name, items)
+        if 'accumulated' in os.path.basename(name).lower():
+            df = df.diff().fillna(df.iloc[:1])
+        return df
+
+    def closure(self, cumulative=False):
+        """
+        Closure errors per timestep (accumulated over time if cumulative) of
+        the total, SZ and UZ balances (those of the files present), with
+        columns (balance, quantity):
+            residual        sum of all items except Error (inflows negative)
+            error           Error item of the balance file
+            component_error error of the balance in wb_component_error
+            difference      residual - component_error
+            relative        residual / total inflow of the timestep
+        """
+        comp = self.frame('wb_component_error') if 'wb_component_error' in self._data else None
+        out = {}
+        for balance, (name, comp_col) in BALANCES.items():
+            if name not in self._data:
+                continue
+            df = self.increments(name)
+            parts = df.drop(columns=[col for col in ['Error'] if col in df.columns])
+            res = pd.DataFrame({'residual': parts.sum(axis=1),
+                                'error': df['Error'] if 'Error' in df.columns else np.nan,
+                                'inflow': -parts.clip(upper=0).sum(axis=1)}, index=df.index)
+            if comp is not None and comp_col in comp.columns:
+                res['component_error'] = comp[comp_col].reindex(df.index)
+            else:
+                res['component_error'] = np.nan
+            if cumulative:
+                res = res.cumsum()
+            res['difference'] = res['residual'] - res['component_error']
+            with np.errstate(invalid='ignore', divide='ignore'):
+                res['relative'] = res['residual'] / res['inflow']
+            out[balance] = res[['residual', 'error', 'component_error', 'difference', 'relative']]
+        if len(out) == 0:
+            raise ValueError(f'No water balance files with closure ({[n for n, _ in BALANCES.values()]}) in {self.folder}')
+        return pd.concat(out, axis=1, names=['balance', 'quantity'])
+
+    def period_sums(self, name, freq='year', items=None, hydro_year_start=10):
+        """
+        Sums per period of the values per timestep of file name (see
+        increments), with the value of a timestep assigned to the period of
+        its (end) time.
+
+        freq                'month', 'year', 'hydro_year' (labelled by the
+                            calendar year it ends in) or None (whole period)
+        hydro_year_start    first month of the hydrological year (default 10: October)
+        """
+        df = self.increments(name, items)
+        time = pd.DatetimeIndex(df.index)
+        if freq == 'month':
+            labels = time.to_period('M')
+        elif freq == 'year':
+            labels = time.year
+        elif freq == 'hydro_year':
+            labels = time.year + (time.month >= hydro_year_start) * (hydro_year_start > 1)
+        elif freq is None:
+            return df.sum().to_frame('total').T
+        else:
+            raise ValueError(f"Unknown freq '{freq}', must be 'month', 'year', 'hydro_year' or None")
+        codes, periods = pd.factorize(labels, sort=True)
+        sums = np.zeros((len(periods), df.shape[1]))
+        np.add.at(sums, codes, df.to_numpy())
+        return pd.DataFrame(sums, index=pd.Index(periods, name=freq), columns=df.columns)
+
+    def group_components(self, name='wb_incremental', groups=None, freq=None, hydro_year_start=10):
+        """
+        Values per timestep of file name summed to groups of items (default
+        COMPONENT_GROUPS), items in no group as 'Other'; per period if freq
+        is given (see period_sums)
+        """
+        groups = COMPONENT_GROUPS if groups is None else groups
+        df = self.increments(name) if freq is None else self.period_sums(name, freq, hydro_year_start=hydro_year_start)
+        columns = [group for group, items in groups.items() if any(item in df.columns for item in items)]
+        membership = np.zeros((df.shape[1], len(columns)))
+        for ig, group in enumerate(columns):
+            membership[[item in groups[group] for item in df.columns], ig] = 1
+        other = membership.sum(axis=1) == 0
+        if other.any():
+            membership = np.column_stack([membership, other.astype(float)])
+            columns = columns + ['Other']
+        return pd.DataFrame(df.to_numpy() @ membership, index=df.index, columns=columns)
+
+    def plot(self, name, title=None, varlist=None, ax=None):
+        """
+        Plot the items (or varlist) of file name over time
+        """
+        df = self.frame(name, varlist)
+        if ax is None:
+            fig, ax = plt.subplots(figsize=(12, 6))
+        df.plot(ax=ax, fontsize=15).legend(loc='center', bbox_to_anchor=(1.15, 0.4))
+        ax.set_ylabel('Storage Depth [mm]', fontsize=15)
+        ax.set_title(name if title is None else title, fontsize=20)
+        return ax
+
+
+def _read_cache(fp_cache):
+    # cached files: name -> (fingerprint, (time, items, values))
+    try:
+        with np.load(fp_cache, allow_pickle=False) as npz:
+            manifest = json.loads(str(npz['manifest']))
+            if manifest.get('version') != WB_CACHE_VERSION:
+                return {}
+            return {name: (fpr, (npz[f'{i}_time'], [str(item) for item in npz[f'{i}_items']], npz[f'{i}_values']))
+                    for i, (name, fpr) in enumerate(manifest['files'].items())}
+    except (OSError, KeyError, ValueError):
+        return {}
+
+
+def _write_cache(fp_cache, fingerprints, data):
+    arrays = {'manifest': np.array(json.dumps({'version': WB_CACHE_VERSION, 'files': fingerprints}))}
+    for i, name in enumerate(fingerprints):
+        time, items, values = data[name]
+        arrays[f'{i}_time'] = time
+        arrays[f'{i}_items'] = np.array(items, dtype=str)
+        arrays[f'{i}_values'] = values
+    try:
+        np.savez(fp_cache, **arrays)
+    except OSError:
+        pass # e.g. read-only folder: only cached in memory
+
+
+def load(folder, use_cache=True):
+    """
+    Load all water balance dfs0 files of folder (see header).
+    use_cache   use (and write) the cache wb_cache.npz in folder
+    Returns WaterBalance
+    """
+    folder = os.path.abspath(folder)
+    if not os.path.isdir(folder):
+        raise ValueError(f'Water balance folder {folder} does not exist')
+    fingerprints = _fingerprints(folder)
+    if use_cache and folder in _loaded and _loaded[folder][0] == fingerprints:
+        return _loaded[folder][1]
+    fp_cache = os.path.join(folder, WB_CACHE_FILE)
+    cached = _read_cache(fp_cache) if use_cache and os.path.exists(fp_cache) else {}
+    data = {}; changed = set(cached) != set(fingerprints)
+    for name, fpr in fingerprints.items():
+        if name in cached and cached[name][0] == fpr:
+            data[name] = cached[name][1]
+        else:
+            data[name] = _read_dfs0(os.path.join(folder, fpr[0]))
+            changed = True
+    wb = WaterBalance(folder, data)
+    if use_cache:
+        if changed:
+            _write_cache(fp_cache, fingerprints, data)
+        _loaded[folder] = (fingerprints, wb)
+    return wb
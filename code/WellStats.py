@@ -10,13 +10,24 @@ Detailed documentation: http://geuswikihydro.geus.dk/w/index.php/Groundwater_lev
 
 NOTE: Requires mikeio v2.0.0 or above!
 
-Usage: WellStats.py <WS_config.xml>
-Output: groundwater statistics in 
+Usage: WellStats.py <WS_config.xml> [--no-cache] [--profile] [--incremental]
+Output: groundwater statistics in
     _observations.txt   : results per individual observation
     _wells.txt          : results per well
     _layers.txt         : results per layer
     _warnings.txt       : warnings (e.g. bottom below model)
-    
+    _<grouping>.txt     : results per group of each of Groupings (optional)
+
+Library usage (in memory, without text files; see class WellStats):
+    from WellStats import WellStats
+    ws = WellStats('WS_config.xml')   # or dictionary of configuration values
+    out_obs, out_well, out_lay, out_warn = ws.run(<result file>)
+
+Batch usage: WellStats.py <WS_config.xml> --batch <result files or globs> [--workers N]
+Output: per result file next to the result file, as
+    <observation file name>_<result name>_observations.txt etc.
+    and _batch_summary.txt next to the observation file (see run_batch)
+
 WS_config.xml is a xml file of following format
     <?xml version="1.0"?>
     <Configuration xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xmlns:xsd="http://www.w3.org/2001/XMLSchema">
@@ -27,6 +38,21 @@ WS_config.xml is a xml file of following format
       <HeadItemText>['head elevation in saturated zone' or 'depth to <top/bottom> phreatic surface (negative)']</HeadItemText>
       <PhreaticUseLayerBelow>[true/false]</PhreaticUseLayerBelow>
        <EpsilonForPhreatic>[threshold to determine dry layer]</EpsilonForPhreatic>
+       <TimeChunkSize>[optional: number of result timesteps read at once; 0 or missing: read all]</TimeChunkSize>
+       <StaticCache>[optional: true/false (default true) - cache metadata of observations and PreProcessed files]</StaticCache>
+       <ColumnStore>[optional: true/false (default true) - read from column store of result file, if converted]</ColumnStore>
+       <DetailedTSFile>[optional, head statistics only: path to detailed time series file (e.g. DetailedTS_SZ.dfs0) with head elevation items named by well ID, used instead of the result file for these wells - values of the well's cell, interpolated in time only and without dry layer check]</DetailedTSFile>
+       <Profile>[optional: true/false (default false) - write time and memory profile per stage (as --profile)]</Profile>
+       <Groupings>[optional: comma separated groupings for extra statistics tables, of layer, season, year, month, boundary, depth; combined with '+', e.g. layer,season,layer+year]</Groupings>
+       <DepthClasses>[optional: comma separated filter depth class limits [m] for grouping depth (default 0,5,10,20,50,100)]</DepthClasses>
+       <Incremental>[optional: true/false (default false) - only extract new or changed observations (as --incremental)]</Incremental>
+       <Dask>[optional: sample the result file in dask worker processes, each task re-reading its time window with mikeio (not a lazy xarray/dask array) (requires dask)]
+         <Workers>[number of worker processes (default: number of cores)]</Workers>
+         <TimeChunkSize>[timesteps per task (default: TimeChunkSize, or 50)]</TimeChunkSize>
+         <Scheduler>[processes (default) or distributed (requires dask.distributed)]</Scheduler>
+         <MemoryLimit>[distributed only: memory per worker, e.g. 4GB (default: auto)]</MemoryLimit>
+         <LocalDirectory>[distributed only: folder workers spill to when reaching MemoryLimit]</LocalDirectory>
+       </Dask>
     </Configuration>
 
 WS input observation file is of format (same as LS_input):
@@ -53,7 +79,9 @@ but just use nearest
 Raphael Schneider, rs@geus.dk, Sep 2024
 """
 
-import sys, os, gc
+import sys, os, gc, glob, argparse, json, time, tracemalloc
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
 import xml.etree.ElementTree as ET
 import numpy as np
@@ -61,51 +89,517 @@ import pandas as pd
 import xarray as xr
 
 import mikeio
+import ColumnStore
+from ColumnStore import file_fingerprint, file_unchanged
 import warnings
+try:
+    import resource #peak RSS for profiling (not available on Windows)
+except ImportError:
+    resource = None
+try:
+    import dask #optional dask backend (Dask section in config)
+except ImportError:
+    dask = None
 # ignore unnecessary mikeio warning
 warnings.filterwarnings('ignore', message='Time step is 0.0 seconds. This must be a positive number. Setting to 1 second.')
 
+# increase when the content of the static metadata cache changes
+STATIC_CACHE_VERSION = 1
+# increase when the content of the incremental state changes
+INCREMENTAL_VERSION = 1
 
-def main():
-    #%% STEP 0: command line handling - could be extended (getopt?). Or: handle everything in WS_config.xml
-    if len(sys.argv) != 2:
-        sys.exit('Usage: WellStats.py <WS_config.xml>')
-    fp_config = sys.argv[1]
-    # IF TESTING FROM IDE
-    # fp_config=r'\\geodata.geus.dk\Dkmodel-hydro\Hdata\jup_pej2024\WSinput\obs_DKMNret500m_comparison\DK1_2024_conf.xml'
-    # fp_config = r'\\geodata.geus.dk\DKmodel_users\FloodWarning\GWH_emulator\ed-LSTM\GWH_obs\WSInput\DK1_2024_conf_dtp.xml'
+
+class Profiler:
+    """
+    Optional profiling of WellStats: wall time, CPU time and peak memory 
+    (tracemalloc, and peak RSS of the process where available) per stage. 
+    Stages are marked with start/stop or the stage context manager and can 
+    be nested (sub-steps); repeated stages (e.g. per time window) are summed, 
+    with the number of calls. Does nothing unless enabled.
+    Tracing memory slows WellStats down, so timings are only comparable 
+    between profiled runs.
+    """
     
+    def __init__(self):
+        self.enabled = False
+        self.reset()
     
-    #%% STEP 1: Load everything
+    def enable(self, trace_memory=True):
+        """
+        Enable profiling; with trace_memory, peak memory is traced with 
+        tracemalloc (slower)
+        """
+        self.enabled = True
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self.reset()
+    
+    def reset(self, stages=None):
+        """
+        Clear the profile, or set it back to stages (e.g. a copy of 
+        self.stages taken before)
+        """
+        self.stages = {} if stages is None else {path: dict(rec) for path, rec in stages.items()} #path -> record, in order of first start
+        self._stack = []
+    
+    def start(self, name):
+        if not self.enabled:
+            return
+        if tracemalloc.is_tracing():
+            # keep peak of enclosing stage before resetting the peak for this one
+            if len(self._stack) > 0:
+                self._stack[-1]['peak'] = max(self._stack[-1]['peak'], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        path = '/'.join([st['name'] for st in self._stack] + [name])
+        self.stages.setdefault(path, {'stage': path, 'level': len(self._stack), 'calls': 0, 'wall_s': 0., 'cpu_s': 0., 
+                                      'tracemalloc_peak_MB': None, 'rss_peak_MB': None})
+        self._stack.append({'name': name, 'path': path, 'peak': 0, 
+                            'wall': time.perf_counter(), 'cpu': time.process_time()})
+    
+    def stop(self, name):
+        if not self.enabled:
+            return
+        st = self._stack.pop()
+        if st['name'] != name:
+            raise ValueError(f'Profiler: stop of stage {name}, but stage {st["name"]} is running')
+        rec = self.stages[st['path']]
+        rec['calls'] += 1
+        rec['wall_s'] += time.perf_counter() - st['wall']
+        rec['cpu_s'] += time.process_time() - st['cpu']
+        if tracemalloc.is_tracing():
+            peak = max(st['peak'], tracemalloc.get_traced_memory()[1])
+            rec['tracemalloc_peak_MB'] = max(rec['tracemalloc_peak_MB'] or 0., peak / 2**20)
+            if len(self._stack) > 0:
+                self._stack[-1]['peak'] = max(self._stack[-1]['peak'], peak)
+        if resource is not None:
+            # peak RSS of the process so far (kB on Linux, bytes on macOS)
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (2**20 if sys.platform == 'darwin' else 2**10)
+            rec['rss_peak_MB'] = max(rec['rss_peak_MB'] or 0., rss)
+    
+    @contextmanager
+    def stage(self, name):
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop(name)
+    
+    def report(self):
+        """
+        Profile as DataFrame, one row per stage
+        """
+        return pd.DataFrame(list(self.stages.values()))
+    
+    def write(self, fp):
+        """
+        Write profile as json file fp
+        """
+        with open(fp, 'w') as f:
+            json.dump({'created': datetime.now().isoformat(timespec='seconds'), 
+                       'tracemalloc': tracemalloc.is_tracing(), 
+                       'stages': list(self.stages.values())}, f, indent=1)
+
+
+# profiler the stages of the functions below are recorded in: the one of the 
+# running WellStats or batch item (see profiling), else this disabled one
+profiler = Profiler()
+
+
+@contextmanager
+def profiling(prof):
+    """
+    Record the stages of the module functions in profiler prof (e.g. of one 
+    WellStats instance) while running, instead of in the module's disabled one
+    """
+    global profiler
+    previous = profiler
+    profiler = prof
+    try:
+        yield prof
+    finally:
+        profiler = previous
+
+
+def axis_index(grid, v):
+    """
+    Precompute indices and linear interpolation weights of values v on a 
+    sorted (increasing) coordinate axis grid, e.g. x or y cell centres or time.
+    
+    Returns
+        i       index of nearest grid value (same as .sel(method='nearest'), 
+                i.e. ties go to the upper value)
+        i0, i1  indices of grid values below and above v
+        w       weight of i1 for linear interpolation (weight of i0 is 1-w)
+        inside  False where v is outside grid (.interp() would give NaN)
+    """
+    n = len(grid)
+    # nearest
+    ir = np.clip(np.searchsorted(grid, v, side='left'), 0, n - 1)
+    il = np.clip(ir - 1, 0, n - 1)
+    i = np.where(np.abs(v - grid[il]) < np.abs(grid[ir] - v), il, ir)
+    # linear
+    i0 = np.clip(np.searchsorted(grid, v, side='right') - 1, 0, max(n - 2, 0))
+    i1 = np.minimum(i0 + 1, n - 1)
+    dg = grid[i1] - grid[i0]
+    w = np.where(dg > 0, (v - grid[i0]) / np.where(dg > 0, dg, 1), 0.)
+    inside = (v >= grid[0]) & (v <= grid[-1])
+    return i, i0, i1, w, inside
+
+
+def point_index(xgrid, ygrid, gwl_time, it_res, obs):
+    """
+    Precompute the point index for all observations: nearest cell/timestep 
+    (ix, iy, it) and bilinear x/y and linear time interpolation corners and 
+    weights (ix0, ix1, wx, ...). Computed once per unique coordinate and 
+    unique date, then mapped to observations.
+    Time indices refer to the timesteps of the result file (it_res), while 
+    position p0 on the time axis gwl_time is kept to assign time windows.
+    
+    Returns dictionary of arrays (one value per observation)
+    """
+    idx = {}
+    for ax, grid, v in [('x', xgrid, obs['x'].values), ('y', ygrid, obs['y'].values), 
+                        ('t', gwl_time.values.astype('int64'), obs['dato'].values.astype('datetime64[ns]').astype('int64'))]:
+        vu, inv = np.unique(v, return_inverse=True)
+        i, i0, i1, w, inside = axis_index(grid, vu.astype(np.float64) if ax != 't' else vu)
+        idx[f'i{ax}'] = i[inv]; idx[f'i{ax}0'] = i0[inv]; idx[f'i{ax}1'] = i1[inv]
+        idx[f'w{ax}'] = w[inv]; idx[f'inside_{ax}'] = inside[inv]
+    idx['inside'] = idx.pop('inside_x') & idx.pop('inside_y') & idx.pop('inside_t')
+    idx['p0'] = idx['it0']
+    for k in ['it', 'it0', 'it1']:
+        idx[k] = it_res[idx[k]]
+    return idx
+
+
+def detailed_ts_index(gwl_time, it_res, obs, icol):
+    """
+    Point index (see point_index) of observations obs in a detailed time 
+    series file: time as in point_index, and column icol of the well's item 
+    as ix (with iy 0, and no interpolation in x/y) - so that the data of the 
+    file (time, 1, item) can be sampled by the same gather functions.
+    """
+    i, i0, i1, w, inside = axis_index(gwl_time.values.astype('int64'), 
+                                      obs['dato'].values.astype('datetime64[ns]').astype('int64'))
+    zero = np.zeros(len(obs), dtype=int)
+    return {'ix': icol, 'ix0': icol, 'ix1': icol, 'wx': np.zeros(len(obs)), 
+            'iy': zero, 'iy0': zero, 'iy1': zero, 'wy': np.zeros(len(obs)), 
+            'it': it_res[i], 'it0': it_res[i0], 'it1': it_res[i1], 'wt': w, 'inside': inside}
+
+
+def detailed_ts_items(fp_dts, stat_type, wells):
+    """
+    Items of the detailed time series file fp_dts to take the simulated 
+    values of wells from: items of type elevation named by well ID (heads, 
+    as in DetailedTS_SZ.dfs0), and only for head statistics - other items 
+    and statistics are sampled from the result file.
+    Returns the item names and warnings
+    """
+    if stat_type != 'head':
+        warning = f"WARNING: Detailed time series file {fp_dts} ignored: only used for head statistics."
+        print(warning)
+        return [], [warning]
+    items = [item for item in mikeio.open(fp_dts).items if item.name in wells]
+    out_warn = []
+    for item in items:
+        if item.type != mikeio.EUMType.Elevation:
+            warning = f"WARNING: Item {item.name} of detailed time series file {fp_dts} is {item.type.name}, not a head elevation: well sampled from result file."
+            out_warn.append(warning)
+            print(warning)
+    return [item.name for item in items if item.type == mikeio.EUMType.Elevation], out_warn
+
+
+def gather_cell(data, idx, iz=None):
+    """
+    Simulated values in nearest cell and timestep (sim_cell) of the point 
+    index idx from data (time, z, y, x) in layer iz, or data (time, y, x).
+    """
+    if iz is None:
+        return data[idx['it'], idx['iy'], idx['ix']]
+    return data[idx['it'], iz, idx['iy'], idx['ix']]
+
+
+def gather_intp(data, idx, iz=None):
+    """
+    Simulated values linearly interpolated in x, y and time (sim_intp) of the 
+    point index idx from data (time, z, y, x) in layer iz, or data (time, y, x).
+    NaN outside the grid / time axis, as xarray's .interp().
+    """
+    val = np.zeros(len(idx['ix']))
+    for it, wt in [(idx['it0'], 1 - idx['wt']), (idx['it1'], idx['wt'])]:
+        for iy, wy in [(idx['iy0'], 1 - idx['wy']), (idx['iy1'], idx['wy'])]:
+            for ix, wx in [(idx['ix0'], 1 - idx['wx']), (idx['ix1'], idx['wx'])]:
+                if iz is None:
+                    val += wt * wy * wx * data[it, iy, ix]
+                else:
+                    val += wt * wy * wx * data[it, iz, iy, ix]
+    val[~idx['inside']] = np.nan
+    return val
+
+
+def sample_head(data, idx, layer, z_bottoms, eps):
+    """
+    Sample simulated heads at observations, including the "jumping down" in 
+    case the layer of an observation is dry.
+    
+    data        simulated heads (time, z, y, x)
+    idx         point index of the observations (see point_index)
+    layer       layer of the observations (0: lowest layer)
+    z_bottoms   bottoms of all layers at the observations (observation, z)
+    eps         threshold to determine dry layer (EpsilonForPhreatic)
+    Returns sim_cell, sim_intp (arrays) and the dry layer marker per observation
+    """
+    # heads of all layers in nearest cell and timestep (observation, z)
+    # Ideally, sim_cell would also be interpolated in time. As of now, nearest ts!
+    col = data[idx['it'], :, idx['iy'], idx['ix']]
+    """
+    Determine dry layer based on same method MIKE SHE uses to calcualte depth 
+    to phreatic. Dry if:
+        Saturated thickness of current layer < epsilon
+        AND
+        UNsaturated thickness of layer below > epsilon
+    Where epsilon typically is between 0.02m and 0.10m; see here:
+        http://geuswikihydro.geus.dk/w/index.php/Depth_to_phreatic_surface
+    and hard-coded here in the .xml config file
+    Determined based on SIM_CELL only! (but replace values for both)
+    """
+    profiler.start('dry layer check')
+    col_below = np.concatenate([col[:, :1], col[:, :-1]], axis=1) #layer below; limit to layer=0, i.e. lowest layer
+    dry = (col < (z_bottoms + eps)) & (col_below < (z_bottoms - eps))
+    # find first layer which is not dry in or below layer of observation (-1 if all 
+    # are dry down to the lowest layer; then lowest layer is used)
+    nz = col.shape[1]
+    wet = ~dry & (np.arange(nz) <= layer[:, None])
+    iz_wet = np.where(wet.any(axis=1), nz - 1 - np.argmax(wet[:, ::-1], axis=1), -1)
+    iz_below = layer - iz_wet
+    iz = np.clip(iz_wet, 0, None)
+    dry_label = np.full(len(layer), pd.NA, dtype=object)
+    dry_label[iz_below > 0] = [f'Layer dry - {i} below' for i in iz_below[iz_below > 0]]
+    profiler.stop('dry layer check')
+    gwl_sim_cell = col[np.arange(len(layer)), iz]
+    with profiler.stage('interpolation'):
+        gwl_sim_intp = gather_intp(data, idx, iz)
+    return gwl_sim_cell, gwl_sim_intp, dry_label
+
+
+def sample_phreatic(data, idx):
+    """
+    Sample simulated depth to phreatic surface at observations.
+    
+    data    simulated depth to phreatic (time, y, x)
+    idx     point index of the observations (see point_index)
+    Returns sim_cell, sim_intp (arrays) with positive values below ground
+    """
+    gwl_sim_cell = gather_cell(data, idx)
+    with profiler.stage('interpolation'):
+        gwl_sim_intp = gather_intp(data, idx)
+    # flip sign to follow convention with positive values below ground!
+    gwl_sim_cell = -gwl_sim_cell
+    gwl_sim_intp = -gwl_sim_intp
+    return gwl_sim_cell, gwl_sim_intp
+
+
+def read_result_window(fp_res, item, it_s, it_e):
+    """
+    Read timesteps it_s to it_e (inclusive) of item from the result file 
+    fp_res as numpy array (time, [z,] y, x)
+    """
+    return mikeio.read(fp_res, items=item, time=list(range(it_s, it_e + 1)))[item].to_numpy()
+
+
+def time_windows(idx, it_res, chunk):
+    """
+    Windows of chunk timesteps of the time axis of point index idx (see 
+    point_index; it_res: timestep in the file per timestep of the axis), 
+    overlapping by one timestep; only windows with observations. Each 
+    observation is in the window containing the timestep before (or at) its 
+    date. Peak memory then is set by the window size instead of by the 
+    length of the simulation; results are identical to reading all 
+    timesteps at once up to float precision (about 1e-6).
+    Yields selection of observations, first and last timestep in the file 
+    (inclusive) and the point index of the window
+    """
+    nt = len(it_res)
+    nwin = max(int(np.ceil((nt - 1) / chunk)), 1)
+    iwin = np.minimum(idx['p0'] // chunk, nwin - 1)
+    for w in np.unique(iwin):
+        sel = iwin == w
+        # timesteps of the result file covered by window
+        it_s = it_res[w * chunk]
+        it_e = it_res[min(w * chunk + chunk, nt - 1)]
+        idx_w = {k: v[sel] for k, v in idx.items()}
+        for k in ['it', 'it0', 'it1']:
+            idx_w[k] = idx_w[k] - it_s
+        yield sel, it_s, it_e, idx_w
+
+
+def sample_window(gwl, idx, stat_type, layer, z_bottoms, eps):
+    """
+    Simulated values of observations with point index idx from window gwl 
+    (time, [z,] y, x): with dry layer check for head statistics (see 
+    sample_head), else of the phreatic surface (see sample_phreatic).
+    Returns sim_cell, sim_intp and dry (None if not head statistics)
+    """
+    # for "normal" WellStats when head data are output
+    if stat_type=='head':
+        return sample_head(gwl, idx, layer, z_bottoms, eps)
+    # for depth to phreatic output
+    sim_cell, sim_intp = sample_phreatic(gwl, idx)
+    return sim_cell, sim_intp, None
+
+
+def read_sample_window(fp_res, item, it_s, it_e, idx, stat_type, layer, z_bottoms, eps):
+    """
+    Read timesteps it_s to it_e of item from result file fp_res and sample 
+    them (see sample_window): one gather task of the dask backend
+    """
+    gwl = read_result_window(fp_res, item, it_s, it_e)
+    return sample_window(gwl, idx, stat_type, layer, z_bottoms, eps)
+
+
+def dask_compute(tasks, dask_conf):
+    """
+    Compute dask.delayed tasks on the local machine with Workers processes: 
+    with the multiprocessing scheduler ('processes'), or on a local 
+    dask.distributed cluster ('distributed'), whose workers spill to 
+    LocalDirectory when reaching MemoryLimit. Peak memory is about Workers 
+    windows, as each task only returns the sampled values of its window.
+    Returns list of the results of tasks
+    """
+    if dask_conf['Scheduler'] == 'distributed':
+        from dask.distributed import LocalCluster, Client
+        with LocalCluster(n_workers=dask_conf['Workers'], threads_per_worker=1, processes=True, 
+                          memory_limit=dask_conf['MemoryLimit'], local_directory=dask_conf['LocalDirectory']) as cluster, \
+             Client(cluster):
+            return list(dask.compute(*tasks))
+    return list(dask.compute(*tasks, scheduler='processes', num_workers=dask_conf['Workers']))
+
+
+def read_store_window(store, idx, it_s, it_e):
+    """
+    Read timesteps it_s to it_e (inclusive) from the column store of the 
+    result file (see ColumnStore.py), but only of the cells needed by the 
+    point index idx (already shifted to it_s in time).
+    The 2x2 cells around each observation (iy0/iy1, ix0/ix1) are stacked to 
+    a compact grid (time, [z,] 2 * patches, 2); the nearest cell always is 
+    one of them. Returns this grid and idx mapped to it, to be used with the 
+    same gather functions as a window of the result file.
+    As all timesteps of a cell are stored together, repeated runs on the 
+    same result file read O(wells x times) instead of the whole grid.
+    """
+    ny, nx = len(store.y), len(store.x)
+    # one patch per unique lower left corner
+    corner, p = np.unique(np.stack([idx['iy0'], idx['ix0']]), axis=1, return_inverse=True)
+    p = p.ravel()
+    iy = np.stack([corner[0], corner[0], np.minimum(corner[0] + 1, ny - 1), np.minimum(corner[0] + 1, ny - 1)], axis=1)
+    ix = np.stack([corner[1], np.minimum(corner[1] + 1, nx - 1), corner[1], np.minimum(corner[1] + 1, nx - 1)], axis=1)
+    data = store.read_cells(iy.ravel(), ix.ravel(), it_s, it_e)
+    data = data.reshape(data.shape[:-1] + (2 * corner.shape[1], 2))
+    idx_c = dict(idx)
+    for k in ['iy', 'iy0', 'iy1']:
+        idx_c[k] = 2 * p + (idx[k] - idx['iy0'])
+    for k in ['ix', 'ix0', 'ix1']:
+        idx_c[k] = idx[k] - idx['ix0']
+    return data, idx_c
+
+
+def read_config(fp_config):
+    """
+    Parse the WS_config.xml file fp_config.
+    Returns dictionary of configuration values (see make_config)
+    """
     # Parse the XML config file
     xml = ET.parse(fp_config).getroot()
     conf = {}
     for el in xml:
-        conf[el.tag] = el.text
+        # sections (e.g. Dask) as dictionary of their elements
+        conf[el.tag] = {sub.tag: sub.text for sub in el} if len(el) > 0 else el.text
+    return make_config(conf, os.path.dirname(fp_config))
+
+
+def make_config(values, base_dir=''):
+    """
+    Configuration from dictionary values, with the same keys as the elements 
+    of WS_config.xml and values as text (as in the xml file) or as Python 
+    values (float, int, bool). Relative file paths are relative to base_dir 
+    (the folder of the config file).
+    Returns dictionary of configuration values, with file paths resolved and 
+    the statistics type in 'stat_type' ('head', 'dtp' or 'dtb')
+    """
+    conf = dict(values)
+    def as_bool(v, default):
+        if (v is None) or (v == ''):
+            return default
+        return v if isinstance(v, bool) else str(v).strip().lower() == 'true'
     conf['EpsilonForPhreatic'] = float(conf['EpsilonForPhreatic'])
+    conf['TimeChunkSize'] = int(conf.get('TimeChunkSize') or 0)
+    conf['StaticCache'] = as_bool(conf.get('StaticCache'), True)
+    conf['ColumnStore'] = as_bool(conf.get('ColumnStore'), True)
+    conf['Profile'] = as_bool(conf.get('Profile'), False)
+    conf['Incremental'] = as_bool(conf.get('Incremental'), False)
+    def as_list(v, default):
+        if (v is None) or (v == ''):
+            return default
+        return [x.strip() for x in v.split(',') if x.strip() != ''] if isinstance(v, str) else list(v)
+    conf['Groupings'] = as_list(conf.get('Groupings'), [])
+    for grouping in conf['Groupings']:
+        if not all(key in GROUPINGS for key in grouping.split('+')):
+            sys.exit(f"ERROR: Unknown grouping '{grouping}' in Groupings! Must be one of {', '.join(GROUPINGS)} (or several joined by '+').")
+    conf['DepthClasses'] = [float(x) for x in as_list(conf.get('DepthClasses'), [0, 5, 10, 20, 50, 100])]
     # file path handling - can be absolute and relative (to fp_config!)
     def obtain_filepath(fp_xml):
         if os.path.isabs(fp_xml):
             return fp_xml
         else:
-            return os.path.join(os.path.dirname(fp_config), fp_xml)
-    fp_obsin = obtain_filepath(conf['ObservationFile'])
-    fp_pp2d = obtain_filepath(conf['PreProcessedDFS2'])
-    fp_pp3d = obtain_filepath(conf['PreProcessedDFS3'])
-    fp_res = obtain_filepath(conf['ResultFile'])
+            return os.path.join(base_dir, fp_xml)
+    for key in ['ObservationFile', 'PreProcessedDFS2', 'PreProcessedDFS3', 'ResultFile', 'DetailedTSFile']:
+        if conf.get(key) is not None:
+            conf[key] = obtain_filepath(conf[key])
+    # dask backend: section of Workers, TimeChunkSize, Scheduler, MemoryLimit, 
+    # LocalDirectory (or true for defaults); None if not used
+    dask_values = conf.get('Dask')
+    if isinstance(dask_values, dict) or as_bool(dask_values, False):
+        if dask is None:
+            sys.exit("ERROR: Dask section in config, but dask is not installed (pip install 'dask[distributed]')!")
+        dask_values = dask_values if isinstance(dask_values, dict) else {}
+        conf['Dask'] = {'Workers': int(dask_values.get('Workers') or os.cpu_count()), 
+                        'TimeChunkSize': int(dask_values.get('TimeChunkSize') or 0), 
+                        'Scheduler': str(dask_values.get('Scheduler') or 'processes').strip(), 
+                        'MemoryLimit': dask_values.get('MemoryLimit') or 'auto', 
+                        'LocalDirectory': dask_values.get('LocalDirectory')}
+        if conf['Dask']['LocalDirectory'] is not None:
+            conf['Dask']['LocalDirectory'] = obtain_filepath(conf['Dask']['LocalDirectory'])
+        if conf['Dask']['Scheduler'] not in ['processes', 'distributed']:
+            sys.exit("ERROR: Scheduler in Dask section must be 'processes' or 'distributed'!")
+    else:
+        conf['Dask'] = None
     # "normal" WellStats or depth to phreatic top or bottom?
     if (conf['HeadItemText'] == 'depth to top phreatic surface (negative)') | (conf['HeadItemText'] == 'depth to phreatic surface (negative)'):
-        stat_type = 'dtp'
+        conf['stat_type'] = 'dtp'
     elif (conf['HeadItemText'] == 'depth to bottom phreatic surface (negative)'):
-        stat_type = 'dtb'
+        conf['stat_type'] = 'dtb'
     elif (conf['HeadItemText'] == 'head elevation in saturated zone'):
-        stat_type = 'head'
+        conf['stat_type'] = 'head'
     else:
         sys.exit(""""ERROR: 'HeadItemText' must be one of
                          head elevation in saturated zone
                          depth to top phreatic surface (negative)
                          depth to bottom phreatic surface (negative)
                          depth to phreatic surface (negative)!""")
+    return conf
+
+
+def build_static(conf):
+    """
+    Everything independent of the result file: load the observations and the 
+    PreProcessed files, and obtain all metadata per well (domain and SZ boundary 
+    checks, topography, ix/iy, layer and layer bottoms).
+    Returns dictionary (static context) with out_obs and out_well (without 
+    simulated values yet), out_warn, itop, z_bottoms per observation and the 
+    period covered by the observations; can be shared between runs.
+    """
+    #%% STEP 1: Load everything
+    profiler.start('STEP 1 load')
+    stat_type = conf['stat_type']
     # dictionary with 'osbervation' column headings
     obs_col = {'dtp':   'WTDEPTH', 
                'dtb':   'WTDEPTH', 
@@ -114,7 +608,7 @@ def main():
     out_warn = []
     
     # Load the WS input file (observation data)
-    WS = pd.read_csv(fp_obsin, sep='\t', index_col=0, parse_dates=['DATO'], date_format='%d-%m-%Y', 
+    WS = pd.read_csv(conf['ObservationFile'], sep='\t', index_col=0, parse_dates=['DATO'], date_format='%d-%m-%Y', 
                      dtype={'XUTM':np.float32, 'YUTM':np.float32, 'DEPTH':np.float32, obs_col[stat_type]:np.float32})
     if ((stat_type=='dtp') | (stat_type=='dtb')) & (WS.columns.isin(['WTDEPTH']).sum()==0):
         sys.exit("ERROR: Specified dtp as HeadItemText (stats type), but no column 'WTDEPTH' in observations input file!")
@@ -126,52 +620,19 @@ def main():
     WS['comment'] = WS['comment'].apply(lambda x: pd.NA if x=='nan' else x)
     
     # Get the topo, layer boundaries etc from PreProcessed files
+    profiler.start('read PreProcessed')
     # model boundaries
-    mb_ds = mikeio.read(fp_pp2d, items='Model domain and grid', time=0).to_xarray()
-    szb_ds = mikeio.read(fp_pp3d, items='Boundary conditions for the saturated zone', time=0, layers=-1).to_xarray() #layers=1: uppermost
+    mb_ds = mikeio.read(conf['PreProcessedDFS2'], items='Model domain and grid', time=0).to_xarray()
+    szb_ds = mikeio.read(conf['PreProcessedDFS3'], items='Boundary conditions for the saturated zone', time=0, layers=-1).to_xarray() #layers=1: uppermost
     # surface topography
-    top_ds = mikeio.read(fp_pp2d, items='Surface topography', time=0).to_xarray() #time=0 obtains dataset as 2D instead of 3D
+    top_ds = mikeio.read(conf['PreProcessedDFS2'], items='Surface topography', time=0).to_xarray() #time=0 obtains dataset as 2D instead of 3D
     # lower level of comp layers
-    ll_ds = mikeio.read(fp_pp3d, items='Lower level of computational layers in the saturated zone', time=0).to_xarray()
-    
-    # find timesteps to fully include period covered by result file
-    gwl_temp = mikeio.open(fp_res)
-    ts_s = WS['DATO'].min(); ts_e = WS['DATO'].max()
-    ti_s = gwl_temp.time.get_indexer([ts_s], method='pad')[0] - 1
-    if ti_s < 0:
-        # accept 14 days missing overlap - if more, print warning
-        if (gwl_temp.time[0]-ts_s)>timedelta(days=14):
-            warning = f"WARNING: First timestep in observations {ts_s} more than 14 days before first timestep in results {gwl_temp.time[0]}"
-            out_warn.append(warning)
-            print(warning)
-        ts_s = gwl_temp.time[0]
-    else:
-        ts_s = gwl_temp.time[ti_s]
-    ti_e = gwl_temp.time.get_indexer([ts_e], method='backfill')[0]
-    if ti_e < 0:
-        # accept 14 days missing overlap - if more, print warning
-        if (ts_e-gwl_temp.time[-1])>timedelta(days=14):
-            warning = f"WARNING: Last timestep in observations {ts_e} more than 14 days after last timestep in results {gwl_temp.time[-1]}"
-            out_warn.append(warning)
-            print(warning)
-        ts_e = gwl_temp.time[-1]
-    else:
-        ts_e = gwl_temp.time[ti_e]
-    del gwl_temp; gc.collect() #release memory
-    
-    # read simulated groundwater heads
-    gwl = mikeio.read(fp_res, items=conf['HeadItemText'], 
-                     time=slice(ts_s, ts_e))[conf['HeadItemText']].to_xarray()
-    # allow for "extrapolation" of sim_intp using .interp() by adding (repeating) missing timestep
-    if ti_s < -1: #add new first timestep to cover obs period
-        added = gwl.isel(time=0).expand_dims(time=[WS['DATO'].min() - timedelta(days=1)])
-        gwl = xr.concat([added, gwl], dim='time')
-    if ti_e < 0: #add new last timestep to cover obs period
-        added = gwl.isel(time=-1).expand_dims(time=[WS['DATO'].max() + timedelta(days=1)])
-        gwl = xr.concat([gwl, added], dim='time')
-    
+    ll_ds = mikeio.read(conf['PreProcessedDFS3'], items='Lower level of computational layers in the saturated zone', time=0).to_xarray()
+    profiler.stop('read PreProcessed')
+    profiler.stop('STEP 1 load')
     
     #%% STEP 2: Obtain all metadata
+    profiler.start('STEP 2 metadata')
     # warn if non-uniqe values per intake exist - should not happen!
     for col in ['XUTM', 'YUTM', 'DEPTH']:
         temp = WS.groupby(WS.index)[col].nunique()
@@ -268,42 +729,35 @@ def main():
                 warning = f"WARNING: Well {prob_wid} has depth of {prob.depth:.2f}m and no marker 'Trni'. Are you certain it represents depth to top phreatic?"
                 out_warn.append(warning)
                 print(warning)
+    obs_period = (WS['DATO'].min(), WS['DATO'].max())
     del top, top_ds, ll_ds, szb, szb_ds, mb, mb_ds, temp_xr, WS; gc.collect() #release memory
 
     # get "i_top" (number of layers)
     itop = int(ll.shape[0]) - 1
-    # loop well by well to obtain iz
-    iw = 0
-    for wid, row in out_well.iterrows():
-        x = row.x; y = row.y; ctop = row.topo
-        cll = ll[:,iw]
-        f_elev = ctop - row.depth # filter depth as absolute elevation
-        # check filter depth in relation to layers
-        if f_elev > ctop: #filter is above topography
-            iz = itop
-            if pd.isna(out_well.loc[wid, 'comment']):
-                out_well.loc[wid, 'comment'] = 'AboveTopography'
-            else:
-                out_well.loc[wid, 'comment'] += ';AboveTopography'
-            warning = f"WARNING: Well {wid} at X {x:.0f} Y {y:.0f}: {f_elev-ctop:.2f}m above topography at {ctop:.2f}m. Use uppermost layer."
-            out_warn.append(warning)
-            print(warning)
-        elif f_elev < cll[0]: #filter is below lowest layer
-            iz = 0
-            if pd.isna(out_well.loc[wid, 'comment']):
-                out_well.loc[wid, 'comment'] = 'BelowLowestLayer'
-            else:
-                out_well.loc[wid, 'comment'] += ';BelowLowestLayer'
-            warning = f"WARNING: Well {wid} at X {x:.0f} Y {y:.0f}: {cll[0]-f_elev:.2f}m below lowest layer {cll[0]:.2f}m. Use lowest layer."
-            out_warn.append(warning)
-            print(warning)
-        else: # filter is between lowest layer bottom and topo: if (f_elev >= cll[0]) & (f_elev <= ctop):
-            iz = int(np.max(np.where(cll <= f_elev)[0]))
-        out_well.loc[wid, 'layer'] = iz
-        out_well.at[wid, 'z_bottoms'] = list(cll) #use .at to assign list to single element of dataframe
-        iw += 1
-    
-    # map to out_obs (FASTER than doing in loop above)
+    # obtain iz for all wells at once
+    ctop = out_well['topo'].values
+    f_elev = ctop - out_well['depth'].values # filter depth as absolute elevation
+    # layer bottoms are increasing with layer index: layer of filter is number of bottoms below filter - 1 (batched searchsorted)
+    iz = (ll <= f_elev).sum(axis=0) - 1
+    # check filter depth in relation to layers
+    above = f_elev > ctop #filter is above topography
+    below = ~above & (f_elev < ll[0]) #filter is below lowest layer
+    iz[above] = itop
+    iz[below] = 0
+    for iw in np.where(above | below)[0]:
+        wid = out_well.index[iw]; x = out_well['x'].iloc[iw]; y = out_well['y'].iloc[iw]
+        if above[iw]:
+            warning = f"WARNING: Well {wid} at X {x:.0f} Y {y:.0f}: {f_elev[iw]-ctop[iw]:.2f}m above topography at {ctop[iw]:.2f}m. Use uppermost layer."
+        else:
+            warning = f"WARNING: Well {wid} at X {x:.0f} Y {y:.0f}: {ll[0,iw]-f_elev[iw]:.2f}m below lowest layer {ll[0,iw]:.2f}m. Use lowest layer."
+        out_warn.append(warning)
+        print(warning)
+    for mask, marker in [(above, 'AboveTopography'), (below, 'BelowLowestLayer')]:
+        out_well.loc[mask, 'comment'] = (out_well.loc[mask, 'comment'] + ';' + marker).fillna(marker)
+    out_well['layer'] = iz
+    out_well['z_bottoms'] = list(ll.T) #one array of all layer bottoms per well
+
+    # map to out_obs
     out_obs['z_bottoms'] = out_obs.index.map(out_well['z_bottoms'])
     out_obs['layer'] = out_obs.index.map(out_well['layer'])
     out_obs['ix'] = out_obs.index.map(out_well['ix'])
@@ -311,128 +765,311 @@ def main():
     out_obs['boundary'] = out_obs.index.map(out_well['boundary'])
     out_obs['comment'] = out_obs.index.map(out_well['comment'])
     
+    # layer bottoms per observation (observation, z) for dry layer check
+    z_bottoms = ll.T[out_well.index.get_indexer(out_obs.index)]
     del ll; gc.collect() #release memory
     
     # exit here if no valid observations (outside model boundary etc)
     if len(out_obs) == 0:
         sys.exit('ERROR: None of the observations are valid (outside model boundary etc).')
+    profiler.stop('STEP 2 metadata')
     
+    return {'out_obs': out_obs, 'out_well': out_well, 'out_warn': out_warn, 'itop': itop, 
+            'z_bottoms': z_bottoms, 'obs_period': obs_period, 'conf': conf}
+
+
+def static_cache_path(conf):
+    """
+    Path of the static metadata cache: next to the observation file, as _static.npz
+    """
+    return f"{os.path.splitext(conf['ObservationFile'])[0]}_static.npz"
+
+
+def static_cache_key(conf):
+    """
+    Everything the static context depends on: the HeadItemText and the 
+    observation and PreProcessed files
+    """
+    return {'version': STATIC_CACHE_VERSION, 'HeadItemText': conf['HeadItemText'], 
+            'files': [conf['ObservationFile'], conf['PreProcessedDFS2'], conf['PreProcessedDFS3']]}
+
+
+def _frame_to_npz(df, prefix, arrays):
+    # store columns of DataFrame df (except z_bottoms) as plain arrays with keys prefix + column
+    arrays[f'{prefix}index'] = df.index.values.astype(str)
+    arrays[f'{prefix}columns'] = np.array(df.columns, dtype=str)
+    for col in df.columns:
+        if col == 'z_bottoms':
+            continue
+        if (df[col].dtype == 'string') | (df[col].dtype == object):
+            # text columns as str array plus mask of missing values and original dtype
+            arrays[f'{prefix}{col}'] = np.asarray(df[col].fillna(''), dtype=str)
+            arrays[f'{prefix}{col}__na'] = df[col].isna().values
+            arrays[f'{prefix}{col}__dtype'] = np.array(str(df[col].dtype))
+        else:
+            arrays[f'{prefix}{col}'] = df[col].values
+
+
+def _frame_from_npz(npz, prefix, z_bottoms):
+    # restore DataFrame stored with _frame_to_npz; z_bottoms as one array per row
+    index = pd.Index(npz[f'{prefix}index'].astype(object))
+    df = pd.DataFrame(index=index)
+    for col in npz[f'{prefix}columns']:
+        if col == 'z_bottoms':
+            df[col] = list(z_bottoms)
+        elif f'{prefix}{col}__na' in npz:
+            values = pd.Series(npz[f'{prefix}{col}'].astype(object), index=index)
+            values[npz[f'{prefix}{col}__na']] = pd.NA
+            df[col] = values.astype(str(npz[f'{prefix}{col}__dtype']))
+        else:
+            df[col] = npz[f'{prefix}{col}']
+    return df
+
+
+def write_static_cache(fp_cache, static):
+    """
+    Write static context (see build_static) to npz file fp_cache, together with 
+    the fingerprints of the files it depends on
+    """
+    key = static_cache_key(static['conf'])
+    key['files'] = [file_fingerprint(fp) for fp in key['files']]
+    arrays = {'key': np.array(json.dumps(key)), 
+              'out_warn': np.array(static['out_warn'], dtype=str), 
+              'itop': np.array(static['itop']),
+              'z_bottoms': static['z_bottoms'],
+              'well_z_bottoms': np.stack(static['out_well']['z_bottoms'].values),
+              'obs_period': np.array(static['obs_period'], dtype='datetime64[ns]')}
+    _frame_to_npz(static['out_obs'], 'obs_', arrays)
+    _frame_to_npz(static['out_well'], 'well_', arrays)
+    with open(fp_cache, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+
+
+def read_static_cache(fp_cache, conf):
+    """
+    Read static context from npz file fp_cache, if it exists and is valid for 
+    conf: same HeadItemText and the observation and PreProcessed files not 
+    changed (same size and modification time, or else same content hash).
+    Returns static context, or None if there is no valid cache
+    """
+    if not os.path.exists(fp_cache):
+        return None
+    try:
+        npz = np.load(fp_cache, allow_pickle=False)
+        key = json.loads(str(npz['key']))
+    except (OSError, ValueError, KeyError):
+        return None
+    key_conf = static_cache_key(conf)
+    if (key['version'] != key_conf['version']) | (key['HeadItemText'] != key_conf['HeadItemText']):
+        return None
+    for fpr, fp in zip(key['files'], key_conf['files']):
+        if not file_unchanged(fp, fpr):
+            return None
+    obs_period = tuple(pd.Timestamp(t) for t in npz['obs_period'])
+    return {'out_obs': _frame_from_npz(npz, 'obs_', npz['z_bottoms']), 
+            'out_well': _frame_from_npz(npz, 'well_', npz['well_z_bottoms']), 
+            'out_warn': list(npz['out_warn']), 'itop': int(npz['itop']), 
+            'z_bottoms': npz['z_bottoms'], 'obs_period': obs_period, 'conf': conf}
+
+
+def load_static(conf, use_cache=True):
+    """
+    Static context (see build_static) for conf. If use_cache, it is read from 
+    the cache next to the observation file if that is valid, otherwise built 
+    and written to the cache; repeated runs with the same observation and 
+    PreProcessed files then skip straight to the result file.
+    """
+    if not use_cache:
+        return build_static(conf)
+    fp_cache = static_cache_path(conf)
+    with profiler.stage('static cache read'):
+        static = read_static_cache(fp_cache, conf)
+    if static is not None:
+        print(f'Using cached metadata of observations and PreProcessed files: {fp_cache}')
+        for warning in static['out_warn']:
+            print(warning)
+        return static
+    static = build_static(conf)
+    with profiler.stage('static cache write'):
+        write_static_cache(fp_cache, static)
+    return static
+
+
+def result_time_axis(res_time, obs_period):
+    """
+    Time axis of the simulated values to read from a file with timesteps 
+    res_time, which fully includes the observation period obs_period. If the 
+    file does not cover the observation period, the first/last timestep is 
+    repeated (at one day before/after the observation period), to allow for 
+    "extrapolation" when interpolating in time.
+    Returns the time axis, for each of its timesteps the timestep index in 
+    the file, and warnings (if the file covers the observation period more 
+    than 14 days too short)
+    """
+    out_warn = []
+    ts_s, ts_e = obs_period
+    ti_s = res_time.get_indexer([ts_s], method='pad')[0] - 1
+    if ti_s < 0:
+        # accept 14 days missing overlap - if more, print warning
+        if (res_time[0]-ts_s)>timedelta(days=14):
+            warning = f"WARNING: First timestep in observations {ts_s} more than 14 days before first timestep in results {res_time[0]}"
+            out_warn.append(warning)
+            print(warning)
+        ts_s = res_time[0]
+    else:
+        ts_s = res_time[ti_s]
+    ti_e = res_time.get_indexer([ts_e], method='backfill')[0]
+    if ti_e < 0:
+        # accept 14 days missing overlap - if more, print warning
+        if (ts_e-res_time[-1])>timedelta(days=14):
+            warning = f"WARNING: Last timestep in observations {ts_e} more than 14 days after last timestep in results {res_time[-1]}"
+            out_warn.append(warning)
+            print(warning)
+        ts_e = res_time[-1]
+    else:
+        ts_e = res_time[ti_e]
+
+    it_res = np.arange(res_time.get_loc(ts_s), res_time.get_loc(ts_e) + 1)
+    gwl_time = res_time[it_res]
+    # allow for "extrapolation" of sim_intp using .interp() by adding (repeating) missing timestep
+    if ti_s < -1: #add new first timestep to cover obs period
+        gwl_time = gwl_time.insert(0, obs_period[0] - timedelta(days=1))
+        it_res = np.insert(it_res, 0, it_res[0])
+    if ti_e < 0: #add new last timestep to cover obs period
+        gwl_time = gwl_time.append(pd.DatetimeIndex([obs_period[1] + timedelta(days=1)]))
+        it_res = np.append(it_res, it_res[-1])
+    return gwl_time, it_res, out_warn
+
 
+def run_result(static, fp_res, fp_dts=None):
+    """
+    Extract simulated values from result file fp_res for the static context 
+    (see build_static) and calculate the statistics.
+    If the detailed time series file fp_dts (dfs0) is given (head statistics 
+    only, see detailed_ts_items), wells with a head item of the same name 
+    (ID) are taken from there instead; fp_res is only read for the remaining 
+    wells (or not at all), and column sim_source of out_obs tells where the 
+    values are from. These are the values MIKE SHE extracted in the well's 
+    cell and layer, interpolated in time only: there is no dry layer check 
+    (column dry is empty) and no interpolation in x/y, so they can differ 
+    from the values sampled from the result file for the same well.
+    Returns out_obs, out_well, out_lay (None if not head statistics) and out_warn
+    """
+    conf = static['conf']; stat_type = conf['stat_type']; itop = static['itop']
+    out_obs = static['out_obs'].copy(deep=True)
+    out_well = static['out_well'].copy(deep=True)
+    # initialize list of warnings (of this result file)
+    out_warn = []
+    
+    # observations with simulated values in the detailed time series file (if 
+    # any); only the others are sampled from the result file
+    if fp_dts is not None:
+        dts_items, warns = detailed_ts_items(fp_dts, stat_type, out_obs.index.unique())
+        out_warn = out_warn + warns
+        in_dts = out_obs.index.isin(dts_items)
+        print(f'Using detailed time series file {fp_dts} for {out_obs.index[in_dts].nunique()} of {out_obs.index.nunique()} wells')
+        out_obs['sim_source'] = np.where(in_dts, 'DetailedTS', 'ResultFile')
+    else:
+        in_dts = np.zeros(len(out_obs), dtype=bool)
+    gwl_sim_cell = np.full(len(out_obs), np.nan)
+    gwl_sim_intp = np.full(len(out_obs), np.nan)
+    
+    
     #%% STEP 3: Obtain the actual simulation data
-    # for "normal" WellStats when head data are output
-    if stat_type=='head':
-        temp_xr = xr.Dataset({'x': (['index'], out_obs['x'].values), 
-                                'y': (['index'], out_obs['y'].values), 
-                                'z': (['index'], out_obs['layer']),
-                                'time': (['index'], out_obs['dato'].values)}, 
-                          coords={'index': out_obs.index.values})
-        temp_xr_below = xr.Dataset({'x': (['index'], out_obs['x'].values), 
-                                'y': (['index'], out_obs['y'].values), 
-                                'z': (['index'], (out_obs['layer'] - 1).clip(lower=0)), #limit to layer=0, i.e. lowest layer
-                                'time': (['index'], out_obs['dato'].values)}, 
-                          coords={'index': out_obs.index.values})
-        gwl_sim_cell = gwl.sel(temp_xr, method='nearest')
-        gwl_sim_cell_below = gwl.sel(temp_xr_below, method='nearest')
-        """
-        Ideally, gwl_sim_cell would also be interpolated in time. As of now, nearest ts!
-        gwl_sim_cell = gwl_sim_cell.interp(time=temp_xr['time'], method='linear')
-        """
-        """
-        Calculation below is done layer by layer. To save RAM.
-        The simpler method would be 
-            gwl_sim_intp = gwl.interp(temp_xr, method='linear')
-        However, excessive RAM usage and only marginally faster
-        """
-        gwl_sim_intp = gwl_sim_cell.copy(deep=True)
-        for l in range(itop,-1,-1):
-            temp = out_obs.loc[out_obs['layer']==l, :]
-            temp_xr_l = xr.Dataset({'x': (['index'], temp['x'].values), 
-                                    'y': (['index'], temp['y'].values), 
-                                    'time': (['index'], temp['dato'].values)}, 
-                              coords={'index': temp.index.values})
-            mask = gwl_sim_intp['z'].values == l
-            if mask.sum() > 0:
-                sim_intp = gwl.sel({'z':l}).interp(temp_xr_l, method='linear')
-                gwl_sim_intp.values[mask] = sim_intp.values  # Direct assignment
-            
-        """
-        Determine dry layer based on same method MIKE SHE uses to calcualte depth 
-        to phreatic. Dry if:
-            Saturated thickness of current layer < epsilon
-            AND
-            UNsaturated thickness of layer below > epsilon
-        Where epsilon typically is between 0.02m and 0.10m; see here:
-            http://geuswikihydro.geus.dk/w/index.php/Depth_to_phreatic_surface
-        and hard-coded here in the .xml config file
-        """
-        # find current layer bottoms, and bottoms of layer one below
-        bottoms = out_obs.apply(lambda row: row['z_bottoms'][row['layer']], axis=1)
-        # determine dry cells based on SIM_CELL only! (but replace values for both)
-        dry = (gwl_sim_cell < (bottoms + conf['EpsilonForPhreatic'])) & \
-            (gwl_sim_cell_below < (bottoms - conf['EpsilonForPhreatic']))
-        del temp_xr, temp_xr_below; gc.collect() #release memory
-        if dry.sum() > 0:
-            iz_below = 0
-            while dry.sum() > 0: #find lower layer values in case layer is dry, and proceed until layer not dry anymore
-                dry_init_i = dry.copy() #get current dry init
-                iz_below += 1
-                temp_xr = xr.Dataset({'x': (['index'], out_obs['x'].values), 
-                                      'y': (['index'], out_obs['y'].values), 
-                                      'z': (['index'], (out_obs['layer'] - iz_below).clip(lower=0)),
-                                      'time': (['index'], out_obs['dato'].values)}, 
-                                     coords={'index': out_obs.index.values})
-                temp_xr_below = xr.Dataset({'x': (['index'], out_obs['x'].values), 
-                                      'y': (['index'], out_obs['y'].values), 
-                                      'z': (['index'], (out_obs['layer'] - iz_below - 1).clip(lower=0)),
-                                      'time': (['index'], out_obs['dato'].values)}, 
-                                     coords={'index': out_obs.index.values})
-                gwl_sim_cell_dry = gwl.sel(temp_xr, method='nearest')
-                gwl_sim_cell_below_dry = gwl.sel(temp_xr_below, method='nearest')
-                """
-                Again, calculation below is done layer by layer. To save RAM.
-                The simpler method would be 
-                    gwl_sim_intp_dry = gwl.interp(temp_xr, method='linear')
-                However, excessive RAM usage and only marginally faster
-                """
-                gwl_sim_intp_dry = gwl_sim_cell.copy(deep=True)
-                for l in range(itop,-1,-1):
-                    temp = out_obs.loc[out_obs['layer']==l, :]
-                    temp_xr_l = xr.Dataset({'x': (['index'], temp['x'].values), 
-                                            'y': (['index'], temp['y'].values), 
-                                            'time': (['index'], temp['dato'].values)}, 
-                                      coords={'index': temp.index.values})
-                    mask = gwl_sim_intp_dry['z'].values == l
-                    if mask.sum() > 0:
-                        sim_intp = gwl.sel({'z':max(l - iz_below, 0)}).interp(temp_xr_l, method='linear')
-                        gwl_sim_intp_dry.values[mask] = sim_intp.values  # Direct assignment
-                bottoms_dry = out_obs.apply(lambda row: row['z_bottoms'][max(row['layer'] - iz_below, 0)], axis=1)
-                dry = dry & (gwl_sim_cell_dry.values < (bottoms_dry + conf['EpsilonForPhreatic'])) & \
-                    (gwl_sim_cell_below_dry.values < (bottoms_dry - conf['EpsilonForPhreatic']))
-                # remove dry value marker if we already reached bottom layer (layer < 0)
-                dry = dry & ((out_obs['layer'] - iz_below)>=0)
-                # not dry anymore in this step - replace values
-                not_dry_i = (dry_init_i & ~dry)
-                out_obs.loc[not_dry_i.values, 'dry'] = f'Layer dry - {iz_below} below'
-                # replace values from lower layer where current layer NOT is dry
-                gwl_sim_cell[not_dry_i] = gwl_sim_cell_dry[not_dry_i]
-                gwl_sim_intp[not_dry_i] = gwl_sim_intp_dry[not_dry_i]
-                del gwl_sim_cell_dry, gwl_sim_cell_below_dry, gwl_sim_intp_dry, temp_xr, temp_xr_below, bottoms_dry; gc.collect() #release memory
-        del gwl; gc.collect() #release memory
+    """
+    Nearest cell/timestep and interpolation weights are computed once for all 
+    observations (point index); sampling then is a NumPy gather (sim_cell) and 
+    a weighted sum (sim_intp) - same values as xarray's .sel(method='nearest') 
+    and .interp(method='linear').
+    The simulated values are read in windows of TimeChunkSize timesteps (all 
+    timesteps in one window if not set). Consecutive windows overlap by one 
+    timestep, so that both timesteps around an observation (needed for the 
+    interpolation in time) are in the same window. Each observation is sampled 
+    from the window containing the timestep before (or at) its date; windows 
+    without any observation are not read at all.
+    """
+    profiler.start('STEP 3 extraction')
+    if in_dts.any():
+        # detailed time series (heads): nearest and linearly interpolated in 
+        # time only (values are at the well already); no dry layer check
+        dts_sel = np.flatnonzero(in_dts)
+        obs_dts = out_obs.iloc[dts_sel]
+        dts_time = mikeio.open(fp_dts).time
+        gwl_time, it_res, warns = result_time_axis(dts_time, static['obs_period'])
+        out_warn = out_warn + warns
+        items = list(obs_dts.index.unique())
+        with profiler.stage('detailed TS read'):
+            ds = mikeio.read(fp_dts, items=items, time=list(range(it_res[0], it_res[-1] + 1)))
+            # (time, 1, item) - as a grid of one row, with one column per well
+            gwl = np.stack([ds[item].to_numpy() for item in items], axis=-1)[:, None, :]
+            del ds; gc.collect() #release memory
+        idx = detailed_ts_index(gwl_time, it_res - it_res[0], obs_dts, pd.Index(items).get_indexer(obs_dts.index))
+        sim_cell = gather_cell(gwl, idx); sim_intp = gather_intp(gwl, idx)
+        gwl_sim_cell[dts_sel] = sim_cell
+        gwl_sim_intp[dts_sel] = sim_intp
+        del gwl, idx, sim_cell, sim_intp; gc.collect() #release memory
+    
+    if (~in_dts).any():
+        res_sel = np.flatnonzero(~in_dts)
+        obs_res = out_obs.iloc[res_sel]
+        # find timesteps to fully include period covered by result file
+        gwl_temp = mikeio.open(fp_res)
+        gwl_time, it_res, warns = result_time_axis(gwl_temp.time, static['obs_period'])
+        out_warn = out_warn + warns
+        # cell centre coordinates of result grid
+        res_x = gwl_temp.geometry.x; res_y = gwl_temp.geometry.y
+        del gwl_temp; gc.collect() #release memory
+        # column store of the result file (see ColumnStore.py), if converted
+        store = ColumnStore.open_store(fp_res, conf['HeadItemText']) if conf['ColumnStore'] else None
+        if store is not None:
+            print(f'Using column store of result file: {store.fp_store}')
+        
+        with profiler.stage('point index'):
+            idx = point_index(res_x, res_y, gwl_time, it_res, obs_res)
+        chunk = conf['TimeChunkSize'] if conf['TimeChunkSize'] > 0 else len(gwl_time)
+        layer = obs_res['layer'].values; z_bottoms = static['z_bottoms'][res_sel]
+        dask_conf = conf['Dask'] if store is None else None
+        if dask_conf is not None:
+            # one gather task per window, run by the dask scheduler: each task 
+            # reads its window and samples it, only the sampled values are 
+            # returned
+            chunk = dask_conf['TimeChunkSize'] or (conf['TimeChunkSize'] if conf['TimeChunkSize'] > 0 else 50)
+            with profiler.stage('dask extraction'):
+                sels = []; tasks = []
+                for sel, it_s, it_e, idx_w in time_windows(idx, it_res, chunk):
+                    sels.append(sel)
+                    tasks.append(dask.delayed(read_sample_window)(fp_res, conf['HeadItemText'], it_s, it_e, idx_w, stat_type, 
+                                                                  layer[sel], z_bottoms[sel], conf['EpsilonForPhreatic']))
+                windows = dask_compute(tasks, dask_conf)
+            for sel, (sim_cell, sim_intp, dry) in zip(sels, windows):
+                if dry is not None:
+                    out_obs.iloc[res_sel[sel], out_obs.columns.get_loc('dry')] = dry
+                gwl_sim_cell[res_sel[sel]] = sim_cell
+                gwl_sim_intp[res_sel[sel]] = sim_intp
+            del windows, tasks
+        for sel, it_s, it_e, idx_w in (time_windows(idx, it_res, chunk) if dask_conf is None else []):
+            if store is None:
+                with profiler.stage('result file read'):
+                    gwl = read_result_window(fp_res, conf['HeadItemText'], it_s, it_e)
+            else:
+                with profiler.stage('column store read'):
+                    gwl, idx_w = read_store_window(store, idx_w, it_s, it_e)
+            sim_cell, sim_intp, dry = sample_window(gwl, idx_w, stat_type, layer[sel], z_bottoms[sel], conf['EpsilonForPhreatic'])
+            if dry is not None:
+                out_obs.iloc[res_sel[sel], out_obs.columns.get_loc('dry')] = dry
+            gwl_sim_cell[res_sel[sel]] = sim_cell
+            gwl_sim_intp[res_sel[sel]] = sim_intp
+            with profiler.stage('release memory'):
+                del gwl, idx_w, sim_cell, sim_intp; gc.collect() #release memory
+        del idx; gc.collect() #release memory
+    profiler.stop('STEP 3 extraction')
+    
+    # warnings of result file(s) first, then from metadata
+    out_warn = out_warn + static['out_warn']
     
-    # for depth to phreatic output
-    elif (stat_type=='dtp') | (stat_type=='dtb'):
-        temp_xr = xr.Dataset({'x': (['index'], out_obs['x'].values), 
-                                'y': (['index'], out_obs['y'].values), 
-                                'time': (['index'], out_obs['dato'].values)}, 
-                          coords={'index': out_obs.index.values})
-        gwl_sim_cell = gwl.sel(temp_xr, method='nearest')
-        gwl_sim_intp = gwl.interp(temp_xr, method='linear')
-        # flip sign to follow convention with positive values below ground!
-        gwl_sim_cell = -gwl_sim_cell
-        gwl_sim_intp = -gwl_sim_intp
-   
     
     #%% STEP 4: Assign values to out dataframes
+    profiler.start('STEP 4 aggregation')
     # observation output
     out_obs['sim_cell'] = gwl_sim_cell
     out_obs['sim_intp'] = gwl_sim_intp
@@ -450,32 +1087,538 @@ def main():
     
     # layer output
     if stat_type=='head':
-        out_lay = pd.DataFrame(index=range(1, itop+2), #layers 1 (top layer) to itop+1 (bottom layer)
-                               columns=['RMSE_wells','RMSE_obs','ME_wells','ME_obs','nwells','nobs'])
-        for il, row in out_lay.iterrows():
-            out_lay.loc[il, 'RMSE_wells'] = np.sqrt(out_well.loc[out_well['layer']==il, 'MSE'].mean())
-            out_lay.loc[il, 'RMSE_obs'] = np.sqrt((out_obs.loc[out_obs['layer']==il, 'err2']).mean())
-            out_lay.loc[il, 'ME_wells'] = out_well.loc[out_well['layer']==il, 'ME'].mean()
-            out_lay.loc[il, 'ME_obs'] = out_obs.loc[out_obs['layer']==il, 'err'].mean()
-            out_lay.loc[il, 'nwells'] = out_well.loc[out_well['layer']==il].shape[0]
-            out_lay.loc[il, 'nobs'] = out_obs.loc[out_obs['layer']==il].shape[0]
-    
+        #layers 1 (top layer) to itop+1 (bottom layer)
+        out_lay = group_tables(out_obs, ['layer'], itop, conf['DepthClasses'])['layer']
+        out_lay.index.name = None
+    else:
+        out_lay = None
+    profiler.stop('STEP 4 aggregation')
     
+    return out_obs, out_well, out_lay, out_warn
+
+
+def observation_keys(out_obs):
+    """
+    Key (hash) of every observation in out_obs of the static context: of
+    well ID, date, observed value, coordinates, filter depth, layer and cell,
+    i.e. everything its simulated value and error depend on (apart from the
+    result file). Identical observations are numbered, so keys are unique.
+    """
+    cols = ['dato', 'obs_value', 'x', 'y', 'depth', 'layer', 'ix', 'iy']
+    h = pd.util.hash_pandas_object(out_obs[cols], index=True).values
+    occ = pd.Series(h).groupby(h).cumcount().values
+    return pd.util.hash_pandas_object(pd.DataFrame({'h': h, 'occ': occ}), index=False).values
+
+
+def incremental_key(conf, fp_res, fp_dts=None):
+    """
+    Everything the simulated values depend on apart from the observations:
+    HeadItemText, EpsilonForPhreatic and the result, detailed time series and
+    PreProcessed files (size and modification time)
+    """
+    files = [fp_res, fp_dts, conf['PreProcessedDFS2'], conf['PreProcessedDFS3']]
+    return {'version': INCREMENTAL_VERSION, 'HeadItemText': conf['HeadItemText'],
+            'EpsilonForPhreatic': conf['EpsilonForPhreatic'],
+            'files': [None if fp is None else file_fingerprint(fp, with_hash=False) for fp in files]}
+
+
+def well_sums(out_obs):
+    """
+    Running sums per well of observations out_obs (with sim_intp and err):
+    number of observations (n), of errors (n_valid) and of simulated values
+    (n_sim), and sums of err, err^2 and sim_intp
+    """
+    g = out_obs[['sim_intp', 'err']].assign(err2=out_obs['err']**2).groupby(level=0)
+    return pd.DataFrame({'n': g.size(), 'n_valid': g['err'].count(), 'n_sim': g['sim_intp'].count(),
+                         'sum_err': g['err'].sum(), 'sum_err2': g['err2'].sum(),
+                         'sum_sim': g['sim_intp'].sum()}).astype(float)
+
+
+def layer_stats_from_sums(layer, sums, itop):
+    """
+    Per layer statistics (as out_lay, see group_stats) of wells in layer
+    (1: top layer) from their running sums (see well_sums)
+    """
+    ig = np.asarray(layer) - 1; ng = itop + 1
+    n_valid = sums['n_valid'].values; ok = n_valid > 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        me = sums['sum_err'].values / n_valid; mse = sums['sum_err2'].values / n_valid
+        n_g = np.bincount(ig, weights=ok, minlength=ng)
+        nv_g = np.bincount(ig, weights=n_valid, minlength=ng)
+        out = pd.DataFrame({
+            'RMSE_wells': np.sqrt(np.bincount(ig, weights=np.where(ok, mse, 0.), minlength=ng) / n_g),
+            'RMSE_obs': np.sqrt(np.bincount(ig, weights=sums['sum_err2'].values, minlength=ng) / nv_g),
+            'ME_wells': np.bincount(ig, weights=np.where(ok, me, 0.), minlength=ng) / n_g,
+            'ME_obs': np.bincount(ig, weights=sums['sum_err'].values, minlength=ng) / nv_g,
+            'nwells': np.bincount(ig, minlength=ng),
+            'nobs': np.bincount(ig, weights=sums['n'].values, minlength=ng).astype(int)},
+            index=pd.Index(range(1, ng + 1)))
+    return out
+
+
+def subset_static(static, mask):
+    """
+    Static context (see build_static) of the observations selected by mask only
+    """
+    sub = dict(static)
+    sub['out_obs'] = static['out_obs'][mask]
+    sub['out_well'] = static['out_well'][static['out_well'].index.isin(sub['out_obs'].index)]
+    sub['z_bottoms'] = static['z_bottoms'][mask]
+    sub['obs_period'] = (sub['out_obs']['dato'].min(), sub['out_obs']['dato'].max())
+    sub['out_warn'] = []
+    return sub
+
+
+def write_incremental_state(fp_state, key, keys, out_obs, sums):
+    """
+    Write state of an incremental run to npz file fp_state: key (see
+    incremental_key), the simulated values and errors of out_obs with their
+    observation keys, and the running sums per well
+    """
+    cols = [col for col in ['sim_cell', 'sim_intp', 'err', 'dry', 'sim_source'] if col in out_obs.columns]
+    rows = out_obs[cols].copy()
+    rows.insert(0, 'key', keys)
+    arrays = {'key': np.array(json.dumps(key))}
+    _frame_to_npz(rows, 'row_', arrays)
+    _frame_to_npz(sums, 'well_', arrays)
+    with open(fp_state, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+
+
+def read_incremental_state(fp_state, key):
+    """
+    Read state of an incremental run from npz file fp_state, if it exists and
+    was written for the same key (see incremental_key).
+    Returns rows (simulated values per observation key) and running sums per
+    well, or None if there is no valid state
+    """
+    if not os.path.exists(fp_state):
+        return None
+    try:
+        npz = np.load(fp_state, allow_pickle=False)
+        if json.loads(str(npz['key'])) != json.loads(json.dumps(key)):
+            return None
+        return _frame_from_npz(npz, 'row_', None), _frame_from_npz(npz, 'well_', None)
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def run_incremental(static, fp_res, fp_dts, fp_state):
+    """
+    As run_result, but simulated values are only extracted for observations
+    that are new or changed since the last run with the same result file
+    (and detailed time series, PreProcessed files, HeadItemText and
+    EpsilonForPhreatic), as kept in the state file fp_state; all others are
+    taken from there. Per well and per layer statistics are updated from
+    running sums per well. Without a valid state, all observations are
+    extracted (and the state written). Groupings are still computed over
+    all observations.
+    Returns out_obs, out_well, out_lay (None if not head statistics) and out_warn
+    """
+    conf = static['conf']; stat_type = conf['stat_type']; itop = static['itop']
+    key = incremental_key(conf, fp_res, fp_dts)
+    keys = observation_keys(static['out_obs'])
+    with profiler.stage('incremental state read'):
+        state = read_incremental_state(fp_state, key)
+    if state is None:
+        print(f'No valid incremental state {fp_state}: extracting all observations')
+        out_obs, out_well, out_lay, out_warn = run_result(static, fp_res, fp_dts)
+        with profiler.stage('incremental state write'):
+            write_incremental_state(fp_state, key, keys, out_obs, well_sums(out_obs))
+        return out_obs, out_well, out_lay, out_warn
+    rows, sums = state
+
+    # observations known from last run (row in state), and new or changed ones
+    irow = pd.Index(rows['key'].values).get_indexer(keys)
+    new = irow < 0; known = np.flatnonzero(~new)
+    removed = np.ones(len(rows), dtype=bool); removed[irow[known]] = False
+    print(f'Incremental: {new.sum()} new or changed observations, {removed.sum()} removed, {len(known)} unchanged')
+    out_obs = static['out_obs'].copy(deep=True)
+    out_well = static['out_well'].copy(deep=True)
+    gwl_sim_cell = np.full(len(out_obs), np.nan)
+    gwl_sim_intp = np.full(len(out_obs), np.nan)
+    gwl_sim_cell[known] = rows['sim_cell'].values[irow[known]]
+    gwl_sim_intp[known] = rows['sim_intp'].values[irow[known]]
+    out_obs.iloc[known, out_obs.columns.get_loc('dry')] = rows['dry'].values[irow[known]]
+    if 'sim_source' in rows.columns:
+        out_obs['sim_source'] = None
+        out_obs.iloc[known, out_obs.columns.get_loc('sim_source')] = rows['sim_source'].values[irow[known]]
+    if new.any():
+        sub_obs = run_result(subset_static(static, new), fp_res, fp_dts)[0]
+        gwl_sim_cell[new] = sub_obs['sim_cell'].values
+        gwl_sim_intp[new] = sub_obs['sim_intp'].values
+        out_obs.iloc[np.flatnonzero(new), out_obs.columns.get_loc('dry')] = sub_obs['dry'].values
+        if 'sim_source' in sub_obs.columns:
+            out_obs.iloc[np.flatnonzero(new), out_obs.columns.get_loc('sim_source')] = sub_obs['sim_source'].values
+    # warnings of the result file(s), for the period of all observations (as run_result)
+    out_warn = []
+    in_dts = (out_obs['sim_source'] == 'DetailedTS').values if 'sim_source' in out_obs.columns else np.zeros(len(out_obs), dtype=bool)
+    if in_dts.any():
+        out_warn = out_warn + result_time_axis(mikeio.open(fp_dts).time, static['obs_period'])[2]
+    if (~in_dts).any():
+        out_warn = out_warn + result_time_axis(mikeio.open(fp_res).time, static['obs_period'])[2]
+
+    profiler.start('STEP 4 aggregation')
+    out_obs['sim_cell'] = gwl_sim_cell
+    out_obs['sim_intp'] = gwl_sim_intp
+    out_obs['err'] = out_obs['obs_value'] - out_obs['sim_intp']
+    out_obs['err2'] = out_obs['err']**2
+
+    # running sums per well: remove removed (and changed) observations, add new ones
+    sums = sums.sub(well_sums(rows[removed]), fill_value=0).add(well_sums(out_obs[new]), fill_value=0)
+    sums = sums.reindex(out_well.index, fill_value=0)
+    # no rounding residues where all values are gone
+    sums.loc[sums['n_valid'] == 0, ['sum_err', 'sum_err2']] = 0
+    sums.loc[sums['n_sim'] == 0, 'sum_sim'] = 0
+    out_well['sim_mean'] = (sums['sum_sim'] / sums['n_sim']).where(sums['n_sim'] > 0)
+    out_well['ME'] = (sums['sum_err'] / sums['n_valid']).where(sums['n_valid'] > 0)
+    out_well['MSE'] = (sums['sum_err2'] / sums['n_valid']).where(sums['n_valid'] > 0)
+
+    # reverse MIKE-internal z-indexing (see run_result)
+    out_obs['layer'] = itop + 1 - out_obs['layer']
+    out_well['layer'] = itop + 1 - out_well['layer']
+    out_lay = layer_stats_from_sums(out_well['layer'].values, sums, itop) if stat_type=='head' else None
+    profiler.stop('STEP 4 aggregation')
+
+    with profiler.stage('incremental state write'):
+        write_incremental_state(fp_state, key, keys, out_obs, sums)
+    return out_obs, out_well, out_lay, out_warn + static['out_warn']
+
+
+def write_output(fp_stump, fp_ext, out_obs, out_well, out_lay, out_warn, out_groups=None):
+    """
+    Write output of run_result to text files fp_stump + _observations, _wells,
+    _layers (head statistics only) and _warnings + fp_ext, the grouped 
+    statistics out_groups (see group_tables) as fp_stump + _<grouping> + fp_ext, 
+    and if profiling is enabled the profile as fp_stump + _profile.json
+    """
     #%% STEP 5: Write output to text files
-    fp_stump = os.path.splitext(fp_obsin)[0]
-    fp_ext = os.path.splitext(fp_obsin)[1]
+    profiler.start('STEP 5 write')
     fp_obs =  f'{fp_stump}_observations{fp_ext}' 
     fp_well = f'{fp_stump}_wells{fp_ext}' 
     fp_lay = f'{fp_stump}_layers{fp_ext}' 
     fp_warn = f'{fp_stump}_warnings{fp_ext}' 
     
-    out_obs.drop(columns=['z_bottoms','boundary']).to_csv(fp_obs, sep='\t', index_label='OBS_ID')
-    out_well.drop(columns=['z_bottoms']).to_csv(fp_well, sep='\t', index_label='OBS_ID')
-    if stat_type=='head':
-        out_lay.to_csv(fp_lay, sep='\t', index_label='Layer')
+    with profiler.stage('write _observations'):
+        out_obs.drop(columns=['z_bottoms','boundary']).to_csv(fp_obs, sep='\t', index_label='OBS_ID')
+    with profiler.stage('write _wells'):
+        out_well.drop(columns=['z_bottoms']).to_csv(fp_well, sep='\t', index_label='OBS_ID')
+    if out_lay is not None:
+        with profiler.stage('write _layers'):
+            out_lay.to_csv(fp_lay, sep='\t', index_label='Layer')
+    for grouping, out in (out_groups or {}).items():
+        with profiler.stage(f'write _{grouping}'):
+            out.to_csv(f"{fp_stump}_{grouping.replace('+', '_')}{fp_ext}", sep='\t')
     with open(fp_warn, 'w') as f:
         for w in out_warn:
             f.write(w + '\n')
+    profiler.stop('STEP 5 write')
+    if profiler.enabled:
+        profiler.write(f'{fp_stump}_profile.json')
+
+
+# groupings available for the grouped statistics (see group_tables), with 
+# their index label in the output tables
+GROUPINGS = {'layer': 'Layer', 'season': 'Season', 'year': 'Year', 'month': 'Month', 
+             'boundary': 'Boundary', 'depth': 'DepthClass'}
+
+
+def group_stats(err, well, codes, groups):
+    """
+    Statistics of errors err (one per observation; NaN if no simulated value) 
+    of wells well, grouped by codes (index in groups per observation; -1: no 
+    group). All groups are in the output, also if empty.
+    For each group and well the mean error and mean squared error are 
+    obtained first (as ME and MSE in out_well), for each group then:
+        RMSE_wells, ME_wells    over the wells' MSE and ME
+        RMSE_obs, ME_obs        over the observations
+        nwells, nobs            number of wells and observations
+    Everything in one pass of bincounts over the observation arrays.
+    Returns DataFrame with one row per group
+    """
+    ig = np.asarray(codes, dtype=np.int64); ng = len(groups)
+    iw, wells = pd.factorize(well); nw = len(wells)
+    valid = ~np.isnan(err) & (ig >= 0)
+    e = np.where(valid, err, 0.)
+    # per group and well
+    gw, igw = np.unique(ig[ig >= 0] * nw + iw[ig >= 0], return_inverse=True)
+    n_gw = np.bincount(igw, weights=valid[ig >= 0], minlength=len(gw))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        me_gw = np.bincount(igw, weights=e[ig >= 0], minlength=len(gw)) / n_gw
+        mse_gw = np.bincount(igw, weights=e[ig >= 0]**2, minlength=len(gw)) / n_gw
+    g_gw = gw // nw
+    ok = n_gw > 0
+    n_g = np.bincount(g_gw, weights=ok, minlength=ng)
+    n_obs_valid = np.bincount(ig[valid], minlength=ng)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        out = pd.DataFrame({
+            'RMSE_wells': np.sqrt(np.bincount(g_gw, weights=np.where(ok, mse_gw, 0.), minlength=ng) / n_g),
+            'RMSE_obs': np.sqrt(np.bincount(ig[valid], weights=e[valid]**2, minlength=ng) / n_obs_valid),
+            'ME_wells': np.bincount(g_gw, weights=np.where(ok, me_gw, 0.), minlength=ng) / n_g,
+            'ME_obs': np.bincount(ig[valid], weights=e[valid], minlength=ng) / n_obs_valid,
+            'nwells': np.bincount(g_gw, minlength=ng),
+            'nobs': np.bincount(ig[ig >= 0], minlength=ng)}, 
+            index=groups)
+    return out
+
+
+def group_labels(out_obs, grouping, itop, depth_classes):
+    """
+    Group of every observation for grouping (one of GROUPINGS, or several 
+    joined by '+', e.g. 'layer+season'). Groups are all layers (1 to itop+1), 
+    seasons and depth classes, otherwise the groups occurring (also for 
+    combinations).
+    Returns codes (index in groups per observation) and groups (Index)
+    """
+    keys = grouping.split('+')
+    labels = []
+    for key in keys:
+        if key == 'layer':
+            lab = pd.Categorical(out_obs['layer'].values, categories=range(1, itop + 2))
+        elif key == 'season':
+            season = np.array(['DJF', 'DJF', 'MAM', 'MAM', 'MAM', 'JJA', 'JJA', 'JJA', 'SON', 'SON', 'SON', 'DJF'])
+            lab = pd.Categorical(season[out_obs['dato'].dt.month.values - 1], categories=['DJF', 'MAM', 'JJA', 'SON'])
+        elif key == 'year':
+            lab = pd.Categorical(out_obs['dato'].dt.year.values)
+        elif key == 'month':
+            lab = pd.Categorical(out_obs['dato'].dt.month.values)
+        elif key == 'boundary':
+            lab = pd.Categorical(out_obs['boundary'].values)
+        elif key == 'depth':
+            edges = list(depth_classes)
+            names = [f'<{edges[0]:g}'] + [f'{a:g}-{b:g}' for a, b in zip(edges[:-1], edges[1:])] + [f'>{edges[-1]:g}']
+            lab = pd.cut(out_obs['depth'].values, [-np.inf] + edges + [np.inf], labels=names, right=False)
+        labels.append(lab)
+    if len(labels) == 1:
+        return labels[0].codes, pd.Index(labels[0].categories, name=GROUPINGS[keys[0]])
+    # combinations: as MultiIndex of the groups occurring (in order of the single groupings)
+    combined = np.zeros(len(out_obs), dtype=np.int64); valid = np.ones(len(out_obs), dtype=bool)
+    for lab in labels:
+        combined = combined * len(lab.categories) + lab.codes
+        valid &= lab.codes >= 0
+    uniques, codes = np.unique(combined[valid], return_inverse=True)
+    codes_all = np.full(len(out_obs), -1, dtype=np.int64); codes_all[valid] = codes.ravel()
+    levels = []
+    for lab in labels[::-1]:
+        levels.insert(0, np.asarray(lab.categories)[uniques % len(lab.categories)])
+        uniques = uniques // len(lab.categories)
+    return codes_all, pd.MultiIndex.from_arrays(levels, names=[GROUPINGS[k] for k in keys])
+
+
+def group_tables(out_obs, groupings, itop, depth_classes):
+    """
+    Grouped statistics (see group_stats) of out_obs for each of groupings 
+    (see group_labels). Returns dictionary grouping -> DataFrame
+    """
+    out_groups = {}
+    for grouping in groupings:
+        codes, groups = group_labels(out_obs, grouping, itop, depth_classes)
+        out_groups[grouping] = group_stats(out_obs['err'].values, out_obs.index.values, codes, groups)
+    return out_groups
+
+
+def summary_stats(out_obs, out_well, out_lay):
+    """
+    Summary of a run: overall statistics over all wells and observations 
+    (row 'all'), and the per layer statistics out_lay (head statistics only)
+    """
+    out_all = pd.DataFrame({'RMSE_wells': np.sqrt(out_well['MSE'].mean()),
+                            'RMSE_obs': np.sqrt(out_obs['err2'].mean()),
+                            'ME_wells': out_well['ME'].mean(),
+                            'ME_obs': out_obs['err'].mean(),
+                            'nwells': out_well.shape[0],
+                            'nobs': out_obs.shape[0]}, index=['all'])
+    if out_lay is None:
+        return out_all
+    return pd.concat([out_all, out_lay])
+
+
+# static context and profiler in batch worker processes (set once per process 
+# by _init_worker)
+_static = None
+_profiler = Profiler()
+
+class WellStats:
+    """
+    WellStats as library: observations and PreProcessed files are loaded 
+    once (see load_static) and reused for any number of result files, with 
+    output returned as DataFrames instead of written to text files.
+    
+    config      path to WS_config.xml file, or dictionary of configuration 
+                values (see make_config); ResultFile is optional
+    base_dir    folder relative file paths of a config dictionary refer to
+    use_cache   use cache of static metadata (if StaticCache is not false)
+    profile     enable profiling (as Profile in config): see self.profiler.report() 
+                and the _profile.json file written by write(); one profile per 
+                instance, covering loading and the last run
+    incremental only extract new or changed observations (as Incremental 
+                in config), keeping state next to the observation file
+    
+    Example
+        ws = WellStats('WS_config.xml')
+        out_obs, out_well, out_lay, out_warn = ws.run('run1/Skjern_500m_3DSZ.dfs3')
+        ws.groups       # grouped statistics of last run (Groupings in config)
+        ws.summary()    # 'all' and per layer statistics of last run
+        ws.write()      # optional: _observations, _wells, ... text files
+    """
+    
+    def __init__(self, config, base_dir='', use_cache=True, profile=False, incremental=False):
+        if isinstance(config, dict):
+            self.conf = make_config(config, base_dir)
+        else:
+            self.conf = read_config(config)
+        self.conf['Profile'] = profile or self.conf['Profile']
+        self.conf['Incremental'] = incremental or self.conf['Incremental']
+        self.profiler = Profiler()
+        if self.conf['Profile']:
+            self.profiler.enable()
+        with profiling(self.profiler):
+            self.static = load_static(self.conf, use_cache=self.conf['StaticCache'] and use_cache)
+        self._load_stages = self.profiler.stages #stages of loading, start of the profile of each run
+        self.result = None
+        self.groups = {}
+    
+    def run(self, fp_res=None, fp_dts=None):
+        """
+        Statistics for result file fp_res (default: ResultFile of config) 
+        and detailed time series file fp_dts (default: DetailedTSFile of 
+        config, if fp_res is not given either).
+        Returns out_obs, out_well, out_lay (None if not head statistics) and out_warn
+        """
+        if fp_res is None:
+            fp_res = self.conf.get('ResultFile')
+            fp_dts = self.conf.get('DetailedTSFile') if fp_dts is None else fp_dts
+        if fp_res is None:
+            raise ValueError('No result file given, and no ResultFile in config')
+        self.profiler.reset(self._load_stages) #one profile per run
+        with profiling(self.profiler):
+            if self.conf['Incremental']:
+                fp_state = f"{os.path.splitext(self.conf['ObservationFile'])[0]}_incremental.npz"
+                self.result = run_incremental(self.static, fp_res, fp_dts, fp_state)
+            else:
+                self.result = run_result(self.static, fp_res, fp_dts)
+            with profiler.stage('STEP 4 groupings'):
+                self.groups = group_tables(self.result[0], self.conf['Groupings'], self.static['itop'], self.conf['DepthClasses'])
+        return self.result
+    
+    def summary(self):
+        """
+        Summary of last run (see summary_stats)
+        """
+        if self.result is None:
+            raise ValueError('No results yet - call run() first')
+        out_obs, out_well, out_lay, _ = self.result
+        return summary_stats(out_obs, out_well, out_lay)
+    
+    def write(self, fp_stump=None, fp_ext=None):
+        """
+        Write output of last run to text files fp_stump + _observations etc. 
+        + fp_ext (default: next to the observation file, as WellStats.py 
+        <WS_config.xml>)
+        """
+        if self.result is None:
+            raise ValueError('No results yet - call run() first')
+        stump, ext = os.path.splitext(self.conf['ObservationFile'])
+        with profiling(self.profiler):
+            write_output(stump if fp_stump is None else fp_stump, ext if fp_ext is None else fp_ext, *self.result, 
+                         out_groups=self.groups)
+
+
+def _init_worker(static):
+    global _static, _profiler
+    _static = static
+    _profiler = Profiler()
+    if static['conf']['Profile']:
+        _profiler.enable()
+
+
+def _run_batch_item(fp_res, fp_stump):
+    """
+    Run and write WellStats for one result file of a batch; returns summary
+    """
+    print(f'WellStats: {fp_res}')
+    _profiler.reset() #one profile per result file
+    with profiling(_profiler):
+        # detailed time series file of same name in the folder of the result file (if configured and present)
+        fp_dts = _static['conf'].get('DetailedTSFile')
+        if fp_dts is not None:
+            fp_dts = os.path.join(os.path.dirname(os.path.abspath(fp_res)), os.path.basename(fp_dts))
+            if not os.path.exists(fp_dts):
+                fp_dts = None
+        if _static['conf']['Incremental']:
+            out_obs, out_well, out_lay, out_warn = run_incremental(_static, fp_res, fp_dts, f'{fp_stump}_incremental.npz')
+        else:
+            out_obs, out_well, out_lay, out_warn = run_result(_static, fp_res, fp_dts)
+        with profiler.stage('STEP 4 groupings'):
+            out_groups = group_tables(out_obs, _static['conf']['Groupings'], _static['itop'], _static['conf']['DepthClasses'])
+        write_output(fp_stump, os.path.splitext(_static['conf']['ObservationFile'])[1], 
+                     out_obs, out_well, out_lay, out_warn, out_groups)
+        return summary_stats(out_obs, out_well, out_lay)
+
+
+def run_batch(static, result_files, workers=1, prof=None):
+    """
+    Run WellStats for many result files (e.g. ensemble members or calibration 
+    runs) sharing one static context: observations and PreProcessed files are 
+    loaded and processed only once. With workers > 1, result files are run in 
+    parallel in a pool of worker processes which each receive the static 
+    context once.
+    Output per result file is written next to the result file, named after 
+    observation file and result file, e.g. 
+        <result folder>/WS_input_<result name>_observations.txt
+    and a combined summary (one row per result file and layer, see 
+    summary_stats) next to the observation file as _batch_summary. If 
+    profiling is enabled, each result file has its own _profile.json, and 
+    the profile of loading the static context prof (e.g. the profiler of 
+    WellStats) is written next to the summary as _batch_profile.json.
+    Returns the combined summary
+    """
+    fp_obsin = static['conf']['ObservationFile']
+    fp_ext = os.path.splitext(fp_obsin)[1]
+    obs_name = os.path.splitext(os.path.basename(fp_obsin))[0]
+    fp_stumps = [os.path.join(os.path.dirname(os.path.abspath(fp_res)), 
+                              f'{obs_name}_{os.path.splitext(os.path.basename(fp_res))[0]}') 
+                 for fp_res in result_files]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(static,)) as pool:
+            summaries = list(pool.map(_run_batch_item, result_files, fp_stumps))
+    else:
+        _init_worker(static)
+        summaries = [_run_batch_item(fp_res, fp_stump) for fp_res, fp_stump in zip(result_files, fp_stumps)]
+    out_sum = pd.concat(summaries, keys=result_files, names=['ResultFile', 'Layer'])
+    out_sum.to_csv(f'{os.path.splitext(fp_obsin)[0]}_batch_summary{fp_ext}', sep='\t')
+    if (prof is not None) and prof.enabled:
+        prof.write(f'{os.path.splitext(fp_obsin)[0]}_batch_profile.json')
+    return out_sum
+
+
+def main():
+    #%% STEP 0: command line handling
+    parser = argparse.ArgumentParser(usage='WellStats.py <WS_config.xml> [--batch RESULT [RESULT ...]] [--workers N] [--no-cache] [--profile] [--incremental]')
+    parser.add_argument('config', help='WS_config.xml file')
+    parser.add_argument('--batch', nargs='+', metavar='RESULT', 
+                        help='result files or glob patterns (e.g. "runs/*/Skjern_500m_3DSZ.dfs3") to run instead of ResultFile in config')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes for --batch (default: 1)')
+    parser.add_argument('--no-cache', action='store_true', help='do not use (nor write) the cache of static metadata')
+    parser.add_argument('--profile', action='store_true', help='write time and memory profile per stage to _profile.json')
+    parser.add_argument('--incremental', action='store_true', help='only extract observations new or changed since the last run')
+    args = parser.parse_args()
+    fp_config = args.config
+    # IF TESTING FROM IDE
+    # fp_config=r'\\geodata.geus.dk\Dkmodel-hydro\Hdata\jup_pej2024\WSinput\obs_DKMNret500m_comparison\DK1_2024_conf.xml'
+    # fp_config = r'\\geodata.geus.dk\DKmodel_users\FloodWarning\GWH_emulator\ed-LSTM\GWH_obs\WSInput\DK1_2024_conf_dtp.xml'
+    
+    ws = WellStats(fp_config, use_cache=not args.no_cache, profile=args.profile, incremental=args.incremental)
+    if args.batch:
+        result_files = []
+        for pattern in args.batch:
+            for fp_res in (sorted(glob.glob(pattern)) or [pattern]):
+                if fp_res not in result_files:
+                    result_files.append(fp_res)
+        run_batch(ws.static, result_files, workers=args.workers, prof=ws.profiler)
+    else:
+        ws.run()
+        ws.write()
 
 
 #%%
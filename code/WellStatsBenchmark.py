@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+WellStatsBenchmark
+
+Benchmark of WellStats on synthetic data, to measure its scaling without a
+real MIKE SHE run. For every combination of grid size, number of layers,
+timesteps, wells and dry cell fraction, synthetic input is generated with
+mikeio:
+    PP.dfs2     PreProcessed dfs2 (model domain, surface topography)
+    PP3.dfs3    PreProcessed 3DSZ dfs3 (SZ boundary, lower levels of layers)
+    R3.dfs3     3DSZ result: head elevation in saturated zone
+    R2.dfs2     2DSZ result: depth to top and bottom phreatic surface
+    obs.csv     WS input observation file
+and WellStats.py is run on it (head, dtp and/or dtb statistics) in a separate
+process per run, with --profile for time and memory per stage.
+
+Usage: WellStatsBenchmark.py [--nx 50 100] [--nz 6] [--nt 200] [--wells 150 1000]
+                             [--dry 0.3] [--modes head dtp dtb] [--repeat N]
+                             [--out <folder>] [--keep]
+    --nx        number of cells in x and y (square grid)
+    --nz        number of computational layers
+    --nt        number of timesteps of the results (daily)
+    --wells     number of wells (each with 1-30 observations)
+    --dry       fraction of cells with dry upper layers
+    --modes     statistics to run: head (R3.dfs3), dtp/dtb (R2.dfs2)
+    --repeat    number of runs without profiling; the fastest is reported as
+                wall_s (the profiled run is slower due to memory tracing)
+    --out       folder for synthetic data and results (default: ./benchmark)
+    --keep      keep the synthetic data of each case (default: delete)
+Output: in --out
+    benchmark.json  : all runs, with the stage profiles of WellStats
+    benchmark.csv   : one row per run: case parameters, wall_s, peak_rss_MB
+                      and wall time of each stage (STEP 1 - STEP 5)
+All lists of values are combined (full matrix). Runs offline; only needs
+mikeio, numpy and pandas (as WellStats).
+"""
+
+import sys, os, json, shutil, argparse, itertools, subprocess, time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+
+import mikeio
+from mikeio import ItemInfo, EUMType
+
+HEAD_ITEM = {'head': 'head elevation in saturated zone',
+             'dtp': 'depth to top phreatic surface (negative)',
+             'dtb': 'depth to bottom phreatic surface (negative)'}
+
+
+def make_case(fp_case, nx, nz, nt, nwells, dry, seed=0):
+    """
+    Generate synthetic PreProcessed files, results and observations in
+    folder fp_case (see header), on a grid of nx x nx cells of 500m with nz
+    layers, nt daily timesteps and nwells wells, of which a fraction dry of
+    the cells has dry upper layers.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(fp_case, exist_ok=True)
+    ny = nx; dx = 500.
+    x0, y0 = 450250., 6150250.
+    g2 = mikeio.Grid2D(nx=nx, ny=ny, dx=dx, origin=(x0, y0), projection='UTM-32')
+    g3 = mikeio.Grid3D(nx=nx, ny=ny, nz=nz, dx=dx, dy=dx, dz=1., origin=(x0, y0, 0.), projection='UTM-32')
+    time1 = pd.DatetimeIndex(['2000-01-01'])
+
+    # PreProcessed: domain (first two columns outside), topography, SZ boundary (first row fixed head), layers
+    mb = np.ones((ny, nx)); mb[:, :2] = 0
+    topo = 50 + 10 * rng.random((ny, nx))
+    mikeio.Dataset([mikeio.DataArray(mb[None], time=time1, geometry=g2, item=ItemInfo('Model domain and grid')),
+                    mikeio.DataArray(topo[None], time=time1, geometry=g2, item=ItemInfo('Surface topography', EUMType.Elevation))]
+                   ).to_dfs(os.path.join(fp_case, 'PP.dfs2'))
+    thick = 60. / nz
+    ll = np.stack([topo - (nz - l) * thick - rng.random((ny, nx)) for l in range(nz)]) #layer 0: lowest
+    szb = np.ones((nz, ny, nx)); szb[:, 0, :] = 2
+    mikeio.Dataset([mikeio.DataArray(szb[None], time=time1, geometry=g3, item=ItemInfo('Boundary conditions for the saturated zone')),
+                    mikeio.DataArray(ll[None], time=time1, geometry=g3, item=ItemInfo('Lower level of computational layers in the saturated zone'))]
+                   ).to_dfs(os.path.join(fp_case, 'PP3.dfs3'))
+
+    # results: heads with seasonal signal and noise; in dry cells the upper half of the layers below their bottoms
+    time = pd.date_range('2000-01-01 06:00', periods=nt, freq='D')
+    base = (topo - 8)[None] + 2 * np.sin(2 * np.pi * np.arange(nt) / 365)[:, None, None]
+    head = np.empty((nt, nz, ny, nx), dtype=np.float32)
+    for l in range(nz):
+        head[:, l] = base - 0.2 * (nz - l) + 0.1 * rng.standard_normal((nt, ny, nx))
+    is_dry = rng.random((ny, nx)) < dry
+    for l in range(nz // 2, nz):
+        head[:, l][:, is_dry] = (ll[l] - 1.)[is_dry]
+    mikeio.Dataset([mikeio.DataArray(head, time=time, geometry=g3, item=ItemInfo(HEAD_ITEM['head'], EUMType.Elevation))]
+                   ).to_dfs(os.path.join(fp_case, 'R3.dfs3'))
+    dtp = -(topo[None] - head[:, -1]).clip(0).astype(np.float32)
+    dtb = (dtp - 0.5 * rng.random((nt, ny, nx))).astype(np.float32)
+    del head
+    mikeio.Dataset([mikeio.DataArray(dtp, time=time, geometry=g2, item=ItemInfo(HEAD_ITEM['dtp'], EUMType.Elevation)),
+                    mikeio.DataArray(dtb, time=time, geometry=g2, item=ItemInfo(HEAD_ITEM['dtb'], EUMType.Elevation))]
+                   ).to_dfs(os.path.join(fp_case, 'R2.dfs2'))
+    del dtp, dtb
+
+    # observations: wells anywhere in (and some outside) the domain, filters in all layers,
+    # also above topography / below lowest layer, dates within (and slightly outside) the results
+    x = x0 - dx + rng.random(nwells) * (nx + 1) * dx
+    y = y0 + rng.random(nwells) * (ny - 1) * dx
+    depth = rng.uniform(-2., 65., nwells)
+    nobs = rng.integers(1, 31, nwells)
+    iw = np.repeat(np.arange(nwells), nobs)
+    days = rng.integers(-10, nt + 10, len(iw))
+    ids = np.array([f'{w}.{w * 7}_1' for w in range(nwells)])
+    obs = pd.DataFrame({'XUTM': x[iw], 'YUTM': y[iw], 'DEPTH': depth[iw].round(2),
+                        'PEJL': (40 + 5 * rng.random(len(iw))).round(2),
+                        'WTDEPTH': (5 * rng.random(len(iw))).round(2),
+                        'DATO': (pd.Timestamp('2000-01-01') + pd.to_timedelta(days, unit='D')).strftime('%d-%m-%Y'),
+                        'comment': np.where(rng.random(len(iw)) < .2, 'Trni', '')},
+                       index=pd.Index(ids[iw], name='ID'))
+    obs.to_csv(os.path.join(fp_case, 'obs.csv'), sep='\t')
+
+
+def write_config(fp_case, mode):
+    """
+    Write WS_config xml for mode ('head', 'dtp' or 'dtb') in case folder
+    fp_case; returns its path
+    """
+    fp_config = os.path.join(fp_case, f'conf_{mode}.xml')
+    res = 'R3.dfs3' if mode == 'head' else 'R2.dfs2'
+    with open(fp_config, 'w') as f:
+        f.write(f"""<?xml version="1.0"?>
+<Configuration>
+    <PreProcessedDFS2>PP.dfs2</PreProcessedDFS2>
+    <PreProcessedDFS3>PP3.dfs3</PreProcessedDFS3>
+    <ObservationFile>obs_{mode}.csv</ObservationFile>
+    <ResultFile>{res}</ResultFile>
+    <HeadItemText>{HEAD_ITEM[mode]}</HeadItemText>
+    <PhreaticUseLayerBelow>true</PhreaticUseLayerBelow>
+    <EpsilonForPhreatic>0.02</EpsilonForPhreatic>
+    <StaticCache>false</StaticCache>
+    <ColumnStore>false</ColumnStore>
+</Configuration>
+""")
+    shutil.copy(os.path.join(fp_case, 'obs.csv'), os.path.join(fp_case, f'obs_{mode}.csv'))
+    return fp_config
+
+
+def run_wellstats(fp_config, fp_profile=None):
+    """
+    Run WellStats.py on fp_config in a new process; with profiling if the 
+    path of its profile fp_profile is given.
+    Returns wall time [s] and the profile (see WellStats.Profiler; None if 
+    not profiled)
+    """
+    fp_ws = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'WellStats.py')
+    cmd = [sys.executable, fp_ws, fp_config] + (['--profile'] if fp_profile is not None else [])
+    t0 = time.perf_counter()
+    proc = subprocess.run(cmd, capture_output=True, text=True)
+    wall = time.perf_counter() - t0
+    if proc.returncode != 0:
+        sys.exit(f'ERROR: WellStats failed on {fp_config}:\n{proc.stdout[-2000:]}{proc.stderr[-2000:]}')
+    prof = None
+    if fp_profile is not None:
+        with open(fp_profile) as f:
+            prof = json.load(f)
+    return wall, prof
+
+
+def run_benchmark(nx_list, nz_list, nt_list, wells_list, dry_list, modes, fp_out, repeat=1, keep=False):
+    """
+    Run the benchmark matrix (see header); writes benchmark.json and
+    benchmark.csv to fp_out and returns the csv table as DataFrame
+    """
+    os.makedirs(fp_out, exist_ok=True)
+    runs = []
+    for nx, nz, nt, nwells, dry in itertools.product(nx_list, nz_list, nt_list, wells_list, dry_list):
+        case = f'nx{nx}_nz{nz}_nt{nt}_w{nwells}_dry{dry}'
+        fp_case = os.path.join(fp_out, case)
+        print(f'Case {case}: generating data')
+        t0 = time.perf_counter()
+        make_case(fp_case, nx, nz, nt, nwells, dry)
+        t_gen = time.perf_counter() - t0
+        nobs = len(pd.read_csv(os.path.join(fp_case, 'obs.csv'), sep='\t', usecols=[0]))
+        for mode in modes:
+            fp_config = write_config(fp_case, mode)
+            walls = [run_wellstats(fp_config)[0] for _ in range(repeat)]
+            wall_prof, prof = run_wellstats(fp_config, os.path.join(fp_case, f'obs_{mode}_profile.json'))
+            rss = [st['rss_peak_MB'] for st in prof['stages'] if st['rss_peak_MB'] is not None]
+            run = {'case': case, 'mode': mode, 'nx': nx, 'ny': nx, 'nz': nz, 'nt': nt, 'wells': nwells,
+                   'nobs': nobs, 'dry': dry, 'wall_s': min(walls), 'wall_profiled_s': wall_prof,
+                   'peak_rss_MB': max(rss) if len(rss) > 0 else None, 'generate_s': t_gen, 'profile': prof['stages']}
+            runs.append(run)
+            print(f'  {mode}: {run["wall_s"]:.2f} s, peak RSS {run["peak_rss_MB"]} MB')
+        if not keep:
+            shutil.rmtree(fp_case)
+
+    with open(os.path.join(fp_out, 'benchmark.json'), 'w') as f:
+        json.dump({'created': datetime.now().isoformat(timespec='seconds'), 'python': sys.version.split()[0],
+                   'numpy': np.__version__, 'pandas': pd.__version__, 'mikeio': mikeio.__version__,
+                   'runs': runs}, f, indent=1)
+    # csv: one row per run, with wall time of the main stages
+    rows = []
+    for run in runs:
+        row = {k: v for k, v in run.items() if k != 'profile'}
+        for st in run['profile']:
+            if st['level'] == 0:
+                row[f"{st['stage']} [s]"] = st['wall_s']
+        rows.append(row)
+    out = pd.DataFrame(rows)
+    out.to_csv(os.path.join(fp_out, 'benchmark.csv'), index=False)
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of WellStats on synthetic data')
+    parser.add_argument('--nx', type=int, nargs='+', default=[50], help='cells in x and y')
+    parser.add_argument('--nz', type=int, nargs='+', default=[6], help='computational layers')
+    parser.add_argument('--nt', type=int, nargs='+', default=[200], help='timesteps (daily)')
+    parser.add_argument('--wells', type=int, nargs='+', default=[150], help='number of wells')
+    parser.add_argument('--dry', type=float, nargs='+', default=[0.3], help='fraction of cells with dry upper layers')
+    parser.add_argument('--modes', nargs='+', default=['head', 'dtp', 'dtb'], choices=['head', 'dtp', 'dtb'])
+    parser.add_argument('--repeat', type=int, default=1, help='runs without profiling per case and mode')
+    parser.add_argument('--out', default='benchmark', help='output folder')
+    parser.add_argument('--keep', action='store_true', help='keep synthetic data')
+    args = parser.parse_args()
+    out = run_benchmark(args.nx, args.nz, args.nt, args.wells, args.dry, args.modes, args.out,
+                        repeat=args.repeat, keep=args.keep)
+    print(out.drop(columns=['case']).to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,11 +1,15 @@
-import re
-from collections import defaultdict
+import re, os, gc, glob, json, hashlib, warnings
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.cm as cm
 import mikeio
 import numpy as np
-import rioxarray
+from scipy import sparse
+import shapely
+import ColumnStore
+import WaterBalance
 import xarray
 from mikeio import ItemInfo, EUMType, EUMUnit
 
@@ -13,6 +17,7 @@ from mikeio import ItemInfo, EUMType, EUMUnit
 
 def clip_2_box(ds_big, bbox=[0,0,0,0], input_crs=None): # for trimming xarray datasets
     
+    import rioxarray # registers the .rio accessor of xarray (only needed here)
     xmin, ymin, xmax, ymax = bbox
 
     if type(ds_big) is mikeio.dataset._dataset.Dataset:
@@ -76,11 +81,784 @@ def ds_2_dfs2(ds, new_filename, original_dfs2=None, name=None, unit=None,type=No
             domain.plot(facecolor='none', edgecolor='black',ax=ax)
         plt.show()
 
+
+def box_slices(geometry, bbox):
+    """
+    Index slices (x, y) of the cells of a mikeio Grid2D geometry that intersect
+    the bounding box bbox = (xmin, ymin, xmax, ymax), e.g. from get_box
+    """
+    xmin, ymin, xmax, ymax = bbox
+    x = np.asarray(geometry.x); y = np.asarray(geometry.y)
+    ix = np.flatnonzero((x + geometry.dx / 2 > xmin) & (x - geometry.dx / 2 < xmax))
+    iy = np.flatnonzero((y + geometry.dy / 2 > ymin) & (y - geometry.dy / 2 < ymax))
+    if len(ix) == 0 or len(iy) == 0:
+        raise ValueError(f"Bounding box {bbox} does not overlap the grid.")
+    return slice(ix[0], ix[-1] + 1), slice(iy[0], iy[-1] + 1)
+
+
+def clip_dfs2_stream(filepath, new_filename, bbox, block=365, items=None):
+    """
+    Clip a dfs2 file to a bounding box and write it as a new dfs2 file, streamed
+    in blocks of timesteps: each block is read, clipped and appended to the new
+    file, so memory stays at one block however long the record is. Items, units,
+    projection and time axis are kept (no xarray/rioxarray round trip as with
+    clip_2_box and ds_2_dfs2).
+
+    Parameters:
+    - filepath: Path to the dfs2 file (e.g. climate input).
+    - new_filename: Path of the clipped dfs2 file.
+    - bbox: Bounding box (xmin, ymin, xmax, ymax), e.g. from get_box; all cells intersecting it are kept.
+    - block: Number of timesteps read and written at once (default 365).
+    - items: Items to keep (optional, default all).
+
+    Returns:
+        str: new_filename
+    """
+    dfs = mikeio.open(filepath)
+    sx, sy = box_slices(dfs.geometry, bbox)
+    nt = dfs.n_timesteps
+    dfs_out = None
+    for it_s in range(0, nt, block):
+        ds = mikeio.read(filepath, items=items, time=list(range(it_s, min(it_s + block, nt))))
+        ds = ds.isel(x=sx).isel(y=sy)
+        if dfs_out is None:
+            ds.to_dfs(new_filename)
+            dfs_out = mikeio.open(new_filename)
+        else:
+            dfs_out.append(ds, validate=False)
+        del ds
+        gc.collect() # mikeio datasets are reference cycles: free the block now, not some blocks later
+    return new_filename
+
+
+def clip_dfs2_files(filepaths, new_filenames, bbox, block=365, workers=1):
+    """
+    Clip several dfs2 files (e.g. the precipitation, reference ET and temperature
+    climate inputs) to the same bounding box with clip_dfs2_stream, in parallel
+    in worker processes if workers > 1.
+
+    Returns:
+        list: new_filenames
+    """
+    if len(filepaths) != len(new_filenames):
+        raise ValueError("'filepaths' and 'new_filenames' must have the same length.")
+    n = len(filepaths)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, n)) as pool:
+            return list(pool.map(clip_dfs2_stream, filepaths, new_filenames, [bbox] * n, [block] * n))
+    return [clip_dfs2_stream(fp, fp_new, bbox, block) for fp, fp_new in zip(filepaths, new_filenames)]
+
+
+def _axis_weights(xs, dxs, xt, dxt, method):
+    # 1D weights (target cell, source cell) between regular axes of cell centres xs, xt
+    if method == 'area':
+        # overlap length of target and source cells, relative to target cell size
+        lo = np.maximum((xt - dxt / 2)[:, None], (xs - dxs / 2)[None, :])
+        hi = np.minimum((xt + dxt / 2)[:, None], (xs + dxs / 2)[None, :])
+        return sparse.csr_matrix(np.clip(hi - lo, 0, None) / dxt)
+    if method == 'bilinear':
+        # linear between the two nearest source centres; nearest towards the
+        # edges of the source grid; none outside the source grid
+        pos = np.clip((xt - xs[0]) / dxs, 0, len(xs) - 1)
+        i0 = np.minimum(np.floor(pos).astype(int), max(len(xs) - 2, 0))
+        i1 = np.minimum(i0 + 1, len(xs) - 1)
+        w1 = pos - i0
+        inside = (xt > xs[0] - dxs / 2) & (xt < xs[-1] + dxs / 2)
+        rows = np.concatenate([np.arange(len(xt))] * 2)
+        w = sparse.csr_matrix((np.concatenate([(1 - w1) * inside, w1 * inside]),
+                               (rows, np.concatenate([i0, i1]))), shape=(len(xt), len(xs)))
+        w.eliminate_zeros()
+        return w
+    raise ValueError(f"Unknown method '{method}', must be 'area' or 'bilinear'.")
+
+
+def grid_signature(geometry):
+    """
+    Signature of a mikeio Grid2D geometry (origin, spacing, size and projection)
+    """
+    return {'x0': float(geometry.x[0]), 'dx': float(geometry.dx), 'nx': int(geometry.nx),
+            'y0': float(geometry.y[0]), 'dy': float(geometry.dy), 'ny': int(geometry.ny),
+            'projection': geometry.projection}
+
+
+def regrid_weights(source, target, method='area', cache_dir=None):
+    """
+    Sparse regridding weights from the source to the target grid (mikeio Grid2D,
+    e.g. a 10 km climate grid and the 100 m topography grid), as matrix
+    (target cell, source cell) of the cells flattened in (y, x) order.
+    Computed per axis and combined as Kronecker product.
+
+    Parameters:
+    - source, target: mikeio Grid2D geometries (regular, not rotated).
+    - method: 'area' (area weighted mean of the source cells overlapping a target cell)
+      or 'bilinear' (linear interpolation between source cell centres).
+    - cache_dir: Folder to cache the weights in, named by the signature of both grids
+      and method (optional, default no cache).
+
+    Returns:
+        scipy.sparse.csr_matrix: weights, rows sum to 1 (or 0 outside the source grid)
+    """
+    if cache_dir is not None:
+        key = json.dumps([grid_signature(source), grid_signature(target), method], sort_keys=True)
+        fp_cache = os.path.join(cache_dir, f"regrid_{hashlib.sha1(key.encode()).hexdigest()[:16]}.npz")
+        if os.path.exists(fp_cache):
+            return sparse.load_npz(fp_cache).tocsr()
+    wx = _axis_weights(np.asarray(source.x), source.dx, np.asarray(target.x), target.dx, method)
+    wy = _axis_weights(np.asarray(source.y), source.dy, np.asarray(target.y), target.dy, method)
+    weights = sparse.kron(wy, wx, format='csr')
+    # normalise (area: target cells partly outside the source grid)
+    total = np.asarray(weights.sum(axis=1)).ravel()
+    weights = sparse.diags(np.divide(1, total, out=np.zeros_like(total), where=total > 0)) @ weights
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        sparse.save_npz(fp_cache, weights)
+    return weights
+
+
+def regrid_dfs2(filepath, new_filename, target, method='area', block=30, cache_dir=None):
+    """
+    Regrid a dfs2 file (e.g. climate input) to a target grid and write it as a new
+    dfs2 file, streamed in blocks of timesteps: each block of timesteps is one
+    sparse matrix product with the weights from regrid_weights. Missing values
+    in the source are left out of the weighted mean (NaN if all are missing).
+
+    Parameters:
+    - filepath: Path to the dfs2 file.
+    - new_filename: Path of the regridded dfs2 file.
+    - target: Target grid, as mikeio Grid2D or path to a dfs2 file with it (e.g. topography).
+    - method: 'area' or 'bilinear' (see regrid_weights).
+    - block: Number of timesteps read and written at once (default 30; output on a fine grid is large).
+    - cache_dir: Folder to cache the weights in (optional, see regrid_weights).
+
+    Returns:
+        str: new_filename
+    """
+    if isinstance(target, str):
+        target = mikeio.open(target).geometry
+    dfs = mikeio.open(filepath)
+    weights = regrid_weights(dfs.geometry, target, method=method, cache_dir=cache_dir)
+    nt = dfs.n_timesteps
+    dfs_out = None
+    for it_s in range(0, nt, block):
+        ds = mikeio.read(filepath, time=list(range(it_s, min(it_s + block, nt))))
+        das = []
+        for da in ds:
+            values = da.to_numpy().reshape(da.n_timesteps, -1).T # (source cell, time)
+            valid = ~np.isnan(values)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                data = (weights @ np.where(valid, values, 0)) / (weights @ valid)
+            data = data.T.reshape(da.n_timesteps, target.ny, target.nx).astype(values.dtype)
+            das.append(mikeio.DataArray(data=data, time=ds.time, geometry=target, item=da.item))
+        ds_out = mikeio.Dataset(das)
+        if dfs_out is None:
+            ds_out.to_dfs(new_filename)
+            dfs_out = mikeio.open(new_filename)
+        else:
+            dfs_out.append(ds_out, validate=False)
+        del ds, das, ds_out
+        gc.collect() # mikeio datasets are reference cycles: free the block now, not some blocks later
+    return new_filename
+
+
+def zone_coverage(zones, geometry, names=None, supersample=5, cache_dir=None):
+    """
+    Fractional coverage of the cells of a grid by polygon zones (e.g. catchment and
+    sub-catchments), rasterized once by testing supersample x supersample points per cell.
+
+    Parameters:
+    - zones: Polygons, as GeoDataFrame/GeoSeries (e.g. of Skjern.shp), list of shapely geometries or one geometry.
+    - geometry: mikeio Grid2D/Grid3D geometry (e.g. of the file to compute zonal statistics of).
+    - names: Names of the zones (optional, default: index of the GeoDataFrame, else 0, 1, ...).
+    - supersample: Number of sample points per cell along each axis (default 5).
+    - cache_dir: Folder to cache the coverage in, named by grid, zones and supersample (optional).
+
+    Returns:
+        scipy.sparse.csr_matrix: covered fraction (zone, cell), cells flattened in (y, x) order
+        list: zone names
+    """
+    if isinstance(zones, shapely.Geometry):
+        zones = [zones]
+    geoms = list(zones.geometry) if hasattr(zones, 'geometry') else list(zones)
+    if names is None:
+        names = list(zones.index) if hasattr(zones, 'geometry') else list(range(len(geoms)))
+    if cache_dir is not None:
+        sha1 = hashlib.sha1(json.dumps([grid_signature(geometry), supersample], sort_keys=True).encode())
+        for geom in geoms:
+            sha1.update(shapely.to_wkb(geom))
+        fp_cache = os.path.join(cache_dir, f"zones_{sha1.hexdigest()[:16]}.npz")
+        if os.path.exists(fp_cache):
+            return sparse.load_npz(fp_cache).tocsr(), names
+    x = np.asarray(geometry.x); y = np.asarray(geometry.y)
+    # sample points in a cell, relative to its centre
+    offs = (np.arange(supersample) + 0.5) / supersample - 0.5
+    rows, cols, vals = [np.zeros(0, dtype=int)], [np.zeros(0, dtype=int)], [np.zeros(0)]
+    for iz, geom in enumerate(geoms):
+        shapely.prepare(geom)
+        xmin, ymin, xmax, ymax = geom.bounds
+        ix = np.flatnonzero((x + geometry.dx / 2 > xmin) & (x - geometry.dx / 2 < xmax))
+        iy = np.flatnonzero((y + geometry.dy / 2 > ymin) & (y - geometry.dy / 2 < ymax))
+        px = (x[ix][:, None] + offs[None, :] * geometry.dx).ravel()
+        # 64 rows of cells at a time, to limit the number of points in memory
+        for iy_s in range(0, len(iy), 64):
+            iy_b = iy[iy_s:iy_s + 64]
+            py = (y[iy_b][:, None] + offs[None, :] * geometry.dy).ravel()
+            inside = shapely.contains_xy(geom, px[None, :], py[:, None])
+            frac = inside.reshape(len(iy_b), supersample, len(ix), supersample).mean(axis=(1, 3))
+            jy, jx = np.nonzero(frac)
+            rows.append(np.full(len(jy), iz)); cols.append(iy_b[jy] * len(x) + ix[jx]); vals.append(frac[jy, jx])
+    coverage = sparse.csr_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+                                 shape=(len(geoms), len(x) * len(y)))
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        sparse.save_npz(fp_cache, coverage)
+    return coverage, names
+
+
+def zonal_stats(filepath, zones, varname=None, layerID=None, stats=('mean',), names=None, block=365,
+                supersample=5, cache_dir=None, dfs0_filename=None):
+    """
+    Zonal statistics of a dfs2/dfs3 file (e.g. precipitation, actual ET, recharge, depth
+    to phreatic) for all timesteps, streamed in blocks of timesteps with vectorized
+    reductions over the cells of each zone (see zone_coverage). Missing values are
+    left out.
+
+    Parameters:
+    - filepath: Path to the dfs2/dfs3 file.
+    - zones: Polygons (see zone_coverage).
+    - varname: Item to use (optional, default first item).
+    - layerID: Layer index for dfs3 files (required for dfs3).
+    - stats: Statistics per zone and timestep: 'mean' and 'sum' (weighted by the covered
+      fraction of cells), and 'min', 'max' and percentiles, e.g. 'p10', 'p50', 'p90'
+      (over the cells covered by at least half).
+    - names: Names of the zones (optional, see zone_coverage).
+    - block: Number of timesteps read at once (default 365).
+    - supersample, cache_dir: See zone_coverage.
+    - dfs0_filename: Path of dfs0 file to write the statistics to (optional), items named '<zone> <stat>'.
+
+    Returns:
+        pd.DataFrame: statistics with time index and columns (zone, stat)
+    """
+    dfs = mikeio.open(filepath)
+    if varname is None:
+        varname = dfs.items[0].name
+    if len(dfs.geometry.default_dims) == 3 and layerID is None:
+        raise ValueError("'layerID' must be provided for dfs3 files.")
+    for stat in stats:
+        if not (stat in ['mean', 'sum', 'min', 'max'] or re.fullmatch(r'p\d+(\.\d+)?', stat)):
+            raise ValueError(f"Unknown statistic '{stat}'.")
+    coverage, names = zone_coverage(zones, dfs.geometry, names=names, supersample=supersample, cache_dir=cache_dir)
+    valid_cov = np.asarray(coverage.sum(axis=1)).ravel() > 0
+    # cells covered by at least half, per zone (for min, max, percentiles)
+    majority = [coverage[iz].indices[coverage[iz].data >= 0.5] for iz in range(coverage.shape[0])]
+    nt = dfs.n_timesteps
+    out = []
+    for it_s in range(0, nt, block):
+        read_kwargs = {} if layerID is None else {'layers': layerID}
+        da = mikeio.read(filepath, items=varname, time=list(range(it_s, min(it_s + block, nt))), **read_kwargs)[varname]
+        values = da.to_numpy().reshape(da.n_timesteps, -1).T # (cell, time)
+        valid = ~np.isnan(values)
+        filled = np.where(valid, values, 0)
+        res = {}
+        with np.errstate(invalid='ignore', divide='ignore'), warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning) # all-NaN zones
+            if 'mean' in stats:
+                res['mean'] = (coverage @ filled) / (coverage @ valid)
+            if 'sum' in stats:
+                res['sum'] = np.where(valid_cov[:, None], coverage @ filled, np.nan)
+            for stat in stats:
+                if stat in ['min', 'max'] or stat.startswith('p'):
+                    res[stat] = np.full((len(names), da.n_timesteps), np.nan)
+                    for iz, cells in enumerate(majority):
+                        if len(cells) == 0:
+                            continue
+                        if stat == 'min':
+                            res[stat][iz] = np.nanmin(values[cells], axis=0)
+                        elif stat == 'max':
+                            res[stat][iz] = np.nanmax(values[cells], axis=0)
+                        else:
+                            res[stat][iz] = np.nanpercentile(values[cells], float(stat[1:]), axis=0)
+        columns = pd.MultiIndex.from_tuples([(name, stat) for name in names for stat in stats], names=['zone', 'stat'])
+        data = np.stack([res[stat][iz] for iz in range(len(names)) for stat in stats], axis=1)
+        out.append(pd.DataFrame(data, index=pd.DatetimeIndex(da.time), columns=columns))
+        del da, values, valid, filled
+        gc.collect() # mikeio datasets are reference cycles: free the block now, not some blocks later
+    df = pd.concat(out)
+    if dfs0_filename is not None:
+        item = dfs.items[[it.name for it in dfs.items].index(varname)]
+        df_flat = df.copy()
+        df_flat.columns = [f'{name} {stat}' for name, stat in df.columns]
+        mikeio.from_pandas(df_flat, items={col: ItemInfo(col, item.type, item.unit) for col in df_flat.columns}).to_dfs(dfs0_filename)
+    return df
+
+
+def point_cells(geometry, x, y):
+    """
+    Nearest cell (iy, ix) of points x, y in a mikeio Grid2D/Grid3D geometry, and
+    mask of the points outside the grid
+    """
+    xc = np.asarray(geometry.x); yc = np.asarray(geometry.y)
+    x = np.asarray(x, dtype=float); y = np.asarray(y, dtype=float)
+    # points on a cell edge go to the upper cell, as ColumnStore.extract_points (np.round would halve to even)
+    ix = np.clip(np.floor((x - xc[0]) / geometry.dx + 0.5).astype(int), 0, len(xc) - 1)
+    iy = np.clip(np.floor((y - yc[0]) / geometry.dy + 0.5).astype(int), 0, len(yc) - 1)
+    outside = (np.abs(xc[ix] - x) > geometry.dx / 2) | (np.abs(yc[iy] - y) > geometry.dy / 2)
+    return iy, ix, outside
+
+
+def extract_points(filepath, points, varname=None, layer=None, names=None, block=365, use_store=True,
+                   dfs0_filename=None):
+    """
+    Time series of many points (e.g. wells, discharge gauges, flux towers) from a
+    dfs2/dfs3 file (e.g. *_2DSZ.dfs2, *_ET_UzCells.dfs2, *_3DSZflow.dfs3), in the
+    nearest cell. The cells are found once and the file is read a single time, in
+    blocks of timesteps, gathering all points per block. If the file has been
+    converted to a column store (see ColumnStore.py), only the cells of the points
+    are read from the store instead.
+
+    Parameters:
+    - filepath: Path to the dfs2/dfs3 file.
+    - points: pd.DataFrame with columns 'x', 'y' and optionally 'layer' (index used as names), or array (point, [x, y]).
+    - varname: Item to extract (optional, default first item).
+    - layer: Layer index for dfs3 files (0: lowest layer), for all points; required for dfs3 if points has no 'layer' column.
+    - names: Names of the points (optional, default index of points, or 0..n-1).
+    - block: Number of timesteps read at once (default 365).
+    - use_store: Read from the column store of the file, if converted (default True).
+    - dfs0_filename: Path of dfs0 file to write the time series to (optional), items named by the points.
+
+    Returns:
+        pd.DataFrame: time series with time index and one column per point (NaN for points outside the grid)
+    """
+    if isinstance(points, pd.DataFrame):
+        x = points['x'].to_numpy(dtype=float); y = points['y'].to_numpy(dtype=float)
+        if 'layer' in points.columns and layer is None:
+            layer = points['layer'].to_numpy(dtype=int)
+        if names is None:
+            names = list(points.index)
+    else:
+        points = np.asarray(points, dtype=float)
+        x, y = points[:, 0], points[:, 1]
+    if names is None:
+        names = list(range(len(x)))
+    if len(names) != len(x):
+        raise ValueError("'names' must have one name per point.")
+
+    dfs = mikeio.open(filepath)
+    if varname is None:
+        varname = dfs.items[0].name
+    is_dfs3 = len(dfs.geometry.default_dims) == 3
+    if is_dfs3:
+        if layer is None:
+            raise ValueError("'layer' (or a 'layer' column in points) must be provided for dfs3 files.")
+        layer = np.broadcast_to(np.asarray(layer, dtype=int), x.shape)
+        nz = dfs.geometry.nz
+        if np.any((layer < 0) | (layer >= nz)):
+            raise ValueError(f"Layers must be between 0 and {nz - 1}.")
+    store = ColumnStore.open_store(filepath, varname) if use_store else None
+    if store is not None:
+        df = store.extract_points(x, y, layer=layer if is_dfs3 else None, names=names)
+    else:
+        iy, ix, outside = point_cells(dfs.geometry, x, y)
+        nt = dfs.n_timesteps
+        data = np.full((nt, len(x)), np.nan)
+        for it_s in range(0, nt, block):
+            it_e = min(it_s + block, nt)
+            values = mikeio.read(filepath, items=varname, time=list(range(it_s, it_e)))[varname].to_numpy()
+            data[it_s:it_e] = values[:, layer, iy, ix] if is_dfs3 else values[:, iy, ix]
+            del values
+            gc.collect() # mikeio datasets are reference cycles: free the block now, not some blocks later
+        data[:, outside] = np.nan
+        df = pd.DataFrame(data, index=pd.DatetimeIndex(dfs.time), columns=names)
+    if dfs0_filename is not None:
+        item = dfs.items[[it.name for it in dfs.items].index(varname)]
+        df_out = df.copy()
+        df_out.columns = [str(name) for name in df.columns]
+        mikeio.from_pandas(df_out, items={col: ItemInfo(col, item.type, item.unit) for col in df_out.columns}).to_dfs(dfs0_filename)
+    return df
+
+
+def _read_station_dfs0(filepath):
+    # time and values of the first item of a station dfs0 file
+    da = mikeio.read(filepath)[0]
+    return pd.DatetimeIndex(da.time), da.to_numpy()
+
+
+# increase when the layout of the station cache of read_station_dfs0 changes
+STATION_CACHE_VERSION = 1
+
+
+def _read_station_cache(fp_cache, value_name):
+    # cached station table: manifest (station IDs, files) and time, values, codes (index of station ID)
+    try:
+        with np.load(fp_cache, allow_pickle=False) as npz:
+            manifest = json.loads(str(npz['manifest']))
+            if manifest.get('version') != STATION_CACHE_VERSION or manifest.get('value_name') != value_name:
+                return None
+            return {'stations': manifest['stations'], 'files': manifest['files'],
+                    'time': npz['time'], 'values': npz['values'], 'codes': npz['codes']}
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def _write_station_cache(fp_cache, df, value_name, station_ids, fingerprints):
+    manifest = {'version': STATION_CACHE_VERSION, 'value_name': value_name, 'stations': station_ids, 'files': fingerprints}
+    try:
+        with open(fp_cache, 'wb') as f: # file object: keep the name as given (np.savez would add .npz)
+            np.savez(f, manifest=np.array(json.dumps(manifest)), time=np.asarray(df.index, dtype='datetime64[ns]'),
+                     values=df[value_name].to_numpy(), codes=df['StationID'].cat.codes.to_numpy())
+    except OSError:
+        pass # e.g. read-only folder: not cached
+
+
+def read_station_dfs0(filepaths, value_name='WTD', workers=8, cache=None):
+    """
+    Read the observation time series of many stations, one dfs0 file per station
+    (e.g. observations/H_data/H_data_filtered/*.dfs0), in parallel with a pool of
+    threads, into one long format DataFrame. The station ID is the file name
+    without extension.
+
+    Parameters:
+    - filepaths: List of dfs0 files, or glob pattern.
+    - value_name: Name of the value column (default 'WTD').
+    - workers: Number of threads reading files (default 8).
+    - cache: Path of npz file to keep the table in (optional). Only files that are new or
+      changed (size or modification time) since the last call are read again, stations of
+      files that are gone are dropped. The files read are recorded in its manifest.
+
+    Returns:
+        pd.DataFrame: time index and columns value_name and 'StationID' (categorical)
+    """
+    if isinstance(filepaths, str):
+        filepaths = glob.glob(filepaths)
+    filepaths = sorted(filepaths)
+    station_ids = [os.path.splitext(os.path.basename(fp))[0] for fp in filepaths]
+    if len(set(station_ids)) < len(station_ids):
+        raise ValueError("Station IDs (file names) must be unique.")
+    fingerprints = {}
+    for sid, fp in zip(station_ids, filepaths):
+        st = os.stat(fp)
+        fingerprints[sid] = [os.path.abspath(fp), st.st_size, st.st_mtime_ns]
+
+    cached = None; manifest = {}
+    if cache is not None and os.path.exists(cache):
+        cached = _read_station_cache(cache, value_name)
+        if cached is not None:
+            manifest = cached['files']
+    keep = [sid for sid in station_ids if manifest.get(sid) == fingerprints[sid]]
+    to_read = [(sid, fp) for sid, fp in zip(station_ids, filepaths) if sid not in keep]
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        series = list(pool.map(_read_station_dfs0, [fp for _, fp in to_read]))
+    times = [t for t, _ in series]; values = [v for _, v in series]
+    code = {sid: i for i, sid in enumerate(station_ids)}
+    codes = [np.full(len(t), code[sid]) for (sid, _), t in zip(to_read, times)]
+    if cached is not None and len(keep) > 0:
+        keep_set = set(keep)
+        cached_codes = np.array([code[sid] if sid in keep_set else -1 for sid in cached['stations']], dtype=int)[cached['codes']]
+        sel = cached_codes >= 0
+        times.append(pd.DatetimeIndex(cached['time'][sel]))
+        values.append(cached['values'][sel])
+        codes.append(cached_codes[sel])
+    if len(times) == 0:
+        df = pd.DataFrame({value_name: np.array([], dtype=float), 'StationID': pd.Categorical([], categories=station_ids)},
+                          index=pd.DatetimeIndex([]))
+    else:
+        codes = np.concatenate(codes)
+        # stations in the order of the files, time ordered within a station
+        order = np.lexsort((np.concatenate([np.asarray(t) for t in times]), codes))
+        df = pd.DataFrame({value_name: np.concatenate(values)[order],
+                           'StationID': pd.Categorical.from_codes(codes[order], categories=station_ids)},
+                          index=pd.DatetimeIndex(np.concatenate([np.asarray(t) for t in times])[order]))
+
+    if cache is not None and (len(to_read) > 0 or set(manifest) != set(station_ids)):
+        _write_station_cache(cache, df, value_name, station_ids, fingerprints)
+    return df
+
+
+def skill_table(obs, mod, metrics=('kge', 'cc', 'nse', 'rmse', 'bias'), time1=None, time2=None, by=None):
+    """
+    Skill of the model at many stations (e.g. discharge gauges, wells) at once: the
+    model series are interpolated in time to the observation times (as modelskill
+    match) and the metrics are computed for all stations in one pass over 2D arrays
+    (time, station), leaving out missing values. Same metrics and table layout as
+    modelskill Comparer.skill().
+
+    Parameters:
+    - obs: Observations, pd.DataFrame with time index and one column per station, or long format
+      (one value column and column 'StationID', e.g. from read_station_dfs0).
+    - mod: Model results, pd.DataFrame with time index and one column per station (e.g. detailed time series dfs0).
+    - metrics: Metrics among 'kge', 'cc', 'nse', 'rmse', 'bias' (default all).
+    - time1, time2: Period (optional, default all).
+    - by: None, or 'month', 'season' (DJF, MAM, JJA, SON) or 'year' for the skill per group.
+
+    Returns:
+        pd.DataFrame: columns 'n' and metrics, index station ('observation'), or (station, group) if by is given
+    """
+    for metric in metrics:
+        if metric not in ['kge', 'cc', 'nse', 'rmse', 'bias']:
+            raise ValueError(f"Unknown metric '{metric}'.")
+    if by not in [None, 'month', 'season', 'year']:
+        raise ValueError(f"Unknown by '{by}', must be None, 'month', 'season' or 'year'.")
+    if 'StationID' in obs.columns:
+        value = [col for col in obs.columns if col != 'StationID'][0]
+        obs = obs.pivot_table(index=obs.index, columns='StationID', values=value, observed=True)
+    stations = [col for col in obs.columns if col in mod.columns]
+    if len(stations) == 0:
+        raise ValueError("No stations (columns) in both 'obs' and 'mod'.")
+    obs = obs[stations].sort_index().loc[time1:time2]
+    O = obs.to_numpy(dtype=float)
+    # linear in time between the non-missing model values, none outside them
+    mod = mod[stations].sort_index()
+    mod = mod[~mod.index.duplicated()]
+    M = mod.reindex(mod.index.union(obs.index)).interpolate(method='time', limit_area='inside')
+    M = M.reindex(obs.index).to_numpy(dtype=float)
+
+    time = pd.DatetimeIndex(obs.index)
+    if by is None:
+        codes = np.zeros(len(time), dtype=int); groups = [None]
+    elif by == 'month':
+        codes = time.month.values - 1; groups = list(range(1, 13))
+    elif by == 'season':
+        codes = time.month.values % 12 // 3; groups = SEASONS
+    else:
+        groups = list(range(time.year.min(), time.year.max() + 1)) if len(time) else []
+        codes = time.year.values - (groups[0] if groups else 0)
+
+    tables = []
+    for ig, group in enumerate(groups):
+        rows = codes == ig
+        o = O[rows]; m = M[rows]
+        valid = ~np.isnan(o) & ~np.isnan(m)
+        n = valid.sum(axis=0)
+        o = np.where(valid, o, 0); m = np.where(valid, m, 0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean_o = o.sum(axis=0) / n; mean_m = m.sum(axis=0) / n
+            do = np.where(valid, o - mean_o, 0); dm = np.where(valid, m - mean_m, 0)
+            std_o = np.sqrt((do ** 2).sum(axis=0) / n); std_m = np.sqrt((dm ** 2).sum(axis=0) / n)
+            cc = (do * dm).sum(axis=0) / n / (std_o * std_m)
+            cc = np.where(n > 1, cc, np.nan)
+            sse = ((m - o) ** 2).sum(axis=0)
+            res = {'n': n,
+                   'bias': mean_m - mean_o,
+                   'rmse': np.sqrt(sse / n),
+                   'nse': 1 - sse / (do ** 2).sum(axis=0),
+                   'cc': cc}
+            # as modelskill: no correlation if the model is constant
+            r = np.where((std_m > 1e-12) & ~np.isnan(cc), cc, 0.0)
+            kge = 1 - np.sqrt((r - 1) ** 2 + (std_m / std_o - 1) ** 2 + (mean_m / mean_o - 1) ** 2)
+            res['kge'] = np.where((n > 0) & (std_o > 0), kge, np.nan)
+        table = pd.DataFrame({col: res[col] for col in ['n', *metrics]}, index=pd.Index(stations, name='observation'))
+        table = table[n > 0]
+        if by is not None:
+            table.index = pd.MultiIndex.from_arrays([table.index, [group] * len(table)], names=['observation', by])
+        tables.append(table)
+    table = pd.concat(tables)
+    if by is not None:
+        table = table.sort_index(level='observation', sort_remaining=False, key=lambda idx: idx.map(stations.index))
+    return table
+
+
+class RiverNetwork:
+    """
+    Index of the river links of a MIKE SHE setup (e.g. <setup>_RiverLinks.shp), built
+    once: spatial index of the links, and the links of each branch ordered by chainage.
+    Used to resolve gauge stations to branch and chainage (station_table), and to read
+    their simulated discharge (read_m11_stations).
+
+    Parameters:
+    - links: River links as GeoDataFrame (line geometries, with branch and chainage columns).
+    - branch_field, chainage_field: Names of the branch and chainage columns (default 'Branch', 'Chainage').
+    """
+
+    def __init__(self, links, branch_field='Branch', chainage_field='Chainage'):
+        self.geometry = np.asarray(links.geometry)
+        self.branch = np.asarray(links[branch_field]).astype(str)
+        self.chainage = np.asarray(links[chainage_field], dtype=float)
+        self.centroid = shapely.centroid(self.geometry)
+        self.tree = shapely.STRtree(self.geometry)
+        self.branches = {}
+        for branch in np.unique(self.branch):
+            ilink = np.flatnonzero(self.branch == branch)
+            self.branches[branch] = ilink[np.argsort(self.chainage[ilink], kind='stable')]
+        sha1 = hashlib.sha1(self.branch.astype('U').tobytes() + self.chainage.tobytes())
+        for geom in self.geometry:
+            sha1.update(shapely.to_wkb(geom))
+        self.sha1 = sha1.hexdigest()
+
+    def locate(self, branch, chainage):
+        """
+        Link of each (branch, chainage): the link of the branch with the nearest chainage
+        """
+        ilinks = []
+        for b, ch in zip(np.atleast_1d(branch), np.atleast_1d(chainage)):
+            if str(b) not in self.branches:
+                raise ValueError(f"Branch '{b}' is not in the river network.")
+            ilink = self.branches[str(b)]
+            ilinks.append(ilink[np.abs(self.chainage[ilink] - ch).argmin()])
+        return np.array(ilinks, dtype=int)
+
+    def snap(self, x, y):
+        """
+        Nearest link of each point x, y, and the distance to it
+        """
+        points = shapely.points(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+        (ipoint, ilink), dist = self.tree.query_nearest(points, return_distance=True, all_matches=False)
+        out_link = np.empty(len(points), dtype=int); out_dist = np.empty(len(points))
+        out_link[ipoint] = ilink; out_dist[ipoint] = dist
+        return out_link, out_dist
+
+    def station_table(self, stations, cache_dir=None):
+        """
+        Branch, chainage and location on the river of gauge stations.
+
+        Parameters:
+        - stations: pd.DataFrame indexed by station ID, with columns 'x', 'y' (snapped to the nearest
+          link) or 'branch', 'chainage' (link of the branch with the nearest chainage).
+        - cache_dir: Folder to cache the table in, named by river network and stations (optional).
+
+        Returns:
+            pd.DataFrame: columns 'stationID', 'branch', 'chainage', 'x', 'y' (centroid of the link, or
+            nearest point on the link for snapped stations) and 'distance' (of snapped stations to the link)
+        """
+        if cache_dir is not None:
+            sha1 = hashlib.sha1((self.sha1 + stations.to_csv()).encode())
+            fp_cache = os.path.join(cache_dir, f"stations_{sha1.hexdigest()[:16]}.csv")
+            if os.path.exists(fp_cache):
+                return pd.read_csv(fp_cache, dtype={'stationID': str, 'branch': str})
+        if {'x', 'y'} <= set(stations.columns):
+            ilink, dist = self.snap(stations['x'], stations['y'])
+            points = shapely.points(stations['x'].to_numpy(dtype=float), stations['y'].to_numpy(dtype=float))
+            on_river = shapely.line_interpolate_point(self.geometry[ilink], shapely.line_locate_point(self.geometry[ilink], points))
+        elif {'branch', 'chainage'} <= set(stations.columns):
+            ilink = self.locate(stations['branch'], stations['chainage'])
+            dist = np.zeros(len(ilink)); on_river = self.centroid[ilink]
+        else:
+            raise ValueError("'stations' must have columns 'x' and 'y', or 'branch' and 'chainage'.")
+        table = pd.DataFrame({'stationID': [str(sid) for sid in stations.index], 'branch': self.branch[ilink],
+                              'chainage': self.chainage[ilink], 'x': shapely.get_x(on_river),
+                              'y': shapely.get_y(on_river), 'distance': dist})
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            table.to_csv(fp_cache, index=False)
+        return table
+
+
+def read_m11_stations(filepath, stations):
+    """
+    Simulated time series (e.g. discharge) of many gauge stations from a MIKE SHE
+    detailed time series dfs0 file (e.g. <setup>DetailedTS_M11.dfs0), read at once.
+    The item of a station is named by its station ID (optionally followed by a
+    description, e.g. 'Q250018: Discharge'), or by its branch and chainage (e.g.
+    'SKJERN_AA_DK5 54135').
+
+    Parameters:
+    - filepath: Path to the dfs0 file.
+    - stations: Station table (see RiverNetwork.station_table), or list of station IDs.
+
+    Returns:
+        pd.DataFrame: time series with time index and one column per station found in the file
+    """
+    if not isinstance(stations, pd.DataFrame):
+        stations = pd.DataFrame({'stationID': [str(sid) for sid in stations]})
+    names = [it.name for it in mikeio.open(filepath).items]
+    items = {}
+    for _, row in stations.iterrows():
+        sid = str(row['stationID'])
+        keys = [sid]
+        if 'branch' in row and 'chainage' in row:
+            keys.append(f"{row['branch']} {row['chainage']:g}")
+        for name in names:
+            if any(name == key or re.match(re.escape(key) + r'\W', name) for key in keys):
+                items[sid] = name
+                break
+    if len(items) == 0:
+        raise ValueError(f"No items of the stations found in {filepath}.")
+    df = mikeio.read(filepath, items=list(items.values())).to_dataframe()
+    df.columns = list(items.keys())
+    return df
+
+
+# vegetation (VEGNAME in DK_2018_Veg_Prop_inv_100m.etv) of the grid codes of DK_Landuse_9classes_5cropsCorr_100m_MB500.dfs2
+LANDUSE_VEGETATION = {2: 'Permanent grass', 3: 'Decidious forest', 4: 'needleleaf forest', 5: 'Heath',
+                      6: 'lake', 7: 'Urban', 8: 'water', 9: 'Suburban',
+                      11: 'WWheat_JB1', 12: 'WWheat_JB2', 13: 'WWheat_JB3-JB4', 14: 'WWheat_JB5-JB8',
+                      21: 'SBarley_JB1', 22: 'SBarley_JB2', 23: 'SBarley_JB3-JB4', 24: 'SBarley_JB5-JB8',
+                      31: 'Grass_JB1', 32: 'Grass_JB2', 33: 'Grass_JB3-JB4', 34: 'Grass_JB5-JB8',
+                      41: 'Maize_JB1', 42: 'Maize_JB2', 43: 'Maize_JB3-JB4', 44: 'Maize_JB5-JB8',
+                      51: 'Root_veg_JB1', 52: 'Root_veg_JB2', 53: 'Root_veg_JB3-JB4', 54: 'Root_veg_JB5-JB8'}
+
+# item type of the vegetation variables of a .etv file in dfs2 (default unit, e.g. millimeter root depth)
+ETV_ITEMS = {'LAI': EUMType.Leaf_Area_Index, 'ROOT': EUMType.Root_Depth, 'Kc': EUMType.Crop_Coefficient}
+
+# parsed .etv files: absolute path -> ((size, modification time), (stages, vegetation))
+_etv_cache = {}
+
+
+def _pfs_value(value):
+    # value of a line 'KEY = value' of a PFS file (e.g. .etv): string, number or as is
+    if value.startswith("'") and value.endswith("'"):
+        return value[1:-1]
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def parse_etv(filepath):
+    """
+    Parse a MIKE SHE .etv vegetation file in one pass: all variables of all vegetations
+    and their stages. The result is cached per file (size, modification time), so
+    repeated calls (e.g. for LAI, ROOT and Kc) do not parse the file again.
+
+    Parameters:
+    - filepath: Path to the .etv file.
+
+    Returns:
+        pd.DataFrame: one row per vegetation and stage (index VEGNAME, Stage), with the stage variables
+        of all sections (END_DAY, LAI, ROOT, Kc, Ky, irrigation settings), NaN where a section has no such stage
+        pd.DataFrame: one row per vegetation (index VEGNAME), with VegNo and its other parameters (e.g. C1, C2, C3, A_ROOT)
+    """
+    st = os.stat(filepath)
+    key = os.path.abspath(filepath)
+    if key in _etv_cache and _etv_cache[key][0] == (st.st_size, st.st_mtime_ns):
+        stages, vegetation = _etv_cache[key][1]
+        return stages.copy(), vegetation.copy()
+    stages = {}; vegetation = {}
+    path = []; veg = None
+    with open(filepath, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('['):
+                path.append(line[1:line.index(']')])
+                if re.fullmatch(r'VegNo_\d+', path[-1]):
+                    veg = {'VegNo': int(path[-1][6:])}
+                continue
+            if line.startswith('EndSect'):
+                if path.pop().startswith('VegNo_') and veg is not None:
+                    vegetation[veg.get('VEGNAME', f"VegNo_{veg['VegNo']}")] = veg
+                    veg = None
+                continue
+            if veg is None or '=' not in line:
+                continue
+            name, value = [part.strip() for part in line.split('=', 1)]
+            if name in ['Touched', 'MzSEPfsListItemCount', 'NO_ITEM']:
+                continue
+            if path[-1].startswith('Stage_'):
+                # stages of the vegetation development, growth model, irrigation and stage end days
+                stages.setdefault((veg.get('VEGNAME', f"VegNo_{veg['VegNo']}"), int(path[-1][6:])), {})[name] = _pfs_value(value)
+            else:
+                veg[name] = _pfs_value(value)
+    stages = pd.DataFrame.from_dict(stages, orient='index')
+    stages.index = pd.MultiIndex.from_tuples(stages.index, names=['VEGNAME', 'Stage'])
+    vegetation = pd.DataFrame.from_dict(vegetation, orient='index').rename_axis('VEGNAME')
+    _etv_cache[key] = ((st.st_size, st.st_mtime_ns), (stages, vegetation))
+    return stages.copy(), vegetation.copy()
+
+
 def read_plot_etv(filepath, variable='LAI', plot=True):
     """
     Built with help from CHATGPT 2025-07-15
 
-    Parse a MIKE SHE .etv vegetation file and plot the selected variable (e.g., LAI, ROOT, Kc)
+    Parse a MIKE SHE .etv vegetation file (see parse_etv) and plot the selected variable (e.g., LAI, ROOT, Kc)
     
     Parameters:
         filepath (str): Path to the .etv file
@@ -90,49 +868,11 @@ def read_plot_etv(filepath, variable='LAI', plot=True):
     Returns:
         dict of pd.DataFrame: Dictionary of vegetation name -> DataFrame with columns ['Stage', variable]
     """
-    veg_data = defaultdict(list)
-    current_veg = None
-    current_stage = None
-    veg_name = None
-
-    with open(filepath, 'r') as f:
-        lines = f.readlines()
-
-    for line in lines:
-        line = line.strip()
-        
-        # Start of a vegetation block
-        veg_match = re.match(r'\[VegNo_(\d+)\]', line)
-        if veg_match:
-            current_veg = f'VegNo_{veg_match.group(1)}'
-            veg_name = None
-            continue
-
-        # Get VEGNAME
-        if 'VEGNAME' in line and current_veg:
-            match = re.search(r"VEGNAME\s*=\s*'([^']+)'", line)
-            if match:
-                veg_name = match.group(1)
-
-        # Start of a stage
-        stage_match = re.match(r'\[Stage_(\d+)\]', line)
-        if stage_match and veg_name:
-            current_stage = int(stage_match.group(1))
-            continue
-
-        # Extract the target variable
-        if line.startswith(variable) and current_stage is not None and veg_name:
-            try:
-                value = float(line.split('=')[1].strip())
-                veg_data[veg_name].append({'Stage': current_stage, variable: value})
-            except ValueError:
-                continue  # Skip malformed lines
-
-    # Create DataFrames
+    stages, _ = parse_etv(filepath)
     veg_dfs = {}
-    for veg_name, stage_data in veg_data.items():
-        df = pd.DataFrame(stage_data).sort_values('Stage')
-        veg_dfs[veg_name] = df
+    if variable in stages.columns:
+        for veg_name, df in stages[variable].dropna().groupby(level='VEGNAME', sort=False):
+            veg_dfs[veg_name] = pd.DataFrame({'Stage': df.index.get_level_values('Stage'), variable: df.to_numpy()})
 
     if plot:
         n_veg = len(veg_dfs)
@@ -155,9 +895,296 @@ def read_plot_etv(filepath, variable='LAI', plot=True):
 
 
     return veg_dfs
-def plot_dfs2_output(filepath, varname=None, timeID=0, ax=None, shapefile=None,layerID=None, time1=None, time2=None):
+
+
+def vegetation_lookup(stages, variable, codes=None, interp='linear'):
+    """
+    Lookup array of a vegetation variable by day of year and grid code: the value
+    of the variable of the vegetation of each code (e.g. LANDUSE_VEGETATION) on
+    each day, from the stage values and stage end days of parse_etv.
+
+    Parameters:
+    - stages: Stages of parse_etv (index VEGNAME, Stage; columns END_DAY and variable).
+    - variable: Stage variable (e.g. 'LAI', 'ROOT', 'Kc').
+    - codes: Dictionary grid code -> vegetation name (default LANDUSE_VEGETATION).
+    - interp: 'linear' (default): linear between the stage values at their end days, 'stage': value of the stage the day is in.
+
+    Returns:
+        np.ndarray: (367, max code + 2) array, row = day of year (1-366, row 0 = day 0), column = code;
+        NaN for codes without vegetation and in the last column (for grid cells without code, see vegetation_grids)
+    """
+    codes = LANDUSE_VEGETATION if codes is None else codes
+    if interp not in ['linear', 'stage']:
+        raise ValueError(f"Unknown interp '{interp}', must be 'linear' or 'stage'")
+    if variable not in stages.columns:
+        raise ValueError(f"No stage variable '{variable}' in the .etv file.")
+    lut = np.full((367, max(codes) + 2), np.nan)
+    days = np.arange(367)
+    names = stages.index.get_level_values('VEGNAME')
+    for code, veg_name in codes.items():
+        if veg_name not in names:
+            raise ValueError(f"No vegetation '{veg_name}' (code {code}) in the .etv file.")
+        df = stages.loc[veg_name, ['END_DAY', variable]].dropna()
+        end_day = df['END_DAY'].to_numpy(float)
+        values = df[variable].to_numpy(float)
+        if interp == 'linear':
+            lut[:, code] = np.interp(days, end_day, values)
+        else:
+            # stage k from the day after the end of stage k-1 to its end day
+            lut[:, code] = values[np.minimum(np.searchsorted(end_day, days), len(values) - 1)]
+    return lut
+
+
+def vegetation_grids(landuse_filepath, etv_filepath, new_filename, time1, time2, variables=('LAI', 'ROOT', 'Kc'),
+                     codes=None, interp='linear', block=30):
+    """
+    Daily grids of vegetation variables (e.g. leaf area index, root depth, crop
+    coefficient) from a land use grid (e.g. DK_Landuse_9classes_5cropsCorr_100m_MB500.dfs2)
+    and a .etv vegetation file (e.g. DK_2018_Veg_Prop_inv_100m.etv), written as a
+    dfs2 file. The .etv file is parsed once (parse_etv) into a lookup array per
+    variable (vegetation_lookup), the land use grid is read once, and each day's
+    grids are the lookup rows of its day of year indexed by the grid codes. The
+    days are written in blocks appended to the new file, so memory stays at one
+    block however long the period is.
+
+    Parameters:
+    - landuse_filepath: Path to the land use dfs2 file (grid codes in the first item, first timestep).
+    - etv_filepath: Path to the .etv file.
+    - new_filename: Path of the new dfs2 file.
+    - time1, time2: First and last day (e.g. '2000-01-01', '2020-12-31').
+    - variables: Stage variables of the .etv file, one item each (default LAI, ROOT and Kc).
+    - codes: Dictionary grid code -> vegetation name (default LANDUSE_VEGETATION); cells with other codes are delete values.
+    - interp: Interpolation between stages, 'linear' (default) or 'stage' (see vegetation_lookup).
+    - block: Number of days computed and written at once (default 30).
+
+    Returns:
+        str: new_filename
+    """
+    codes = LANDUSE_VEGETATION if codes is None else codes
+    stages, _ = parse_etv(etv_filepath)
+    luts = {var: vegetation_lookup(stages, var, codes, interp).astype(np.float32) for var in variables}
+    landuse = mikeio.read(landuse_filepath, items=[0], time=[0])[0]
+    geometry = landuse.geometry
+    grid = np.asarray(landuse.to_numpy(), dtype=float).reshape(geometry.ny, geometry.nx)
+    # code of each cell as column of the lookup arrays, last column (NaN) for cells without (known) code
+    nodata = max(codes) + 1
+    known = np.isfinite(grid) & (grid >= 0) & (grid < nodata)
+    grid = np.where(known, np.nan_to_num(grid), nodata).astype(int)
+    items = [ItemInfo(var, ETV_ITEMS.get(var, EUMType.Undefined)) for var in variables]
+
+    time = pd.date_range(pd.Timestamp(time1).normalize(), pd.Timestamp(time2).normalize(), freq='D')
+    if len(time) == 0:
+        raise ValueError("'time2' must not be before 'time1'.")
+    dfs_out = None
+    for it_s in range(0, len(time), block):
+        t = time[it_s:it_s + block]
+        days = np.asarray(t.dayofyear)
+        ds = mikeio.Dataset([mikeio.DataArray(luts[var][days][:, grid], time=t, geometry=geometry, item=item)
+                             for var, item in zip(variables, items)])
+        if dfs_out is None:
+            ds.to_dfs(new_filename)
+            dfs_out = mikeio.open(new_filename)
+        else:
+            dfs_out.append(ds, validate=False)
+        del ds
+        gc.collect() # mikeio datasets are reference cycles: free the block now, not some blocks later
+    return new_filename
+
+
+SEASONS = ['DJF', 'MAM', 'JJA', 'SON']
+
+
+def time_aggregate(filepath, varname=None, layerID=None, time1=None, time2=None, by=None, block=100, cache_dir=None):
+    """
+    Time mean of one item (and layer, for dfs3) of a dfs2/dfs3 file, streamed: only the
+    timesteps from time1 to time2 of the item and layer are read, block timesteps at a
+    time. Results are cached in a sidecar folder (default <filepath>.agg) per item, layer,
+    period and by, and used as long as the file is unchanged (size, modification time);
+    an unreadable cache is computed again.
+
+    Parameters:
+    - filepath: Path to the dfs2/dfs3 file.
+    - varname: Variable name (optional, if not provided, first variable is used).
+    - layerID: Layer index of dfs3 file (required for dfs3).
+    - time1, time2: Time range to average over (if None, use full range; as .sel(time=slice(time1, time2))).
+    - by: None (mean over the period), or 'month', 'season' (DJF, MAM, JJA, SON) or 'year' for
+      the mean per calendar month or season (climatology), or per year.
+    - block: Number of timesteps read at once (default 100).
+    - cache_dir: Folder of the cache (default <filepath>.agg; False: no cache).
+
+    Returns:
+        mikeio.DataArray (by=None), or dict of group (month, season or year) -> mikeio.DataArray
+    """
+    dfs = mikeio.open(filepath)
+    if varname is None:
+        varname = dfs.items[0].name
+    if len(dfs.geometry.default_dims) == 3 and layerID is None:
+        raise ValueError("'layerID' must be provided for dfs3 files.")
+    if by not in [None, 'month', 'season', 'year']:
+        raise ValueError(f"Unknown by '{by}', must be None, 'month', 'season' or 'year'.")
+    its = pd.Series(np.arange(dfs.n_timesteps), index=pd.DatetimeIndex(dfs.time)).loc[time1:time2]
+    if len(its) == 0:
+        raise ValueError(f"No timesteps from {time1} to {time2} in {filepath}.")
+    read_kwargs = {} if layerID is None else {'layers': layerID}
+    # 2D template (geometry, item) of the result
+    template = mikeio.read(filepath, items=varname, time=int(its.iloc[0]), **read_kwargs)[varname]
+    if by is None:
+        codes = np.zeros(len(its), dtype=int); groups = [None]
+    elif by == 'month':
+        codes = its.index.month.values - 1; groups = list(range(1, 13))
+    elif by == 'season':
+        codes = its.index.month.values % 12 // 3; groups = SEASONS
+    else:
+        groups = sorted(its.index.year.unique()); codes = its.index.year.values - groups[0]
+        groups = list(range(groups[0], groups[-1] + 1))
+
+    fp_cache = None; mean = None
+    if cache_dir is not False:
+        cache_dir = f'{filepath}.agg' if cache_dir is None else cache_dir
+        key = json.dumps([os.path.abspath(filepath), varname, layerID, int(its.iloc[0]), int(its.iloc[-1]), by])
+        fp_cache = os.path.join(cache_dir, f"{hashlib.sha1(key.encode()).hexdigest()[:16]}.npz")
+        st = os.stat(filepath)
+        fingerprint = np.array([st.st_size, st.st_mtime_ns])
+        if os.path.exists(fp_cache):
+            try:
+                with np.load(fp_cache, allow_pickle=False) as npz:
+                    if np.array_equal(npz['fingerprint'], fingerprint):
+                        mean = npz['mean']
+            except (OSError, KeyError, ValueError):
+                mean = None # corrupt or incomplete cache: computed again
+
+    if mean is None:
+        total = np.zeros((len(groups),) + template.shape, dtype=np.float64)
+        count = np.zeros(len(groups), dtype=np.int64)
+        for i_s in range(0, len(its), block):
+            sel = its.iloc[i_s:i_s + block]
+            # timesteps of a block are consecutive in the file
+            da = mikeio.read(filepath, items=varname, time=list(range(int(sel.iloc[0]), int(sel.iloc[-1]) + 1)), **read_kwargs)[varname]
+            values = da.to_numpy().reshape((len(sel),) + template.shape)
+            code = codes[i_s:i_s + block]
+            for g in np.unique(code):
+                total[g] += values[code == g].sum(axis=0)
+                count[g] += np.sum(code == g)
+            del da, values
+            gc.collect() # mikeio datasets are reference cycles: free the block now, not some blocks later
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = (total / count[:, None, None]).astype(template.to_numpy().dtype)
+        if fp_cache is not None:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                # written next to the cache and renamed: other processes never read a half written file
+                fp_tmp = f'{fp_cache}.{os.getpid()}.tmp'
+                with open(fp_tmp, 'wb') as f: # file object: keep the name as given (np.savez would add .npz)
+                    np.savez(f, mean=mean, fingerprint=fingerprint)
+                os.replace(fp_tmp, fp_cache)
+            except OSError:
+                pass # read-only location: no cache
+
+    das = {group: mikeio.DataArray(data=mean[ig], time=template.time, geometry=template.geometry, item=template.item)
+           for ig, group in enumerate(groups)}
+    return das[None] if by is None else das
+
+
+def coarsen(values, factor, categorical=False):
+    """
+    Downsample a 2D grid (y, x) by blocks of factor x factor cells: block mean, or block
+    mode for categorical grids (e.g. land use codes). Missing values are left out; grids
+    not divisible by factor get partial blocks at the upper/right edge.
+    """
+    ny, nx = values.shape
+    nyc, nxc = -(-ny // factor), -(-nx // factor)
+    padded = np.full((nyc * factor, nxc * factor), np.nan)
+    padded[:ny, :nx] = values
+    # (coarse cell, cells in block)
+    blocks = padded.reshape(nyc, factor, nxc, factor).transpose(0, 2, 1, 3).reshape(nyc * nxc, -1)
+    valid = ~np.isnan(blocks)
+    if categorical:
+        codes = np.unique(blocks[valid])
+        if len(codes) == 0:
+            return np.full((nyc, nxc), np.nan)
+        counts = np.stack([(blocks == code).sum(axis=1) for code in codes], axis=1)
+        out = np.where(valid.any(axis=1), codes[counts.argmax(axis=1)], np.nan)
+    else:
+        with np.errstate(invalid='ignore', divide='ignore'):
+            out = np.where(valid, blocks, 0).sum(axis=1) / valid.sum(axis=1)
+    return out.reshape(nyc, nxc).astype(values.dtype)
+
+
+# overview levels per cache key (see overview_levels), least recently used first;
+# only the last OVERVIEW_CACHE_SIZE are kept, as each holds its full resolution grid
+OVERVIEW_CACHE_SIZE = 4
+_overviews = OrderedDict()
+
+
+def overview_levels(data, categorical=False, cache_key=None, min_size=64):
+    """
+    Overview pyramid of a 2D mikeio.DataArray: the original and levels downsampled by
+    2, 4, 8, ... (see coarsen) until the grid is smaller than min_size cells along
+    both axes. Levels are kept in memory under cache_key (optional), so repeated
+    plots of the same data reuse them (for the last OVERVIEW_CACHE_SIZE keys).
+
+    Returns:
+        list of mikeio.DataArray: level 0 (original), 1 (factor 2), ...
+    """
+    if cache_key is not None and cache_key in _overviews:
+        _overviews.move_to_end(cache_key)
+        return _overviews[cache_key]
+    geometry = data.geometry
+    values = data.to_numpy().reshape(geometry.ny, geometry.nx)
+    levels = [data]
+    factor = 2
+    while max(geometry.nx, geometry.ny) / factor >= min_size:
+        coarse = coarsen(values, factor, categorical=categorical)
+        # coarse grid with the same lower left corner (x0, y0: centre of the first cell)
+        grid = mikeio.Grid2D(x0=geometry.x[0] + geometry.dx * (factor - 1) / 2, dx=geometry.dx * factor, nx=coarse.shape[1],
+                             y0=geometry.y[0] + geometry.dy * (factor - 1) / 2, dy=geometry.dy * factor, ny=coarse.shape[0],
+                             projection=geometry.projection)
+        levels.append(mikeio.DataArray(data=coarse, time=data.time, geometry=grid, item=data.item))
+        factor *= 2
+    if cache_key is not None:
+        _overviews[cache_key] = levels
+        while len(_overviews) > OVERVIEW_CACHE_SIZE:
+            _overviews.popitem(last=False)
+    return levels
+
+
+def plot_grid(data, ax=None, categorical=False, overview=True, cache_key=None, kind=None, **kwargs):
+    """
+    Plot a 2D mikeio.DataArray (e.g. ds[0][timeID]) at the overview level that matches
+    the resolution of the axis (about 1 to 2 cells per pixel), instead of pushing all
+    cells of a fine grid through matplotlib.
+
+    Parameters:
+    - data: 2D mikeio.DataArray (one timestep, one layer).
+    - ax: Matplotlib axis to plot on (optional).
+    - categorical: Grid of codes (e.g. land use): block mode instead of block mean.
+    - overview: Use overview levels (default True); False: plot all cells.
+    - cache_key: Key to keep the overview levels in memory under (optional, see overview_levels).
+    - kind: Plot method of mikeio, e.g. 'contourf' (default: DataArray.plot).
+    - kwargs: Passed to the plot method (e.g. cmap, title).
+
+    Returns:
+        Matplotlib axis
+    """
+    if ax is None:
+        fig, ax = plt.subplots(figsize=(9, 6))
+    level = data
+    if overview:
+        bbox = ax.get_window_extent()
+        cells_per_pixel = max(data.geometry.nx / max(bbox.width, 1), data.geometry.ny / max(bbox.height, 1))
+        if cells_per_pixel >= 2:
+            levels = overview_levels(data, categorical=categorical, cache_key=cache_key)
+            level = levels[min(int(np.log2(cells_per_pixel)), len(levels) - 1)]
+    plot = level.plot if kind is None else getattr(level.plot, kind)
+    plot(ax=ax, **kwargs)
+    return ax
+
+
+def plot_dfs2_output(filepath, varname=None, timeID=0, ax=None, shapefile=None,layerID=None, time1=None, time2=None, by=None, group=None,
+                     categorical=False, overview=True):
     """
     Plot a dfs2 output file, averaged over a time range if provided, else at a specific time index.
+    Only the timesteps, item and layer needed are read; averages are cached (see time_aggregate).
     
     Parameters:
     - filepath: Path to the dfs2 file.
@@ -167,36 +1194,39 @@ def plot_dfs2_output(filepath, varname=None, timeID=0, ax=None, shapefile=None,l
     - shapefile: Geopandas dataframe of shapefile to overlay (optional).
     - layerID: Layer index to select from dfs3 file (if applicable).
     - time1, time2: Time range to average over (if None, use full range).
+    - by, group: Plot the mean of group (e.g. 7, 'JJA' or 2010) of climatology by ('month', 'season' or 'year'), over time1 to time2 (optional).
+    - categorical: Grid of codes (e.g. land use), see plot_grid.
+    - overview: Plot at the overview level matching the axis resolution (default True, see plot_grid).
     """
-    ds = mikeio.read(filepath)
+    dfs = mikeio.open(filepath)
     if varname is None:
-        varname = ds.variables[0].name
+        varname = dfs.items[0].name
+    is_dfs3 = len(dfs.geometry.default_dims) == 3
 
     
     if ax is None:
         fig, ax = plt.subplots(figsize=(9, 6))
 
-    # check if time1 and time2 are provided for averaging
-    if time1 is not None and time2 is not None:
-        if len(ds[0].dims) == 4:
-            data = ds[varname].sel(time=slice(time1, time2)).mean()[layerID]
-            datestr = f"AVG {str(time1)} to {str(time2)}, L{layerID}"
-        else:
-            data = ds[varname].sel(time=slice(time1, time2)).mean()
-            datestr = f"AVG {str(time1)} to {str(time2)}"
+    # climatology, or check if time1 and time2 are provided for averaging
+    if by is not None:
+        data = time_aggregate(filepath, varname, layerID, time1, time2, by=by)[group]
+        period = f", {str(time1)} to {str(time2)}" if time1 is not None and time2 is not None else ""
+        datestr = f"AVG {by} {group}{period}" + (f", L{layerID}" if is_dfs3 else "")
+    elif time1 is not None and time2 is not None:
+        data = time_aggregate(filepath, varname, layerID, time1, time2)
+        datestr = f"AVG {str(time1)} to {str(time2)}" + (f", L{layerID}" if is_dfs3 else "")
 
     else:
-        # Check if dfs3 or dfs2
-        if len(ds[0].dims) == 4:
-            data = ds[varname][timeID,layerID]
-        else:
-            data = ds[varname][timeID]
-        datestr = str(ds[varname][timeID].time[0])[0:10]
+        # only the timestep (and layer if dfs3)
+        data = mikeio.read(filepath, items=varname, time=timeID, **({'layers': layerID} if is_dfs3 else {}))[varname]
+        datestr = str(data.time[0])[0:10]
 
     #capitailize first letter of variable name
     varname_caps = varname.capitalize() if varname else "Variable"
 
-    data.plot(ax=ax, cmap='viridis')
+    st = os.stat(filepath)
+    cache_key = (os.path.abspath(filepath), st.st_size, st.st_mtime_ns, varname, layerID, timeID, time1, time2, by, group, categorical)
+    plot_grid(data, ax=ax, categorical=categorical, overview=overview, cache_key=cache_key, cmap='viridis')
     ax.set_title(f"{varname_caps} {datestr}")
 
     # Check if shapefile is provided and plot it
@@ -220,14 +1250,7 @@ def plot_settings(ax):
         spine.set_visible(False)
 
 def plot_wb_output(filepath,title,varlist=None):
-    wb = mikeio.read(filepath)
-    wb_df = wb.to_dataframe() # For more plotting options
-
-    if varlist is not None:
-        wb_df = wb_df[varlist]
-
-    fig, ax = plt.subplots(figsize=(12, 6))
-    wb_df.plot(ax=ax,fontsize=15).legend(loc='center',bbox_to_anchor=(1.15,0.4))
-    plt.ylabel('Storage Depth [mm]',fontsize=15)
-    plt.title(label=title,fontsize=20)
+    # from the water balance files of the folder, loaded once and cached (see WaterBalance.py)
+    wb = WaterBalance.load(os.path.dirname(os.path.abspath(filepath)))
+    wb.plot(filepath, title, varlist=varlist)
     plt.show()
\ No newline at end of file
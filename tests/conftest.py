@@ -0,0 +1,35 @@
+import os, sys, shutil
+
+import pytest
+
+# the modules of code/ are scripts imported by name (as in the notebooks)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'code'))
+
+
+@pytest.fixture(scope='session')
+def ws_case(tmp_path_factory):
+    # small synthetic WellStats case (see WellStatsBenchmark.make_case): PP.dfs2,
+    # PP3.dfs3, R3.dfs3 (head), R2.dfs2 (dtp, dtb) and obs.csv
+    import WellStatsBenchmark
+    fp_case = str(tmp_path_factory.mktemp('ws_case'))
+    WellStatsBenchmark.make_case(fp_case, nx=10, nz=4, nt=60, nwells=30, dry=0.3)
+    return fp_case
+
+
+@pytest.fixture
+def ws_config(ws_case, tmp_path):
+    # configuration dictionary of the synthetic case for mode 'head', 'dtp' or 'dtb',
+    # with its own copy of the observation file (caches and state are written next to it)
+    import WellStatsBenchmark
+    fp_obs = str(tmp_path / 'obs.csv')
+    shutil.copy(os.path.join(ws_case, 'obs.csv'), fp_obs)
+    def config(mode='head', **values):
+        conf = {'PreProcessedDFS2': os.path.join(ws_case, 'PP.dfs2'),
+                'PreProcessedDFS3': os.path.join(ws_case, 'PP3.dfs3'),
+                'ObservationFile': fp_obs,
+                'ResultFile': os.path.join(ws_case, 'R3.dfs3' if mode == 'head' else 'R2.dfs2'),
+                'HeadItemText': WellStatsBenchmark.HEAD_ITEM[mode], 'PhreaticUseLayerBelow': 'true',
+                'EpsilonForPhreatic': 0.02, 'StaticCache': False, 'ColumnStore': False}
+        conf.update(values)
+        return conf
+    return config
@@ -0,0 +1,47 @@
+"""
+Streamed clipping of dfs2 files (tools.clip_dfs2_stream, tools.clip_dfs2_files)
+against a clip of the whole file in memory, on a small synthetic grid.
+"""
+
+import numpy as np
+import pandas as pd
+
+import mikeio
+import tools
+
+
+def write_dfs2(fp, nt=10):
+    rng = np.random.default_rng(0)
+    geometry = mikeio.Grid2D(x0=505, y0=6005, dx=10, dy=10, nx=12, ny=9, projection='UTM-32')
+    time = pd.date_range('2000-01-01', periods=nt, freq='D')
+    das = [mikeio.DataArray(rng.random((nt, 9, 12)).astype(np.float32), time=time, geometry=geometry,
+                            item=mikeio.ItemInfo(name, mikeio.EUMType.Precipitation_Rate, mikeio.EUMUnit.mm_per_day))
+           for name in ['P', 'Q']]
+    mikeio.Dataset(das).to_dfs(fp)
+
+
+def test_clip_stream_matches_clip_in_memory(tmp_path):
+    fp = str(tmp_path / 'big.dfs2')
+    write_dfs2(fp)
+    # the box cuts cells 2-5 in x (edges 520-560) and 1-3 in y (edges 6010-6040)
+    bbox = (525, 6015, 555, 6035)
+    tools.clip_dfs2_stream(fp, str(tmp_path / 'small.dfs2'), bbox, block=3)
+    out = mikeio.read(tmp_path / 'small.dfs2')
+    expected = mikeio.read(fp).isel(x=slice(2, 6)).isel(y=slice(1, 4))
+    assert out.geometry == expected.geometry and out.geometry.projection == 'UTM-32'
+    assert out.items == expected.items
+    pd.testing.assert_index_equal(out.time, expected.time)
+    for name in ['P', 'Q']:
+        np.testing.assert_array_equal(out[name].to_numpy(), expected[name].to_numpy())
+
+
+def test_clip_files_in_workers(tmp_path):
+    fps = [str(tmp_path / f'in{i}.dfs2') for i in range(2)]
+    for fp in fps:
+        write_dfs2(fp, nt=4)
+    bbox = (505, 6005, 530, 6020)
+    fps_out = [str(tmp_path / f'out{i}.dfs2') for i in range(2)]
+    assert tools.clip_dfs2_files(fps, fps_out, bbox, block=3, workers=2) == fps_out
+    for fp, fp_out in zip(fps, fps_out):
+        expected = mikeio.read(fp).isel(x=slice(0, 3)).isel(y=slice(0, 2))
+        np.testing.assert_array_equal(mikeio.read(fp_out)['P'].to_numpy(), expected['P'].to_numpy())
@@ -0,0 +1,39 @@
+"""
+Column store of result files (ColumnStore.convert, ColumnStore.open_store):
+values read back from a small synthetic dfs3, and validity of the store when
+the result file is touched or changed.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+import mikeio
+import ColumnStore
+
+
+def write_result(fp, values):
+    geometry = mikeio.Grid3D(nx=values.shape[3], ny=values.shape[2], nz=values.shape[1], dx=100., dy=100., dz=1.,
+                             origin=(0., 0., 0.))
+    mikeio.DataArray(values, time=pd.date_range('2000-01-01', periods=len(values), freq='D'), geometry=geometry,
+                     item=mikeio.ItemInfo('head')).to_dfs(fp)
+
+
+def test_store_values_and_validity(tmp_path):
+    values = np.random.default_rng(0).random((5, 2, 7, 9)).astype(np.float32)
+    fp = str(tmp_path / 'R3.dfs3')
+    write_result(fp, values)
+    ColumnStore.convert(fp, tile=4, time_chunk=2)
+    store = ColumnStore.open_store(fp, 'head')
+    iy, ix = np.array([0, 6, 3, 4]), np.array([0, 8, 4, 5])
+    np.testing.assert_array_equal(store.read_cells(iy, ix, 1, 3), values[1:4, :, iy, ix])
+    assert ColumnStore.open_store(fp, 'other item') is None
+    # touched (other modification time, same content): still valid
+    st = os.stat(fp)
+    os.utime(fp, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert ColumnStore.open_store(fp, 'head') is not None
+    # changed content
+    values[2, 1, 3, 4] += 1
+    write_result(fp, values)
+    assert ColumnStore.open_store(fp, 'head') is None
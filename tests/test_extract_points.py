@@ -0,0 +1,82 @@
+"""
+Batched point time series extraction (tools.point_cells, tools.extract_points)
+from small synthetic dfs2/dfs3 files, with and without column store.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import mikeio
+import ColumnStore
+import tools
+
+NT, NZ, NY, NX = 7, 3, 5, 6
+TIME = pd.date_range('2000-01-01', periods=NT, freq='D')
+# points in cells (iy, ix) = (0, 0), (4, 5), (2, 3) and one outside the grid; cells of 100 m from (0, 0)
+X = np.array([10., 560., 349., 700.])
+Y = np.array([99., 420., 250., 50.])
+IY, IX = np.array([0, 4, 2, 0]), np.array([0, 5, 3, 0])
+
+
+@pytest.fixture
+def files(tmp_path):
+    rng = np.random.default_rng(0)
+    values2 = rng.random((NT, NY, NX)).astype(np.float32)
+    values3 = rng.random((NT, NZ, NY, NX)).astype(np.float32)
+    # same cells: the origin of Grid2D is the centre of the first cell, of Grid3D its corner
+    g2 = mikeio.Grid2D(nx=NX, ny=NY, dx=100., x0=50., y0=50.)
+    g3 = mikeio.Grid3D(nx=NX, ny=NY, nz=NZ, dx=100., dy=100., dz=1., origin=(0., 0., 0.))
+    mikeio.DataArray(values2, time=TIME, geometry=g2, item=mikeio.ItemInfo('dtp')).to_dfs(tmp_path / 'r.dfs2')
+    mikeio.DataArray(values3, time=TIME, geometry=g3, item=mikeio.ItemInfo('head')).to_dfs(tmp_path / 'r.dfs3')
+    return str(tmp_path / 'r.dfs2'), values2, str(tmp_path / 'r.dfs3'), values3
+
+
+def test_point_cells():
+    geometry = mikeio.Grid2D(nx=NX, ny=NY, dx=100., x0=50., y0=50.)
+    iy, ix, outside = tools.point_cells(geometry, X, Y)
+    np.testing.assert_array_equal(iy[:3], IY[:3])
+    np.testing.assert_array_equal(ix[:3], IX[:3])
+    np.testing.assert_array_equal(outside, [False, False, False, True])
+
+
+@pytest.mark.parametrize('use_store', [False, True])
+def test_points_on_cell_edges_go_to_the_upper_cell(files, use_store):
+    fp2, values2, _, _ = files
+    if use_store:
+        ColumnStore.convert(fp2, tile=4)
+    # edges between cells 0|1, 1|2, 2|3 in x and 0|1, 2|3, 3|4 in y, and the outer edges of the grid
+    x = np.array([100., 200., 300., 0., 600.])
+    y = np.array([100., 300., 400., 0., 500.])
+    iy, ix = np.array([1, 3, 4, 0, 4]), np.array([1, 2, 3, 0, 5])
+    df = tools.extract_points(fp2, np.column_stack([x, y]), use_store=use_store)
+    np.testing.assert_array_equal(df.to_numpy(), values2[:, iy, ix])
+
+
+@pytest.mark.parametrize('use_store', [False, True])
+def test_extract_points_dfs2(files, tmp_path, use_store):
+    fp2, values2, _, _ = files
+    if use_store:
+        ColumnStore.convert(fp2, tile=4)
+    df = tools.extract_points(fp2, np.column_stack([X, Y]), names=['a', 'b', 'c', 'out'], block=3,
+                              use_store=use_store, dfs0_filename=str(tmp_path / 'points.dfs0'))
+    assert list(df.columns) == ['a', 'b', 'c', 'out']
+    np.testing.assert_array_equal(df.index, TIME)
+    np.testing.assert_array_equal(df[['a', 'b', 'c']].to_numpy(), values2[:, IY[:3], IX[:3]])
+    assert df['out'].isna().all()
+    dfs0 = mikeio.read(tmp_path / 'points.dfs0').to_dataframe()
+    np.testing.assert_allclose(dfs0['b'].to_numpy(), df['b'].to_numpy())
+
+
+@pytest.mark.parametrize('use_store', [False, True])
+def test_extract_points_dfs3_layer_per_point(files, use_store):
+    _, _, fp3, values3 = files
+    if use_store:
+        ColumnStore.convert(fp3, tile=4)
+    layer = np.array([0, 2, 1, 0])
+    points = pd.DataFrame({'x': X, 'y': Y, 'layer': layer}, index=['a', 'b', 'c', 'out'])
+    df = tools.extract_points(fp3, points, block=2, use_store=use_store)
+    np.testing.assert_array_equal(df[['a', 'b', 'c']].to_numpy(), values3[:, layer[:3], IY[:3], IX[:3]])
+    assert df['out'].isna().all()
+    with pytest.raises(ValueError):
+        tools.extract_points(fp3, np.column_stack([X, Y]))
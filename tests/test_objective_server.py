@@ -0,0 +1,79 @@
+"""
+Objective server (ObjectiveServer) on an ephemeral localhost port, on the
+synthetic case of WellStatsBenchmark: evaluate and shutdown round trips, and
+requests with a wrong token or files outside the root directory.
+"""
+
+import os, shutil, stat, threading
+
+import numpy as np
+import pytest
+
+import ObjectiveServer
+import WellStats
+import WellStatsBenchmark
+
+TOKEN = 'test-token'
+
+
+@pytest.fixture
+def server(ws_case, tmp_path):
+    root = tmp_path / 'root'
+    fp_case = shutil.copytree(ws_case, root / 'case')
+    context = ObjectiveServer.load_context(WellStatsBenchmark.write_config(fp_case, 'head'))
+    server = ObjectiveServer.make_server(context, TOKEN, port=0, root=str(root))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server, fp_case, thread
+    if thread.is_alive():
+        server.shutdown()
+    thread.join(10)
+    server.server_close()
+
+
+def query(server, request, token=TOKEN):
+    return ObjectiveServer.query(request, port=server.server_address[1], timeout=60, token=token)
+
+
+def test_evaluate_and_shutdown(server):
+    server, fp_case, thread = server
+    response = query(server, {'cmd': 'evaluate', 'folder': 'case'})
+    assert response['status'] == 'ok', response
+    out_obs, out_well, _, out_warn = WellStats.WellStats(WellStatsBenchmark.write_config(fp_case, 'head')).run()
+    assert response['head']['all']['nobs'] == len(out_obs)
+    np.testing.assert_allclose(response['head']['all']['RMSE_obs'], np.sqrt(out_obs['err2'].mean()))
+    assert sorted(response['head']['wells']) == sorted(str(well) for well in out_well.index)
+    assert response['head']['warnings'] == out_warn and response['discharge'] is None
+    # the same folder as absolute path, written next to the result file
+    assert query(server, {'cmd': 'evaluate', 'folder': str(fp_case), 'write': True})['status'] == 'ok'
+    assert os.path.exists(os.path.join(fp_case, 'obs_head_R3_observations.csv'))
+
+    assert query(server, {'cmd': 'shutdown'}) == {'status': 'ok'}
+    thread.join(10)
+    assert not thread.is_alive()
+
+
+def test_rejected_requests(server, tmp_path):
+    server, fp_case, _ = server
+    response = query(server, {'cmd': 'shutdown'}, token='wrong')
+    assert response['status'] == 'error' and 'token' in response['error']
+    response = ObjectiveServer.query({'cmd': 'ping', 'token': ''}, port=server.server_address[1], timeout=60)
+    assert response['status'] == 'error'
+    # files outside the root directory: through '..', absolute or through a link
+    os.symlink(tmp_path, tmp_path / 'root' / 'link')
+    for request in [{'folder': '../root/../../'}, {'folder': str(tmp_path)},
+                    {'result_file': os.path.join(fp_case, '..', '..', 'R3.dfs3')}, {'folder': 'link'}]:
+        response = query(server, {'cmd': 'evaluate', **request})
+        assert response['status'] == 'error' and 'root directory' in response['error'], request
+    # still serving
+    assert query(server, {'cmd': 'ping'}) == {'status': 'ok'}
+
+
+def test_tokens(tmp_path, monkeypatch):
+    monkeypatch.delenv(ObjectiveServer.TOKEN_ENV, raising=False)
+    fp_token = str(tmp_path / 'token')
+    token = ObjectiveServer.server_token(fp_token)
+    assert stat.S_IMODE(os.stat(fp_token).st_mode) == 0o600
+    assert ObjectiveServer.client_token(fp_token) == token != ObjectiveServer.server_token(fp_token)
+    monkeypatch.setenv(ObjectiveServer.TOKEN_ENV, 'shared')
+    assert ObjectiveServer.server_token(fp_token) == ObjectiveServer.client_token(fp_token) == 'shared'
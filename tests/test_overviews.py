@@ -0,0 +1,52 @@
+"""
+Overview pyramids for map plotting (tools.coarsen, tools.overview_levels) on
+small synthetic grids.
+"""
+
+import numpy as np
+import pandas as pd
+
+import mikeio
+import tools
+
+
+def dataarray(values, x0=1005., y0=2005., dx=10.):
+    geometry = mikeio.Grid2D(x0=x0, y0=y0, dx=dx, dy=dx, nx=values.shape[1], ny=values.shape[0])
+    return mikeio.DataArray(values, time=pd.DatetimeIndex(['2000-01-01']), geometry=geometry, item=mikeio.ItemInfo('z'))
+
+
+def test_coarse_cell_centres_are_block_means_of_fine_centres():
+    data = dataarray(np.zeros((32, 48)))
+    levels = tools.overview_levels(data, min_size=4)
+    assert len(levels) == 4
+    x, y = np.asarray(data.geometry.x), np.asarray(data.geometry.y)
+    for ilevel, level in enumerate(levels[1:], start=1):
+        factor = 2 ** ilevel
+        np.testing.assert_allclose(level.geometry.x, x.reshape(-1, factor).mean(axis=1))
+        np.testing.assert_allclose(level.geometry.y, y.reshape(-1, factor).mean(axis=1))
+        assert level.geometry.dx == data.geometry.dx * factor
+
+
+def test_coarsen_block_mean_and_mode():
+    values = np.arange(24, dtype=float).reshape(4, 6)
+    values[0, 0] = np.nan
+    np.testing.assert_allclose(tools.coarsen(values, 2),
+                               [[(1 + 6 + 7) / 3, 5.5, 7.5], [15.5, 17.5, 19.5]])
+    # partial blocks at the upper/right edge
+    np.testing.assert_allclose(tools.coarsen(values[:3, :5], 2)[:, 2], [(4 + 10) / 2, 16])
+    codes = np.array([[1, 1, 2, 2], [3, 1, 2, np.nan], [5, 5, np.nan, np.nan], [5, 4, np.nan, np.nan]])
+    np.testing.assert_array_equal(tools.coarsen(codes, 2, categorical=True), [[1, 2], [5, np.nan]])
+
+
+def test_overview_cache_is_bounded():
+    tools._overviews.clear()
+    data = dataarray(np.ones((16, 16)))
+    first = tools.overview_levels(data, cache_key='first', min_size=4)
+    for i in range(tools.OVERVIEW_CACHE_SIZE - 1):
+        tools.overview_levels(data, cache_key=i, min_size=4)
+    # reuse keeps 'first' as most recently used
+    assert tools.overview_levels(data, cache_key='first', min_size=4) is first
+    tools.overview_levels(data, cache_key='last', min_size=4)
+    assert len(tools._overviews) == tools.OVERVIEW_CACHE_SIZE
+    assert 'first' in tools._overviews and 0 not in tools._overviews
+    tools._overviews.clear()
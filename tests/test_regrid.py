@@ -0,0 +1,73 @@
+"""
+Sparse-weight regridding of dfs2 grids (tools.regrid_weights, tools.regrid_dfs2)
+on small synthetic grids.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import mikeio
+import tools
+
+
+def grid(x0, y0, dx, nx, ny):
+    # Grid2D with the centre of the first cell at x0, y0
+    return mikeio.Grid2D(x0=x0, y0=y0, dx=dx, dy=dx, nx=nx, ny=ny)
+
+
+def test_area_weights_are_block_means_and_conserve_the_mean():
+    rng = np.random.default_rng(0)
+    fine = grid(5, 5, 10, 12, 8)
+    coarse = grid(20, 20, 40, 3, 2) # 4 x 4 fine cells each, same extent
+    values = rng.random((fine.ny, fine.nx))
+    w = tools.regrid_weights(fine, coarse, method='area')
+    np.testing.assert_allclose(np.asarray(w.sum(axis=1)).ravel(), 1)
+    out = (w @ values.ravel()).reshape(coarse.ny, coarse.nx)
+    np.testing.assert_allclose(out, values.reshape(2, 4, 3, 4).mean(axis=(1, 3)))
+    np.testing.assert_allclose(out.mean(), values.mean())
+    # back to the fine grid: each fine cell gets the value of its coarse cell, mean unchanged
+    back = (tools.regrid_weights(coarse, fine, method='area') @ out.ravel()).reshape(fine.ny, fine.nx)
+    np.testing.assert_allclose(back, np.kron(out, np.ones((4, 4))))
+    np.testing.assert_allclose(back.mean(), values.mean())
+
+
+def test_area_weights_of_partly_overlapping_cells():
+    source = grid(5, 5, 10, 4, 1)
+    target = grid(10, 5, 10, 3, 1) # shifted by half a cell: mean of two source cells
+    w = tools.regrid_weights(source, target, method='area')
+    values = np.array([1., 2., 4., 8.])
+    np.testing.assert_allclose(w @ values, [1.5, 3., 6.])
+
+
+def test_bilinear_weights_are_exact_for_linear_field():
+    source = grid(50, 50, 100, 6, 5)
+    target = grid(75, 60, 30, 15, 12)
+    xs, ys = np.meshgrid(source.x, source.y)
+    xt, yt = np.meshgrid(target.x, target.y)
+    w = tools.regrid_weights(source, target, method='bilinear')
+    np.testing.assert_allclose(w @ (3 * xs - 2 * ys + 7).ravel(), (3 * xt - 2 * yt + 7).ravel())
+
+
+def test_weights_outside_the_source_grid_are_zero():
+    source = grid(5, 5, 10, 4, 4)
+    target = grid(-25, 15, 10, 2, 1) # both cells left of the source grid
+    for method in ['area', 'bilinear']:
+        assert tools.regrid_weights(source, target, method=method).nnz == 0
+
+
+@pytest.mark.filterwarnings('ignore:Mean of empty slice') # expected mean of the all missing cell
+def test_regrid_dfs2_leaves_out_missing_values(tmp_path):
+    rng = np.random.default_rng(1)
+    fine = grid(5, 5, 10, 8, 4)
+    coarse = grid(20, 20, 40, 2, 1)
+    time = pd.date_range('2000-01-01', periods=5, freq='D')
+    values = rng.random((len(time), fine.ny, fine.nx)).astype(np.float32)
+    values[:, 0, 0] = np.nan
+    values[2, :, :4] = np.nan # first coarse cell all missing on day 3
+    mikeio.DataArray(values, time=time, geometry=fine, item=mikeio.ItemInfo('P')).to_dfs(tmp_path / 'fine.dfs2')
+    tools.regrid_dfs2(str(tmp_path / 'fine.dfs2'), str(tmp_path / 'coarse.dfs2'), coarse, block=2)
+    out = mikeio.read(tmp_path / 'coarse.dfs2')['P'].to_numpy()
+    expected = np.stack([np.nanmean(values[:, :, :4], axis=(1, 2)), np.nanmean(values[:, :, 4:], axis=(1, 2))], axis=1)
+    np.testing.assert_allclose(out[:, 0, :], expected, rtol=1e-5)
+    assert np.isnan(out[2, 0, 0]) and not np.isnan(out[2, 0, 1])
@@ -0,0 +1,53 @@
+"""
+River network index (tools.RiverNetwork): gauge stations located by branch and
+chainage or snapped by coordinates, on a small synthetic network.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+import shapely
+
+import tools
+
+
+@pytest.fixture
+def network():
+    # branch A along y = 0 from x = 0 to 300, branch B along x = 300 from y = 0 to 200; links not in chainage order
+    lines = [[(100, 0), (200, 0)], [(0, 0), (100, 0)], [(300, 0), (300, 100)], [(200, 0), (300, 0)], [(300, 100), (300, 200)]]
+    links = pd.DataFrame({'Branch': ['A', 'A', 'B', 'A', 'B'], 'Chainage': [150., 50., 50., 250., 150.],
+                          'geometry': shapely.linestrings(lines)})
+    return tools.RiverNetwork(links)
+
+
+def test_locate_nearest_chainage_of_the_branch(network):
+    np.testing.assert_array_equal(network.branches['A'], [1, 0, 3])
+    np.testing.assert_array_equal(network.locate(['A', 'A', 'A', 'B', 'B'], [0., 120., 1000., 90., 160.]), [1, 0, 3, 2, 4])
+    np.testing.assert_array_equal(network.locate('B', 140.), [4])
+    with pytest.raises(ValueError):
+        network.locate(['C'], [0.])
+
+
+def test_snap_to_nearest_link(network):
+    ilink, dist = network.snap([20., 180., 310., 290., -30.], [5., -8., 170., 60., 40.])
+    np.testing.assert_array_equal(ilink, [1, 0, 4, 2, 1])
+    np.testing.assert_allclose(dist, [5., 8., 10., 10., 50.])
+
+
+def test_station_table(network, tmp_path):
+    snapped = pd.DataFrame({'x': [180., 310.], 'y': [-8., 170.]}, index=['Q1', 'Q2'])
+    table = network.station_table(snapped, cache_dir=str(tmp_path))
+    assert list(table['stationID']) == ['Q1', 'Q2'] and list(table['branch']) == ['A', 'B']
+    np.testing.assert_allclose(table[['chainage', 'x', 'y', 'distance']].to_numpy(),
+                               [[150., 180., 0., 8.], [150., 300., 170., 10.]])
+    # from the cache the second time
+    assert len(os.listdir(tmp_path)) == 1
+    pd.testing.assert_frame_equal(network.station_table(snapped, cache_dir=str(tmp_path)), table)
+    located = pd.DataFrame({'branch': ['B'], 'chainage': [60.]}, index=[7])
+    table = network.station_table(located)
+    np.testing.assert_allclose(table[['chainage', 'x', 'y', 'distance']].to_numpy(), [[50., 300., 50., 0.]])
+    assert table.loc[0, 'stationID'] == '7'
+    with pytest.raises(ValueError):
+        network.station_table(pd.DataFrame({'x': [0.]}))
@@ -0,0 +1,86 @@
+"""
+Multi-station skill table (tools.skill_table) against the metric formulas of
+modelskill, one station at a time, on synthetic series.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import tools
+
+
+def metrics(o, m):
+    # modelskill definitions (population standard deviations)
+    r = np.corrcoef(o, m)[0, 1]
+    return {'n': len(o),
+            'kge': 1 - np.sqrt((r - 1) ** 2 + (m.std() / o.std() - 1) ** 2 + (m.mean() / o.mean() - 1) ** 2),
+            'cc': r,
+            'nse': 1 - ((m - o) ** 2).sum() / ((o - o.mean()) ** 2).sum(),
+            'rmse': np.sqrt(((m - o) ** 2).mean()),
+            'bias': (m - o).mean()}
+
+
+def matched(obs, mod):
+    # model linear in time at the observation times, between its non-missing values only
+    mod = mod.dropna()
+    t_mod = mod.index.asi8.astype(float); t_obs = obs.index.asi8.astype(float)
+    m = np.interp(t_obs, t_mod, mod.to_numpy())
+    m[(t_obs < t_mod[0]) | (t_obs > t_mod[-1])] = np.nan
+    valid = ~np.isnan(m) & ~np.isnan(obs.to_numpy())
+    return obs.to_numpy()[valid], m[valid], obs.index[valid]
+
+
+@pytest.fixture
+def series():
+    rng = np.random.default_rng(0)
+    t_mod = pd.date_range('2000-01-01', '2001-12-31', freq='D')
+    season = np.sin(2 * np.pi * np.arange(len(t_mod)) / 365)
+    mod = pd.DataFrame({'A': 10 + 3 * season + rng.normal(0, .5, len(t_mod)),
+                        'B': 2 + season + rng.normal(0, .3, len(t_mod)),
+                        'C': 5 + rng.normal(0, 1, len(t_mod))}, index=t_mod)
+    mod.iloc[100:130, 1] = np.nan # gap in the model of B
+    # observations at irregular times (some before the model starts), with missing values
+    t_obs = pd.DatetimeIndex(np.sort(pd.Timestamp('1999-12-20') + pd.to_timedelta(rng.uniform(0, 740, 300), unit='D')))
+    obs = pd.DataFrame({'A': np.interp(t_obs.asi8, t_mod.asi8, mod['A'].to_numpy()) + rng.normal(0, 1, len(t_obs)),
+                        'B': 2 + np.sin(2 * np.pi * (t_obs - t_mod[0]).days / 365) + rng.normal(0, .4, len(t_obs)),
+                        'D': rng.normal(0, 1, len(t_obs))}, index=t_obs)
+    obs.iloc[::7, 0] = np.nan
+    return obs, mod
+
+
+def test_skill_table_matches_metric_formulas(series):
+    obs, mod = series
+    table = tools.skill_table(obs, mod)
+    assert list(table.index) == ['A', 'B'] and table.index.name == 'observation'
+    assert list(table.columns) == ['n', 'kge', 'cc', 'nse', 'rmse', 'bias']
+    for station in ['A', 'B']:
+        o, m, _ = matched(obs[station], mod[station])
+        expected = metrics(o, m)
+        for metric, value in expected.items():
+            np.testing.assert_allclose(table.loc[station, metric], value, rtol=1e-10, err_msg=f'{station} {metric}')
+
+
+def test_skill_table_long_format_period_and_groups(series):
+    obs, mod = series
+    long = obs[['A', 'B']].melt(ignore_index=False, var_name='StationID', value_name='Q').dropna()
+    long['StationID'] = long['StationID'].astype('category')
+    pd.testing.assert_frame_equal(tools.skill_table(long, mod, metrics=('rmse',), time1='2000-03-01', time2='2001-06-30'),
+                                  tools.skill_table(obs, mod, metrics=('rmse',), time1='2000-03-01', time2='2001-06-30'))
+    table = tools.skill_table(obs, mod, metrics=('bias', 'rmse'), by='season')
+    o, m, t = matched(obs['A'], mod['A'])
+    season = np.array(tools.SEASONS)[t.month % 12 // 3]
+    for group in tools.SEASONS:
+        sel = season == group
+        expected = metrics(o[sel], m[sel])
+        assert table.loc[('A', group), 'n'] == sel.sum()
+        np.testing.assert_allclose(table.loc[('A', group), ['bias', 'rmse']].to_numpy(dtype=float),
+                                   [expected['bias'], expected['rmse']], rtol=1e-10)
+
+
+def test_skill_table_errors(series):
+    obs, mod = series
+    with pytest.raises(ValueError):
+        tools.skill_table(obs, mod, metrics=('mae',))
+    with pytest.raises(ValueError):
+        tools.skill_table(obs[['D']], mod)
@@ -0,0 +1,74 @@
+"""
+Station time series of many dfs0 files (tools.read_station_dfs0) and their
+npz cache: only new or changed files are read again, on small synthetic files.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import mikeio
+import tools
+
+
+def write_station(fp, start, n, offset):
+    time = pd.date_range(start, periods=n, freq='D')
+    mikeio.from_pandas(pd.DataFrame({'WTD': offset + np.arange(n, dtype=float)}, index=time)).to_dfs(fp)
+    st = os.stat(fp)
+    os.utime(fp, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9)) # changed, also on a coarse clock
+
+
+@pytest.fixture
+def reads(monkeypatch):
+    # station files read by read_station_dfs0
+    read = tools._read_station_dfs0
+    files = []
+    def record(fp):
+        files.append(os.path.splitext(os.path.basename(fp))[0])
+        return read(fp)
+    monkeypatch.setattr(tools, '_read_station_dfs0', record)
+    return files
+
+
+def test_cache_reads_only_new_or_changed_files(tmp_path, reads):
+    for i, sid in enumerate(['W1', 'W2', 'W3']):
+        write_station(tmp_path / f'{sid}.dfs0', '2000-01-01', 4 + i, 10 * i)
+    pattern, cache = str(tmp_path / '*.dfs0'), str(tmp_path / 'stations.npz')
+    cold = tools.read_station_dfs0(pattern, cache=cache)
+    assert sorted(reads) == ['W1', 'W2', 'W3'] and len(cold) == 4 + 5 + 6
+    assert list(cold['StationID'].cat.categories) == ['W1', 'W2', 'W3']
+    np.testing.assert_array_equal(cold.loc[cold['StationID'] == 'W2', 'WTD'], 10 + np.arange(5.))
+
+    reads.clear()
+    pd.testing.assert_frame_equal(tools.read_station_dfs0(pattern, cache=cache), cold)
+    assert reads == []
+
+    # one changed, one removed, one new
+    write_station(tmp_path / 'W2.dfs0', '2001-01-01', 3, 100)
+    os.remove(tmp_path / 'W3.dfs0')
+    write_station(tmp_path / 'W4.dfs0', '2002-01-01', 2, 200)
+    reads.clear()
+    warm = tools.read_station_dfs0(pattern, cache=cache)
+    assert sorted(reads) == ['W2', 'W4']
+    reads.clear()
+    pd.testing.assert_frame_equal(warm, tools.read_station_dfs0(pattern))
+    assert list(warm['StationID'].cat.categories) == ['W1', 'W2', 'W4']
+    w2 = warm[warm['StationID'] == 'W2']
+    np.testing.assert_array_equal(w2['WTD'], [100., 101., 102.])
+    assert w2.index[0] == pd.Timestamp('2001-01-01')
+
+
+def test_cache_of_other_value_name_or_corrupt_is_read_again(tmp_path, reads):
+    write_station(tmp_path / 'W1.dfs0', '2000-01-01', 3, 0)
+    pattern, cache = str(tmp_path / '*.dfs0'), str(tmp_path / 'stations.npz')
+    tools.read_station_dfs0(pattern, cache=cache)
+    reads.clear()
+    assert 'H' in tools.read_station_dfs0(pattern, value_name='H', cache=cache).columns
+    assert reads == ['W1']
+    with open(cache, 'wb') as f:
+        f.write(b'not a npz file')
+    reads.clear()
+    assert len(tools.read_station_dfs0(pattern, value_name='H', cache=cache)) == 3
+    assert reads == ['W1']
@@ -0,0 +1,66 @@
+"""
+Streamed time means of dfs2 files (tools.time_aggregate) against a pandas
+groupby mean, and their sidecar cache, on a small synthetic grid.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import mikeio
+import tools
+
+
+@pytest.fixture
+def fp_dfs2(tmp_path):
+    rng = np.random.default_rng(0)
+    time = pd.date_range('2000-01-01', '2001-12-31', freq='D')
+    geometry = mikeio.Grid2D(x0=5, y0=5, dx=10, dy=10, nx=4, ny=3)
+    values = rng.random((len(time), 3, 4)) * 10
+    fp = str(tmp_path / 'ET.dfs2')
+    mikeio.DataArray(values, time=time, geometry=geometry, item=mikeio.ItemInfo('ET')).to_dfs(fp)
+    return fp
+
+
+def groupby_mean(fp, key, time1=None, time2=None):
+    da = mikeio.read(fp)['ET'].sel(time=slice(time1, time2))
+    df = pd.DataFrame(da.to_numpy().reshape(da.n_timesteps, -1), index=da.time)
+    return df.groupby(key(df.index)).mean()
+
+
+@pytest.mark.parametrize('by, key', [(None, lambda t: np.zeros(len(t), dtype=int)),
+                                     ('month', lambda t: t.month),
+                                     ('season', lambda t: np.array(tools.SEASONS)[t.month % 12 // 3]),
+                                     ('year', lambda t: t.year)])
+def test_time_aggregate_matches_groupby_mean(fp_dfs2, by, key):
+    expected = groupby_mean(fp_dfs2, key, '2000-03-10', '2001-08-20')
+    out = tools.time_aggregate(fp_dfs2, time1='2000-03-10', time2='2001-08-20', by=by, block=45, cache_dir=False)
+    out = {0: out} if by is None else out
+    assert sorted(out) == sorted(expected.index)
+    for group, row in expected.iterrows():
+        assert out[group].shape == (3, 4)
+        np.testing.assert_allclose(out[group].to_numpy().ravel(), row.to_numpy(), rtol=1e-6) # float32 file
+
+
+def test_cache_is_used_and_recomputed(fp_dfs2, tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / 'agg')
+    mean = tools.time_aggregate(fp_dfs2, by='season', cache_dir=cache_dir)
+    [fp_cache] = [os.path.join(cache_dir, f) for f in os.listdir(cache_dir)]
+    assert fp_cache.endswith('.npz') # no temporary file left
+    # from the cache: no blocks read
+    read = mikeio.read
+    monkeypatch.setattr(mikeio, 'read', lambda fp, *args, time=None, **kwargs:
+                        read(fp, *args, time=time, **kwargs) if isinstance(time, int) else pytest.fail('read again'))
+    cached = tools.time_aggregate(fp_dfs2, by='season', cache_dir=cache_dir)
+    monkeypatch.setattr(mikeio, 'read', read)
+    for season in tools.SEASONS:
+        np.testing.assert_array_equal(cached[season].to_numpy(), mean[season].to_numpy())
+    # a corrupt cache is computed again and replaced
+    with open(fp_cache, 'wb') as f:
+        f.write(b'not a npz file')
+    again = tools.time_aggregate(fp_dfs2, by='season', cache_dir=cache_dir)
+    np.testing.assert_array_equal(again['JJA'].to_numpy(), mean['JJA'].to_numpy())
+    with np.load(fp_cache) as npz:
+        np.testing.assert_array_equal(npz['mean'][2], mean['JJA'].to_numpy())
@@ -0,0 +1,107 @@
+"""
+ETV vegetation parser and daily vegetation grids (tools.parse_etv,
+tools.vegetation_lookup, tools.vegetation_grids) on a small synthetic .etv
+file of the layout of DK_2018_Veg_Prop_inv_100m.etv.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import mikeio
+import tools
+
+# vegetation name, parameter C1, stages (END_DAY, LAI, ROOT, Kc)
+VEGETATION = [('Crop', 0.3, [(0, 0.0, 100., 1.0), (100, 4.0, 800., 1.2), (250, 2.0, 500., 1.1), (366, 0.0, 100., 1.0)]),
+              ('lake', 0.1, [(0, 0.0, 10000., 1.2), (10000, 0.0, 10000., 1.2)])]
+CODES = {1: 'Crop', 2: 'lake'}
+
+
+def write_etv(fp, vegetation=VEGETATION):
+    lines = ['// Created     : 2019-01-21 14:32:50', '[ETVegProp]', '   FileVersion = 3', '   [VEGSETUP]',
+             f'      NO_VEG = {len(vegetation)}']
+    for iveg, (name, c1, stages) in enumerate(vegetation, start=1):
+        lines += [f'      [VegNo_{iveg}]', '         Touched = 1', f"         VEGNAME = '{name}'", f'         C1 = {c1}',
+                  '         [UserDefVegDevelopment]', f'            NO_ITEM = {len(stages)}']
+        for k, (_, lai, root, kc) in enumerate(stages, start=1):
+            lines += [f'            [Stage_{k}]', '               Touched = 1', f'               LAI = {lai}',
+                      f'               ROOT = {root:.7E}', f'               Kc = {kc}', f'            EndSect  // Stage_{k}', ' ']
+        # parameters of the growth model between the stage sections (not stages)
+        lines += ['         EndSect  // UserDefVegDevelopment', '         [GrowthModVegDevelopment]',
+                  '            LAI_DAMPING_D = 0.0', '            LAI_DAMPING_A = 0.0']
+        for k in range(1, len(stages) + 1):
+            lines += [f'            [Stage_{k}]', '               Ky = 0.5', f'            EndSect  // Stage_{k}']
+        lines += ['         EndSect  // GrowthModVegDevelopment']
+        for k, (end_day, *_) in enumerate(stages, start=1):
+            lines += [f'         [Stage_{k}]', "            STAGE_NAME = 'New Stage'", f'            END_DAY = {end_day}',
+                      f'         EndSect  // Stage_{k}']
+        lines += [f'      EndSect  // VegNo_{iveg}']
+    lines += ['   EndSect  // VEGSETUP', 'EndSect  // ETVegProp']
+    with open(fp, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return str(fp)
+
+
+def test_parse_etv_collects_all_stages_and_parameters(tmp_path):
+    stages, vegetation = tools.parse_etv(write_etv(tmp_path / 'veg.etv'))
+    assert list(vegetation.index) == ['Crop', 'lake']
+    assert vegetation.loc['Crop', 'VegNo'] == 1 and vegetation.loc['Crop', 'C1'] == 0.3
+    assert vegetation.loc['Crop', 'LAI_DAMPING_D'] == 0.0
+    assert list(stages.loc['Crop'].index) == [1, 2, 3, 4]
+    expected = pd.DataFrame(VEGETATION[0][2], columns=['END_DAY', 'LAI', 'ROOT', 'Kc'], index=[1, 2, 3, 4])
+    pd.testing.assert_frame_equal(stages.loc['Crop', ['END_DAY', 'LAI', 'ROOT', 'Kc']], expected, check_names=False,
+                                  check_dtype=False)
+    assert (stages['Ky'] == 0.5).all() and (stages['STAGE_NAME'] == 'New Stage').all()
+    # one row per stage: the growth model parameters are no LAI stages
+    lai = tools.read_plot_etv(str(tmp_path / 'veg.etv'), variable='LAI', plot=False)
+    assert lai['Crop']['Stage'].tolist() == [1, 2, 3, 4]
+    assert lai['Crop']['LAI'].tolist() == [0.0, 4.0, 2.0, 0.0]
+
+
+def test_parse_etv_cache_follows_file(tmp_path):
+    fp = write_etv(tmp_path / 'veg.etv')
+    stages, _ = tools.parse_etv(fp)
+    stages.loc[('Crop', 2), 'LAI'] = -1 # copies: the cached table is unchanged
+    assert tools.parse_etv(fp)[0].loc[('Crop', 2), 'LAI'] == 4.0
+    write_etv(fp, [('Crop', 0.3, [(0, 1.0, 100., 1.0), (366, 3.0, 100., 1.0)])])
+    assert tools.parse_etv(fp)[0].loc['Crop', 'LAI'].tolist() == [1.0, 3.0]
+
+
+@pytest.mark.parametrize('interp', ['linear', 'stage'])
+def test_vegetation_lookup_at_stage_end_days(tmp_path, interp):
+    stages, _ = tools.parse_etv(write_etv(tmp_path / 'veg.etv'))
+    for variable, column in [('LAI', 1), ('ROOT', 2), ('Kc', 3)]:
+        lut = tools.vegetation_lookup(stages, variable, CODES, interp=interp)
+        assert lut.shape == (367, 4)
+        for end_day, *values in VEGETATION[0][2]:
+            assert lut[end_day, 1] == pytest.approx(values[column - 1])
+        assert (lut[:, 2] == VEGETATION[1][2][0][column]).all()
+        assert np.isnan(lut[:, [0, 3]]).all()
+    lut = tools.vegetation_lookup(stages, 'LAI', CODES, interp=interp)
+    if interp == 'linear':
+        assert lut[50, 1] == pytest.approx(2.0) and lut[175, 1] == pytest.approx(3.0)
+    else:
+        # day in the stage ending on or after it
+        assert lut[1, 1] == 4.0 and lut[100, 1] == 4.0 and lut[101, 1] == 2.0 and lut[366, 1] == 0.0
+
+
+def test_vegetation_grids(tmp_path):
+    fp_etv = write_etv(tmp_path / 'veg.etv')
+    geometry = mikeio.Grid2D(nx=3, ny=2, dx=100., x0=50., y0=50.)
+    codes = np.array([[[1, 2, np.nan], [7, 1, 2]]])
+    mikeio.DataArray(codes, time=pd.DatetimeIndex(['2018-01-01']), geometry=geometry,
+                     item=mikeio.ItemInfo('2-Grass, ...')).to_dfs(tmp_path / 'landuse.dfs2')
+    fp = tools.vegetation_grids(str(tmp_path / 'landuse.dfs2'), fp_etv, str(tmp_path / 'veg.dfs2'),
+                                '2001-04-05', '2001-04-15', codes=CODES, block=4)
+    ds = mikeio.read(fp)
+    assert [item.name for item in ds.items] == ['LAI', 'ROOT', 'Kc']
+    assert ds['ROOT'].item.unit == mikeio.EUMUnit.millimeter
+    np.testing.assert_array_equal(ds.time, pd.date_range('2001-04-05', '2001-04-15', freq='D'))
+    lai = ds['LAI'].to_numpy()
+    # day of year 95-105, linear from 0 on day 0 to 4 on day 100 and to 2 on day 250
+    expected = np.interp(ds.time.dayofyear, [0, 100, 250], [0., 4., 2.])
+    np.testing.assert_allclose(lai[:, 0, 0], expected, rtol=1e-6)
+    np.testing.assert_allclose(lai[:, 1, 1], expected, rtol=1e-6)
+    assert (lai[:, 0, 1] == 0).all() and (ds['ROOT'].to_numpy()[:, 1, 2] == 10000).all()
+    # no code, or a code without vegetation: delete values
+    assert np.isnan(lai[:, 0, 2]).all() and np.isnan(lai[:, 1, 0]).all()
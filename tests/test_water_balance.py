@@ -0,0 +1,76 @@
+"""
+Water balance analytics (WaterBalance) on the output of the Water Balance Tool
+in output_sample/waterbalance_output: closure errors, period sums and the
+cache of the folder.
+"""
+
+import os, shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import mikeio
+import WaterBalance
+
+FOLDER = os.path.join(os.path.dirname(__file__), '..', 'output_sample', 'waterbalance_output')
+
+
+@pytest.fixture(scope='module')
+def wb():
+    return WaterBalance.load(FOLDER, use_cache=False)
+
+
+def read(name):
+    return mikeio.read(os.path.join(FOLDER, f'{name}.dfs0')).to_dataframe()
+
+
+def test_closure_against_the_balance_files(wb):
+    closure = wb.closure()
+    assert list(closure.columns.unique('balance')) == ['total', 'SZ', 'UZ']
+    comp = read('wb_component_error')
+    for balance, (name, comp_col) in WaterBalance.BALANCES.items():
+        df = read(name)
+        res = closure[balance]
+        np.testing.assert_allclose(res['residual'], df.drop(columns='Error').sum(axis=1), atol=1e-9)
+        np.testing.assert_allclose(res['error'], df['Error'])
+        np.testing.assert_allclose(res['component_error'], comp[comp_col])
+        # the Error item of a balance is its closure residual, up to the float32 precision of the files
+        np.testing.assert_allclose(res['difference'], res['residual'] - comp[comp_col])
+        assert np.abs(res['difference']).max() < 1e-3
+        inflow = -df.drop(columns='Error').clip(upper=0).sum(axis=1)
+        np.testing.assert_allclose(res['relative'][inflow > 0], (res['residual'] / inflow)[inflow > 0])
+    cumulative = wb.closure(cumulative=True)
+    np.testing.assert_allclose(cumulative[('total', 'residual')], closure[('total', 'residual')].cumsum())
+
+
+@pytest.mark.parametrize('freq', ['month', 'year', 'hydro_year', None])
+def test_period_sums_against_groupby(wb, freq):
+    df = read('wb_incremental')
+    sums = wb.period_sums('wb_incremental', freq)
+    if freq is None:
+        expected = df.sum().to_frame('total').T
+    else:
+        labels = {'month': df.index.to_period('M'), 'year': df.index.year,
+                  'hydro_year': df.index.year + (df.index.month >= 10)}[freq]
+        expected = df.groupby(labels).sum()
+    assert list(sums.index) == list(expected.index)
+    np.testing.assert_allclose(sums.to_numpy(), expected.to_numpy(), rtol=1e-9, atol=1e-9)
+
+
+def test_period_sums_of_accumulated_file(wb):
+    # increments of the accumulated balance: the sum over all timesteps is the last accumulated value
+    acc = read('wb_accumulated')
+    np.testing.assert_allclose(wb.period_sums('wb_accumulated', None).iloc[0], acc.iloc[-1], rtol=1e-5, atol=1e-3)
+    with pytest.raises(ValueError):
+        wb.period_sums('wb_incremental', 'week')
+
+
+def test_load_from_cache(wb, tmp_path):
+    folder = shutil.copytree(FOLDER, tmp_path / 'wb')
+    WaterBalance.load(folder)
+    assert os.path.exists(folder / WaterBalance.WB_CACHE_FILE)
+    WaterBalance._loaded.clear() # from the file, not from memory
+    cached = WaterBalance.load(folder)
+    assert cached.names == wb.names
+    pd.testing.assert_frame_equal(cached.frame('wb_incremental'), wb.frame('wb_incremental'))
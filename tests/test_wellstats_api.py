@@ -0,0 +1,54 @@
+"""
+WellStats library API (class WellStats) on the synthetic case of
+WellStatsBenchmark: configuration from xml or dictionary, results returned as
+DataFrames and the same as the text files of the command line.
+"""
+
+import os, shutil, subprocess, sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import WellStats
+import WellStatsBenchmark
+
+
+@pytest.mark.parametrize('mode', ['head', 'dtp'])
+def test_run_matches_command_line_output(ws_case, tmp_path, mode):
+    fp_case = shutil.copytree(ws_case, tmp_path / 'case')
+    fp_config = WellStatsBenchmark.write_config(fp_case, mode)
+    ws = WellStats.WellStats(fp_config)
+    out_obs, out_well, out_lay, out_warn = ws.run()
+    assert (out_lay is None) == (mode != 'head')
+    # same as the command line, which writes next to the observation file
+    subprocess.run([sys.executable, os.path.join(os.path.dirname(WellStats.__file__), 'WellStats.py'), fp_config],
+                   check=True, capture_output=True)
+    stump = os.path.join(fp_case, f'obs_{mode}')
+    obs = pd.read_csv(f'{stump}_observations.csv', sep='\t', index_col=0)
+    np.testing.assert_allclose(obs['sim_intp'], out_obs['sim_intp'], rtol=1e-6)
+    np.testing.assert_allclose(obs['err'], out_obs['err'], rtol=1e-6, atol=1e-6)
+    well = pd.read_csv(f'{stump}_wells.csv', sep='\t', index_col=0)
+    np.testing.assert_allclose(well['MSE'], out_well['MSE'], rtol=1e-6)
+    with open(f'{stump}_warnings.csv') as f:
+        assert f.read().splitlines() == out_warn
+    # write() of the library gives the same files
+    ws.write(str(tmp_path / 'lib'), '.txt')
+    obs_lib = pd.read_csv(tmp_path / 'lib_observations.txt', sep='\t', index_col=0)
+    pd.testing.assert_frame_equal(obs_lib, obs)
+
+
+def test_config_dictionary_and_summary(ws_case, ws_config):
+    conf = ws_config('head')
+    ws = WellStats.WellStats(conf)
+    with pytest.raises(ValueError):
+        ws.summary()
+    out_obs, out_well, out_lay, _ = ws.run()
+    # relative paths of a dictionary refer to base_dir
+    rel = dict(conf, PreProcessedDFS2='PP.dfs2', PreProcessedDFS3='PP3.dfs3', ResultFile='R3.dfs3')
+    pd.testing.assert_frame_equal(WellStats.WellStats(rel, base_dir=ws_case).run()[0], out_obs)
+    summary = ws.summary()
+    assert list(summary.index) == ['all'] + list(out_lay.index)
+    np.testing.assert_allclose(summary.loc['all', 'RMSE_obs'], np.sqrt(out_obs['err2'].mean()))
+    np.testing.assert_allclose(summary.loc['all', 'ME_wells'], out_well['ME'].mean())
+    assert summary.loc['all', 'nobs'] == len(out_obs)
@@ -0,0 +1,48 @@
+"""
+Batch runs of WellStats (run_batch) against single runs of the library API,
+on the synthetic case of WellStatsBenchmark.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import mikeio
+import WellStats
+
+
+@pytest.fixture
+def result_files(ws_config, tmp_path):
+    # the head result of the case, and one with heads 1 m higher, in folders of their own
+    ds = mikeio.read(ws_config('head')['ResultFile'])
+    fps = []
+    for name, shift in [('run1', 0.), ('run2', 1.)]:
+        os.makedirs(tmp_path / name)
+        (ds + shift).to_dfs(tmp_path / name / 'R3.dfs3')
+        fps.append(str(tmp_path / name / 'R3.dfs3'))
+    return fps
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_batch_matches_single_runs(ws_config, result_files, workers):
+    ws = WellStats.WellStats(ws_config('head', Groupings='season'))
+    out_sum = WellStats.run_batch(ws.static, result_files, workers=workers)
+    fp_obs = ws.conf['ObservationFile']
+    summary = pd.read_csv(f'{os.path.splitext(fp_obs)[0]}_batch_summary.csv', sep='\t', index_col=[0, 1])
+    assert list(summary.index) == [(fp, str(layer)) for fp, layer in out_sum.index]
+    np.testing.assert_allclose(summary.to_numpy(float), out_sum.to_numpy(float))
+    for fp_res in result_files:
+        out_obs, out_well, out_lay, _ = ws.run(fp_res)
+        pd.testing.assert_frame_equal(out_sum.loc[fp_res], ws.summary(), check_index_type=False, check_names=False)
+        # output next to the result file, named after observation and result file
+        stump = os.path.join(os.path.dirname(fp_res), 'obs_R3')
+        obs = pd.read_csv(f'{stump}_observations.csv', sep='\t', index_col=0)
+        np.testing.assert_allclose(obs['sim_intp'], out_obs['sim_intp'])
+        lay = pd.read_csv(f'{stump}_layers.csv', sep='\t', index_col=0)
+        np.testing.assert_allclose(lay['RMSE_obs'], out_lay['RMSE_obs'])
+        assert os.path.exists(f'{stump}_season.csv')
+    # heads 1 m higher: mean error 1 m lower
+    np.testing.assert_allclose(out_sum.loc[(result_files[1], 'all'), 'ME_obs'],
+                               out_sum.loc[(result_files[0], 'all'), 'ME_obs'] - 1, rtol=1e-5)
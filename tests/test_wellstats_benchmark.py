@@ -0,0 +1,35 @@
+"""
+Synthetic WellStats benchmark (WellStatsBenchmark) on a tiny case matrix.
+"""
+
+import json, os
+
+import numpy as np
+import pandas as pd
+
+import mikeio
+import WellStatsBenchmark
+
+
+def test_make_case(tmp_path):
+    WellStatsBenchmark.make_case(str(tmp_path), nx=6, nz=3, nt=10, nwells=8, dry=0.5)
+    head = mikeio.read(tmp_path / 'R3.dfs3')[0]
+    ll = mikeio.read(tmp_path / 'PP3.dfs3', items='Lower level of computational layers in the saturated zone')[0]
+    assert head.shape == (10, 3, 6, 6) and head.geometry.nx == ll.geometry.nx
+    # dry cells: the upper layers below their bottoms
+    below = head.to_numpy()[0, 2] < ll.to_numpy()[0, 2]
+    assert below.any() and not below.all()
+    obs = pd.read_csv(tmp_path / 'obs.csv', sep='\t', index_col=0)
+    assert obs.index.nunique() == 8 and set(obs.columns) >= {'XUTM', 'YUTM', 'DEPTH', 'PEJL', 'WTDEPTH', 'DATO'}
+
+
+def test_run_benchmark(tmp_path):
+    out = WellStatsBenchmark.run_benchmark([6], [3], [10], [5], [0.3], ['head', 'dtp'], str(tmp_path))
+    assert list(out['mode']) == ['head', 'dtp']
+    assert (out['wall_s'] > 0).all() and out['STEP 3 extraction [s]'].notna().all()
+    with open(tmp_path / 'benchmark.json') as f:
+        runs = json.load(f)['runs']
+    assert [run['case'] for run in runs] == ['nx6_nz3_nt10_w5_dry0.3'] * 2
+    np.testing.assert_array_equal(pd.read_csv(tmp_path / 'benchmark.csv')['nobs'], out['nobs'])
+    # synthetic data deleted unless --keep
+    assert sorted(os.listdir(tmp_path)) == ['benchmark.csv', 'benchmark.json']
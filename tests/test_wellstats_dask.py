@@ -0,0 +1,26 @@
+"""
+Dask backend of WellStats (Dask section of the configuration) against the
+default extraction, on the synthetic case of WellStatsBenchmark.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import WellStats
+
+dask = pytest.importorskip('dask')
+
+
+@pytest.mark.parametrize('mode', ['head', 'dtp'])
+@pytest.mark.parametrize('scheduler', ['processes', 'distributed'])
+def test_dask_matches_default(ws_config, mode, scheduler):
+    if scheduler == 'distributed':
+        pytest.importorskip('dask.distributed')
+    out_obs = WellStats.WellStats(ws_config(mode)).run()[0]
+    conf = ws_config(mode, Dask={'Workers': 2, 'TimeChunkSize': 7, 'Scheduler': scheduler})
+    out_dask = WellStats.WellStats(conf).run()[0]
+    for col in ['sim_cell', 'sim_intp', 'err']:
+        np.testing.assert_allclose(out_dask[col], out_obs[col], rtol=1e-6, atol=1e-6)
+    assert (out_dask['dry'].fillna('') == out_obs['dry'].fillna('')).all()
+    pd.testing.assert_index_equal(out_dask.index, out_obs.index)
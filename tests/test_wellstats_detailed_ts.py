@@ -0,0 +1,61 @@
+"""
+WellStats with a detailed time series file (DetailedTSFile) against sampling
+the result file, on the synthetic case of WellStatsBenchmark.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import mikeio
+from mikeio import ItemInfo, EUMType
+import WellStats
+
+
+@pytest.fixture
+def head_run(ws_config, tmp_path):
+    # result file run, and a detailed time series file with the heads of the cell and layer of every well
+    ws = WellStats.WellStats(ws_config('head'))
+    out_grid = ws.run()
+    res = mikeio.read(ws.conf['ResultFile'])
+    head = res[0].to_numpy()
+    wells = ws.static['out_well']
+    items = [mikeio.DataArray(head[:, w.layer, w.iy, w.ix], time=res.time, item=ItemInfo(wid, EUMType.Elevation))
+             for wid, w in wells.iterrows()]
+    # one well as discharge: not a head, sampled from the result file
+    items[0] = mikeio.DataArray(items[0].to_numpy(), time=res.time, item=ItemInfo(wells.index[0], EUMType.Discharge))
+    fp_dts = str(tmp_path / 'DetailedTS_SZ.dfs0')
+    mikeio.Dataset(items).to_dfs(fp_dts)
+    return ws, out_grid, fp_dts, pd.Series(list(head[:, wells['layer'], wells['iy'], wells['ix']].T), index=wells.index), res.time
+
+
+def test_detailed_ts_heads_match_result_file_cells(head_run):
+    ws, out_grid, fp_dts, series, time = head_run
+    obs_grid = out_grid[0]
+    obs_dts, well_dts, _, warn_dts = ws.run(ws.conf['ResultFile'], fp_dts)
+    first = obs_dts.index == series.index[0]
+    np.testing.assert_array_equal(obs_dts['sim_source'], np.where(first, 'ResultFile', 'DetailedTS'))
+    assert any('not a head elevation' in w for w in warn_dts)
+    # well of the discharge item: as from the result file
+    np.testing.assert_array_equal(obs_dts.loc[first, 'sim_intp'], obs_grid.loc[first, 'sim_intp'])
+    # nearest timestep of the well's cell: same as the result file, unless its layer is dry there
+    wet = ~first & obs_grid['dry'].isna().values
+    assert wet.sum() > 0 and (~first & ~wet).sum() > 0
+    np.testing.assert_allclose(obs_dts.loc[wet, 'sim_cell'], obs_grid.loc[wet, 'sim_cell'])
+    assert obs_dts.loc[~first, 'dry'].isna().all()
+    # linear in time at the well's cell (no interpolation in x/y), constant beyond the ends
+    t = time.asi8.astype(float)
+    expected = [np.interp(pd.Timestamp(d).value, t, series[wid]) for wid, d in zip(obs_dts.index[~first], obs_dts['dato'][~first])]
+    np.testing.assert_allclose(obs_dts.loc[~first, 'sim_intp'], expected, rtol=1e-6)
+
+
+def test_detailed_ts_ignored_for_phreatic_statistics(head_run, ws_config):
+    _, _, fp_dts, _, _ = head_run
+    ws = WellStats.WellStats(ws_config('dtp'))
+    obs_res = ws.run()[0]
+    obs_dts, _, _, warn_dts = ws.run(ws.conf['ResultFile'], fp_dts)
+    assert (obs_dts['sim_source'] == 'ResultFile').all()
+    assert any(os.path.basename(fp_dts) in w and 'ignored' in w for w in warn_dts)
+    pd.testing.assert_frame_equal(obs_dts.drop(columns='sim_source'), obs_res)
@@ -0,0 +1,55 @@
+"""
+Grouped statistics of WellStats (group_labels, group_stats, group_tables)
+against a plain pandas groupby of the observations, on the synthetic case of
+WellStatsBenchmark.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import WellStats
+
+
+def groupby_stats(out_obs, keys):
+    # statistics of the observations with a simulated value, per group; over wells from ME/MSE per group and well
+    obs = out_obs[out_obs['err'].notna()].assign(well=lambda df: df.index)
+    per_well = obs.groupby(keys + ['well'])['err'].agg(me='mean', mse=lambda e: (e**2).mean())
+    return pd.DataFrame({'RMSE_wells': np.sqrt(per_well.groupby(keys)['mse'].mean()),
+                         'RMSE_obs': np.sqrt((obs['err']**2).groupby([obs[k] for k in keys]).mean()),
+                         'ME_wells': per_well.groupby(keys)['me'].mean(),
+                         'ME_obs': obs.groupby(keys)['err'].mean()})
+
+
+@pytest.fixture
+def run(ws_config):
+    ws = WellStats.WellStats(ws_config('head', Groupings='layer,season,depth,layer+year', DepthClasses='10,30'))
+    out_obs = ws.run()[0]
+    obs = out_obs.assign(Season=np.array(['DJF', 'MAM', 'JJA', 'SON'])[out_obs['dato'].dt.month % 12 // 3],
+                         Year=out_obs['dato'].dt.year, Layer=out_obs['layer'],
+                         DepthClass=pd.cut(out_obs['depth'], [-np.inf, 10, 30, np.inf], right=False,
+                                           labels=['<10', '10-30', '>30']).astype(str))
+    return ws, obs
+
+
+@pytest.mark.parametrize('grouping, keys', [('season', ['Season']), ('depth', ['DepthClass']),
+                                            ('layer+year', ['Layer', 'Year'])])
+def test_grouped_statistics_match_groupby(run, grouping, keys):
+    ws, obs = run
+    table = ws.groups[grouping]
+    expected = groupby_stats(obs, keys)
+    got = table.loc[expected.index, expected.columns]
+    np.testing.assert_allclose(got.to_numpy(float), expected.to_numpy(float), rtol=1e-10)
+    nobs = obs.groupby(keys).size()
+    np.testing.assert_array_equal(table.loc[nobs.index, 'nobs'], nobs)
+    nwells = obs.assign(well=obs.index).groupby(keys)['well'].nunique()
+    np.testing.assert_array_equal(table.loc[nwells.index, 'nwells'], nwells)
+
+
+def test_layer_grouping_is_layer_table(run):
+    ws, _ = run
+    out_lay = ws.result[2]
+    # all layers and seasons, also empty ones
+    assert list(ws.groups['layer'].index) == list(out_lay.index) == list(range(1, ws.static['itop'] + 2))
+    assert list(ws.groups['season'].index) == ['DJF', 'MAM', 'JJA', 'SON']
+    pd.testing.assert_frame_equal(ws.groups['layer'], out_lay, check_names=False)
@@ -0,0 +1,44 @@
+"""
+Incremental WellStats (run_incremental) against a full run after observations
+were appended, changed and removed, on the synthetic case of
+WellStatsBenchmark.
+"""
+
+import numpy as np
+import pandas as pd
+
+import WellStats
+
+
+def test_incremental_matches_full_run(ws_config, capsys):
+    conf = ws_config('head', Incremental=True)
+    fp_obs = conf['ObservationFile']
+    obs = pd.read_csv(fp_obs, sep='\t', index_col=0, dtype={'DATO': str})
+    # first run on two thirds of the observations (writes the state)
+    obs.iloc[:len(obs) * 2 // 3].to_csv(fp_obs, sep='\t')
+    WellStats.WellStats(conf).run()
+    assert 'No valid incremental state' in capsys.readouterr().out
+    # then: the other observations appended, two changed and one removed
+    obs.iloc[[3, 10], obs.columns.get_loc('PEJL')] += 1.5
+    obs.iloc[np.r_[0:5, 6:len(obs)]].to_csv(fp_obs, sep='\t')
+    obs_inc, well_inc, lay_inc, warn_inc = WellStats.WellStats(conf).run()
+    assert 'Incremental:' in capsys.readouterr().out
+    obs_full, well_full, lay_full, warn_full = WellStats.WellStats(dict(conf, Incremental=False)).run()
+
+    pd.testing.assert_frame_equal(obs_inc.drop(columns='dry'), obs_full.drop(columns='dry'))
+    assert (obs_inc['dry'].fillna('') == obs_full['dry'].fillna('')).all()
+    for col in ['sim_mean', 'ME', 'MSE']:
+        np.testing.assert_allclose(well_inc[col], well_full[col], rtol=1e-9, atol=1e-12)
+    np.testing.assert_allclose(lay_inc.to_numpy(float), lay_full.to_numpy(float), rtol=1e-9)
+    assert warn_inc == warn_full
+
+
+def test_incremental_state_unchanged_and_invalidated(ws_config, capsys):
+    conf = ws_config('head', Incremental=True)
+    WellStats.WellStats(conf).run()
+    ws = WellStats.WellStats(conf)
+    ws.run()
+    assert 'Incremental: 0 new or changed observations, 0 removed' in capsys.readouterr().out
+    # other EpsilonForPhreatic: all observations extracted again
+    WellStats.WellStats(dict(conf, EpsilonForPhreatic=0.5)).run()
+    assert 'No valid incremental state' in capsys.readouterr().out
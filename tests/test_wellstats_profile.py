@@ -0,0 +1,56 @@
+"""
+Profiling of WellStats (Profiler, profile=True) on the synthetic case of
+WellStatsBenchmark: one profile per instance and run, and the profiles of a
+batch.
+"""
+
+import json, os, shutil, tracemalloc
+
+import pytest
+
+import WellStats
+
+
+@pytest.fixture(autouse=True)
+def stop_tracing():
+    yield
+    tracemalloc.stop()
+
+
+def stages(prof):
+    return {st['stage']: st for st in prof.stages.values()}
+
+
+def test_profile_per_instance_and_run(ws_config):
+    conf = ws_config('head')
+    ws1 = WellStats.WellStats(conf, profile=True)
+    ws2 = WellStats.WellStats(conf, profile=True)
+    for _ in range(2):
+        for ws in [ws1, ws2]:
+            ws.run()
+            st = stages(ws.profiler)
+            assert st['STEP 1 load']['calls'] == 1 and st['STEP 3 extraction']['calls'] == 1
+    # the module's profiler records nothing outside a run
+    assert not WellStats.profiler.enabled and WellStats.profiler.stages == {}
+
+
+def test_batch_profiles(ws_config, tmp_path, monkeypatch):
+    conf = ws_config('head')
+    fps = []
+    for name in ['run1', 'run2']:
+        os.makedirs(tmp_path / name)
+        fps.append(shutil.copy(conf['ResultFile'], tmp_path / name / 'R3.dfs3'))
+    ws = WellStats.WellStats(conf, profile=True)
+    WellStats.run_batch(ws.static, fps, prof=ws.profiler)
+    # loading (STEP 1-2) next to the batch summary, extraction per result file
+    with open(tmp_path / 'obs_batch_profile.json') as f:
+        names = [st['stage'] for st in json.load(f)['stages']]
+    assert 'STEP 1 load' in names and 'STEP 3 extraction' not in names
+    for fp in fps:
+        with open(os.path.join(os.path.dirname(fp), 'obs_R3_profile.json')) as f:
+            st = {st['stage']: st for st in json.load(f)['stages']}
+        assert st['STEP 3 extraction']['calls'] == 1 and 'STEP 1 load' not in st
+    # a batch item also runs outside a worker process
+    monkeypatch.setattr(WellStats, '_static', ws.static)
+    summary = WellStats._run_batch_item(fps[0], str(tmp_path / 'item'))
+    assert summary.loc['all', 'nobs'] == len(ws.static['out_obs'])
@@ -0,0 +1,79 @@
+"""
+Sampling of simulated heads at observations in WellStats (point index,
+interpolation and dry layer descent) on small synthetic grids.
+"""
+
+import numpy as np
+import pandas as pd
+
+import WellStats
+
+
+def descent_loop(col, layer, z_bottoms, eps):
+    # dry layer descent one observation and layer at a time, as the original
+    # WellStats loop: go down while the layer is dry (saturated thickness < eps
+    # and layer below unsaturated by > eps), at most to below the lowest layer
+    n = len(layer)
+    iz = np.zeros(n, dtype=int)
+    label = np.full(n, pd.NA, dtype=object)
+    for i in range(n):
+        k = 0
+        while layer[i] - k >= 0:
+            lz = layer[i] - k
+            below = col[i, max(lz - 1, 0)]
+            if not (col[i, lz] < z_bottoms[i, lz] + eps and below < z_bottoms[i, lz] - eps):
+                break
+            k += 1
+        iz[i] = max(layer[i] - k, 0)
+        if k > 0:
+            label[i] = f'Layer dry - {k} below'
+    return iz, label
+
+
+def observations(x, y, dato):
+    return pd.DataFrame({'x': np.asarray(x, dtype=float), 'y': np.asarray(y, dtype=float),
+                         'dato': pd.to_datetime(dato)})
+
+
+def test_point_index_interpolation_is_exact_for_linear_field():
+    xgrid = np.arange(5) * 100. + 50
+    ygrid = np.arange(4) * 100. + 50
+    time = pd.date_range('2000-01-01', periods=6, freq='D')
+    t = np.arange(len(time), dtype=float)
+    data = (2 * xgrid[None, None, :] - 3 * ygrid[None, :, None] + 10 * t[:, None, None])
+    obs = observations([75, 120, 410], [60, 333, 140],
+                       ['2000-01-02 12:00', '2000-01-04 00:00', '2000-01-05 06:00'])
+    idx = WellStats.point_index(xgrid, ygrid, pd.Series(time), np.arange(len(time)), obs)
+    t_obs = (obs['dato'] - time[0]).dt.total_seconds().to_numpy() / 86400
+    expected = 2 * obs['x'].to_numpy() - 3 * obs['y'].to_numpy() + 10 * t_obs
+    np.testing.assert_allclose(WellStats.gather_intp(data, idx), expected)
+    # outside the grid: NaN, as xarray's .interp()
+    idx = WellStats.point_index(xgrid, ygrid, pd.Series(time), np.arange(len(time)),
+                                observations([10], [60], ['2000-01-02']))
+    assert np.isnan(WellStats.gather_intp(data, idx)[0])
+
+
+def test_dry_layer_descent_matches_loop():
+    rng = np.random.default_rng(1)
+    nt, nz, ny, nx, n = 3, 4, 5, 6, 400
+    xgrid = np.arange(nx) * 100. + 50
+    ygrid = np.arange(ny) * 100. + 50
+    time = pd.date_range('2000-01-01', periods=nt, freq='D')
+    bottoms = np.array([0., 10., 20., 30.]) # layer 0: lowest
+    # heads around the layer bottoms, so that many layers are (nearly) dry
+    data = bottoms[rng.integers(0, nz, (nt, nz, ny, nx))] + rng.choice([-0.05, -0.01, 0.01, 0.05, 5.], (nt, nz, ny, nx))
+    obs = observations(rng.choice(xgrid, n), rng.choice(ygrid, n), rng.choice(time, n))
+    idx = WellStats.point_index(xgrid, ygrid, pd.Series(time), np.arange(nt), obs)
+    layer = rng.integers(0, nz, n)
+    z_bottoms = np.tile(bottoms, (n, 1))
+    eps = 0.02
+
+    sim_cell, sim_intp, dry = WellStats.sample_head(data, idx, layer, z_bottoms, eps)
+
+    col = data[idx['it'], :, idx['iy'], idx['ix']]
+    iz, label = descent_loop(col, layer, z_bottoms, eps)
+    assert (iz != layer).any() and (iz == layer).any()
+    np.testing.assert_array_equal(sim_cell, col[np.arange(n), iz])
+    # observations at cell centres and timesteps: interpolation gives the cell value
+    np.testing.assert_allclose(sim_intp, sim_cell)
+    assert [None if pd.isna(v) else v for v in dry] == [None if pd.isna(v) else v for v in label]
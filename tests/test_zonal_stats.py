@@ -0,0 +1,68 @@
+"""
+Zonal statistics of gridded output (tools.zone_coverage, tools.zonal_stats) on
+small synthetic grids, against a plain groupby over the cells.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import mikeio
+import shapely
+import tools
+
+
+@pytest.fixture
+def dfs2(tmp_path):
+    # 6 x 4 cells of 10 m, lower left corner at (0, 0), 4 daily timesteps with some missing values
+    rng = np.random.default_rng(0)
+    geometry = mikeio.Grid2D(x0=5, y0=5, dx=10, dy=10, nx=6, ny=4)
+    time = pd.date_range('2000-01-01', periods=4, freq='D')
+    values = rng.random((len(time), 4, 6)).astype(np.float32)
+    values[1, 0, :2] = np.nan
+    fp = tmp_path / 'grid.dfs2'
+    mikeio.DataArray(values, time=time, geometry=geometry, item=mikeio.ItemInfo('ET')).to_dfs(fp)
+    return str(fp), geometry, values.astype(float)
+
+
+def test_zonal_stats_match_groupby_of_cells(dfs2, tmp_path):
+    fp, geometry, values = dfs2
+    # zones along cell edges: left (x < 20), right upper (x > 20, y > 20)
+    zones = [shapely.box(0, 0, 20, 40), shapely.box(20, 20, 60, 40)]
+    zone = np.full((4, 6), -1)
+    zone[:, :2] = 0
+    zone[2:, 2:] = 1
+    df = tools.zonal_stats(fp, zones, names=['left', 'upper right'], stats=('mean', 'sum', 'min', 'max', 'p50'),
+                           block=3, dfs0_filename=str(tmp_path / 'zones.dfs0'))
+    cells = pd.DataFrame(values.reshape(len(values), -1).T, columns=df.index)
+    cells['zone'] = zone.ravel()
+    grouped = cells[cells['zone'] >= 0].groupby('zone')
+    for iz, name in enumerate(['left', 'upper right']):
+        for stat, expected in [('mean', grouped.mean()), ('sum', grouped.sum()), ('min', grouped.min()),
+                               ('max', grouped.max()), ('p50', grouped.median())]:
+            np.testing.assert_allclose(df[(name, stat)].to_numpy(), expected.loc[iz].to_numpy(), rtol=1e-6,
+                                       err_msg=f'{name} {stat}')
+    dfs0 = mikeio.read(tmp_path / 'zones.dfs0').to_dataframe()
+    np.testing.assert_allclose(dfs0['left mean'].to_numpy(), df[('left', 'mean')].to_numpy(), rtol=1e-6)
+
+
+def test_zone_coverage_of_partly_covered_cells(dfs2):
+    _, geometry, _ = dfs2
+    # half of the cells of the second column, all of the first
+    coverage, names = tools.zone_coverage([shapely.box(0, 0, 15, 40)], geometry, supersample=4)
+    frac = coverage.toarray().reshape(4, 6)
+    np.testing.assert_allclose(frac[:, 0], 1)
+    np.testing.assert_allclose(frac[:, 1], 0.5)
+    assert (frac[:, 2:] == 0).all() and names == [0]
+
+
+def test_zonal_mean_weights_partly_covered_cells(dfs2):
+    fp, _, values = dfs2
+    df = tools.zonal_stats(fp, shapely.box(0, 0, 15, 10), stats=('mean', 'sum'), supersample=4)
+    # first row: full first cell, half of the second
+    expected_sum = values[:, 0, 0] + 0.5 * values[:, 0, 1]
+    expected_mean = expected_sum / 1.5
+    # day 2: both cells missing
+    assert np.isnan(df[(0, 'mean')].iloc[1])
+    np.testing.assert_allclose(df[(0, 'mean')].to_numpy()[[0, 2, 3]], expected_mean[[0, 2, 3]])
+    np.testing.assert_allclose(df[(0, 'sum')].to_numpy()[[0, 2, 3]], expected_sum[[0, 2, 3]])